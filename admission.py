@@ -0,0 +1,233 @@
+"""Admission control and load shedding for the API
+
+Every request is put in a priority class by endpoint:
+
+    critical  tracking reads, health checks, the UI
+    standard  listings, search, dashboards
+    bulk      writes (geocoding, SES/SNS, S3 uploads)
+
+and must pass, in order:
+
+1. a per-client token bucket for its class (429 + Retry-After when empty);
+2. a per-route concurrency limit (503 + Retry-After when full);
+3. a shared in-flight budget where lower classes may only use part of the
+   slots, so tracking reads still get through while writes pile up.
+
+Token buckets live in process; set RATE_LIMIT_REDIS_URL to keep them in
+Redis so limits hold across workers. Concurrency limits are per worker.
+"""
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from flask import request, jsonify, g
+import auth
+import metrics
+
+ADMISSION_CONTROL = os.getenv('ADMISSION_CONTROL', '1') == '1'
+ADMISSION_MAX_IN_FLIGHT = int(os.getenv('ADMISSION_MAX_IN_FLIGHT', '64'))
+RATE_LIMIT_REDIS_URL = os.getenv('RATE_LIMIT_REDIS_URL', '')
+# Honour X-Forwarded-For when running behind a load balancer
+ADMISSION_TRUST_PROXY = os.getenv('ADMISSION_TRUST_PROXY', '0') == '1'
+
+# rate: tokens/second per client, burst: bucket size,
+# share: fraction of the in-flight budget the class may occupy
+PRIORITY_CLASSES = {
+    'critical': {'rate': 50.0, 'burst': 100, 'share': 1.0},
+    'standard': {'rate': 20.0, 'burst': 40, 'share': 0.8},
+    'bulk': {'rate': 5.0, 'burst': 20, 'share': 0.5},
+}
+
+ROUTE_CLASSES = {
+    'track_package': 'critical',
+    'get_package_by_id': 'critical',
+    'health': 'critical',
+    'metrics': 'critical',
+    'index': 'critical',
+    'serve_static': 'critical',
+    'register': 'bulk',
+    'create_package': 'bulk',
+    'update_status': 'bulk',
+    'accept_delivery': 'bulk',
+    'upload_package_file': 'bulk',
+    'update_package': 'bulk',
+    'delete_package': 'bulk',
+}
+
+# Concurrent requests per route and worker; unlisted routes are only bound
+# by the in-flight budget
+ROUTE_CONCURRENCY = {
+    'create_package': 16,
+    'update_package': 8,
+    'upload_package_file': 4,
+    'dashboard_stats': 4,
+    'analytics_timeseries': 2,
+    'search': 8,
+    'eta_batch': 8,
+    'dispatch_waves': 2,
+}
+
+MAX_TRACKED_CLIENTS = 100000
+
+
+class LocalTokenBuckets:
+    """In-process token buckets keyed by (class, client), LRU-bounded"""
+    
+    def __init__(self, max_clients=MAX_TRACKED_CLIENTS):
+        self.max_clients = max_clients
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def take(self, key, rate, burst):
+        """Take one token; returns 0 if admitted, else seconds until a token is available"""
+        now = time.monotonic()
+        with self._lock:
+            tokens, stamp = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - stamp) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+class RedisTokenBuckets:
+    """Token buckets in Redis, shared by every worker"""
+    
+    SCRIPT = '''
+        local rate = tonumber(ARGV[1])
+        local burst = tonumber(ARGV[2])
+        local now = tonumber(ARGV[3])
+        local data = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+        local tokens = tonumber(data[1]) or burst
+        local ts = tonumber(data[2]) or now
+        tokens = math.min(burst, tokens + math.max(0, now - ts) * rate)
+        local wait = 0
+        if tokens >= 1 then tokens = tokens - 1 else wait = (1 - tokens) / rate end
+        redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+        redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+        return tostring(wait)
+    '''
+    
+    def __init__(self, url):
+        try:
+            import redis
+        except ImportError:
+            raise ImportError("redis is required for RATE_LIMIT_REDIS_URL. Install with: pip install redis")
+        self.client = redis.Redis.from_url(url, socket_timeout=0.05)
+        self.script = self.client.register_script(self.SCRIPT)
+    
+    def take(self, key, rate, burst):
+        try:
+            return float(self.script(keys=[f"ratelimit:{key}"], args=[rate, burst, time.time()]))
+        except Exception as e:
+            # Fail open: an unavailable limiter must not take the API down
+            print(f"Rate limiter error: {e}")
+            return 0.0
+
+
+class ConcurrencyLimiter:
+    """Non-blocking per-route slots plus a class-aware in-flight budget"""
+    
+    def __init__(self, max_in_flight=ADMISSION_MAX_IN_FLIGHT):
+        self.max_in_flight = max_in_flight
+        self.in_flight = 0
+        self.routes = {}
+        self._lock = threading.Lock()
+    
+    def acquire(self, route, priority):
+        """Reserve a slot; returns False if the route or the class budget is full"""
+        limit = ROUTE_CONCURRENCY.get(route)
+        budget = max(1, int(self.max_in_flight * PRIORITY_CLASSES[priority]['share']))
+        with self._lock:
+            if self.in_flight >= budget:
+                return False
+            if limit is not None and self.routes.get(route, 0) >= limit:
+                return False
+            self.in_flight += 1
+            self.routes[route] = self.routes.get(route, 0) + 1
+            return True
+    
+    def release(self, route):
+        with self._lock:
+            self.in_flight -= 1
+            self.routes[route] -= 1
+
+
+buckets = RedisTokenBuckets(RATE_LIMIT_REDIS_URL) if RATE_LIMIT_REDIS_URL else LocalTokenBuckets()
+limiter = ConcurrencyLimiter()
+
+SHED = metrics.counter('admission_rejected', 'Requests shed by admission control', ('priority', 'reason'))
+metrics.callback('admission_in_flight', 'Admitted requests in flight, by route',
+                 lambda: {(route,): n for route, n in list(limiter.routes.items())}, ('route',))
+
+
+def client_key(authorization, forwarded_for, remote_addr):
+    """Identify the caller: the verified user, else the client address
+    
+    Missing or invalid tokens fall back to the address, so rotating junk
+    tokens does not buy a fresh bucket. May query the users table on an
+    auth cache miss.
+    """
+    user, _, _ = auth.verify(authorization)
+    if user is not None:
+        return f"user:{user['id']}"
+    if ADMISSION_TRUST_PROXY and forwarded_for:
+        return 'ip:' + forwarded_for.split(',')[0].strip()
+    return f"ip:{remote_addr}"
+
+def client_id():
+    return client_key(request.headers.get('Authorization', ''), request.headers.get('X-Forwarded-For'),
+                      request.remote_addr)
+
+def _reject(status, message, retry_after):
+    resp = jsonify({'error': message})
+    resp.status_code = status
+    resp.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+    return resp
+
+def check(route, client):
+    """Admit a request: None, or (status, message, retry_after) to shed it
+    
+    An admitted request holds a slot until limiter.release(route).
+    """
+    priority = ROUTE_CLASSES.get(route, 'standard')
+    config = PRIORITY_CLASSES[priority]
+    
+    wait = buckets.take(f"{priority}:{client}", config['rate'], config['burst'])
+    if wait > 0:
+        SHED.labels(priority, 'rate_limit').inc()
+        return 429, 'Rate limit exceeded', wait
+    
+    if not limiter.acquire(route, priority):
+        SHED.labels(priority, 'concurrency').inc()
+        return 503, 'Server busy, please retry', 1
+    return None
+
+def admit():
+    """before_request hook: returns a 429/503 response to shed the request"""
+    route = request.endpoint
+    if route is None:
+        return None
+    rejected = check(route, client_id())
+    if rejected is not None:
+        return _reject(*rejected)
+    g.admission_route = route
+    return None
+
+def release(exc=None):
+    """teardown_request hook: free the slot taken in admit()"""
+    route = g.pop('admission_route', None)
+    if route is not None:
+        limiter.release(route)
+
+def init_app(app):
+    if not ADMISSION_CONTROL:
+        return
+    app.before_request(admit)
+    app.teardown_request(release)
@@ -0,0 +1,276 @@
+"""Columnar analytics over packages for time-series dashboard metrics
+
+A snapshot of the packages table is kept as NumPy column arrays (created_at
+as epoch seconds, price, distance, and dictionary-encoded status, zone and
+driver). Group-bys are answered with np.bincount over the arrays instead of
+GROUP BY queries against the OLTP database.
+
+Refreshes are incremental: only rows created since the last refresh are
+read, plus the small set of packages that are not yet delivered or
+cancelled (the only rows whose status, driver or price can still change).
+"""
+import os
+import threading
+import time
+import numpy as np
+from datetime import datetime
+from db_config import router, execute_query, get_db_connection
+from geocoder import address_zone
+
+ANALYTICS_REFRESH_SECONDS = int(os.getenv('ANALYTICS_REFRESH_SECONDS', '30'))
+# Rows created this close to the watermark are re-read on the next refresh,
+# catching inserts that committed after a later created_at was seen
+ANALYTICS_OVERLAP_SECONDS = 120
+# Largest groups x buckets grid a single query may return
+ANALYTICS_MAX_CELLS = int(os.getenv('ANALYTICS_MAX_CELLS', '500000'))
+
+TERMINAL_STATUSES = ('delivered', 'cancelled')
+
+# Bucket width in hours, and the shift that makes weeks start on Monday
+# (the epoch, 1970-01-01, was a Thursday)
+BUCKETS = {'hour': (1, 0), 'day': (24, 0), 'week': (168, 72)}
+METRICS = ('volume', 'revenue', 'avg_distance', 'avg_price')
+GROUP_BYS = ('none', 'zone', 'driver', 'status')
+
+
+def _horizon(watermark):
+    """Start of the overlap window behind a created_at watermark"""
+    if not watermark:
+        return ''
+    since = datetime.fromisoformat(watermark).timestamp() - ANALYTICS_OVERLAP_SECONDS
+    return datetime.fromtimestamp(since).isoformat()
+
+
+class Dictionary:
+    """Dictionary encoding of a text column (value <-> small int code)"""
+    
+    def __init__(self, values=()):
+        self.values = list(values)
+        self.codes = {v: i for i, v in enumerate(self.values)}
+    
+    def encode(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+
+class ColumnSnapshot:
+    """Growable NumPy column store of package rows"""
+    
+    COLUMNS = {
+        'created_at': np.int64,
+        'hour': np.int32,
+        'price': np.float64,
+        'distance': np.float64,
+        'status': np.int16,
+        'zone': np.int32,
+        'driver': np.int32,
+        'alive': np.bool_,
+    }
+    
+    def __init__(self, capacity=1024):
+        self.size = 0
+        self.arrays = {name: np.zeros(capacity, dtype) for name, dtype in self.COLUMNS.items()}
+        self.dictionaries = {'status': Dictionary(), 'zone': Dictionary(), 'driver': Dictionary(['unassigned'])}
+        # package id -> row, only for rows that can still change
+        self.active = {}
+        # shard -> created_at watermark, and ids already read inside the overlap window
+        self.watermarks = {}
+        self.recent = {}
+        self.refreshed_at = 0
+        self._lock = threading.Lock()
+    
+    def _reserve(self, extra):
+        needed = self.size + extra
+        capacity = len(self.arrays['created_at'])
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity *= 2
+        for name, arr in self.arrays.items():
+            grown = np.zeros(capacity, arr.dtype)
+            grown[:self.size] = arr[:self.size]
+            self.arrays[name] = grown
+    
+    def append(self, columns):
+        """Append rows given as {column: sequence} with equal lengths"""
+        count = len(columns['created_at'])
+        self._reserve(count)
+        for name, values in columns.items():
+            self.arrays[name][self.size:self.size + count] = values
+        self.size += count
+    
+    def view(self, name):
+        return self.arrays[name][:self.size]
+    
+    def _set_row(self, row, package):
+        a = self.arrays
+        a['price'][row] = package['price'] or 0.0
+        a['distance'][row] = package['distance'] or 0.0
+        a['status'][row] = self.dictionaries['status'].encode(package['status'] or 'unknown')
+        a['driver'][row] = self.dictionaries['driver'].encode(package['driver_id'] or 'unassigned')
+    
+    def _ingest(self, packages):
+        """Append new package dicts, tracking the ones that can still change"""
+        if not packages:
+            return
+        start = self.size
+        created = np.array([p['created_at'] for p in packages], dtype='datetime64[s]').astype(np.int64)
+        zones = self.dictionaries['zone']
+        self.append({
+            'created_at': created,
+            'hour': created // 3600,
+            'zone': [zones.encode(address_zone(p['recipient_address'])) for p in packages],
+            'alive': np.ones(len(packages), np.bool_),
+        })
+        for offset, package in enumerate(packages):
+            row = start + offset
+            self._set_row(row, package)
+            if package['status'] not in TERMINAL_STATUSES:
+                self.active[package['id']] = row
+    
+    def _refresh_shard(self, shard, batch_size=5000):
+        conn = get_db_connection(shard)
+        try:
+            watermark = self.watermarks.get(shard, '')
+            cursor = execute_query(conn, '''
+                SELECT id, recipient_address, status, price, distance, driver_id, created_at
+                FROM packages WHERE created_at >= ? ORDER BY created_at
+            ''', (_horizon(watermark),))
+            columns = [col[0] for col in cursor.description]
+            recent = self.recent.get(shard, {})
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                fresh = []
+                for row in rows:
+                    package = dict(zip(columns, row))
+                    if package['id'] in recent:
+                        continue
+                    recent[package['id']] = package['created_at']
+                    fresh.append(package)
+                    watermark = max(watermark, package['created_at'])
+                self._ingest(fresh)
+                # Only ids inside the overlap window need remembering
+                horizon = _horizon(watermark)
+                recent = {k: v for k, v in recent.items() if v >= horizon}
+            self.recent[shard] = recent
+            self.watermarks[shard] = watermark
+        finally:
+            conn.close()
+    
+    def _resync_active(self, batch_size=500):
+        """Re-read packages that can still change; drop the ones deleted"""
+        ids = list(self.active)
+        seen = set()
+        for start in range(0, len(ids), batch_size):
+            chunk = ids[start:start + batch_size]
+            marks = ', '.join('?' for _ in chunk)
+            for rows in router.scatter(f'''
+                SELECT id, status, price, distance, driver_id FROM packages WHERE id IN ({marks})
+            ''', chunk):
+                for package in rows:
+                    row = self.active[package['id']]
+                    self._set_row(row, package)
+                    seen.add(package['id'])
+                    if package['status'] in TERMINAL_STATUSES:
+                        del self.active[package['id']]
+        for package_id in set(ids) - seen:
+            self.arrays['alive'][self.active.pop(package_id)] = False
+    
+    def refresh(self, force=False):
+        """Pull new and changed rows if the snapshot is older than the refresh interval"""
+        if not force and time.time() - self.refreshed_at < ANALYTICS_REFRESH_SECONDS:
+            return
+        with self._lock:
+            if not force and time.time() - self.refreshed_at < ANALYTICS_REFRESH_SECONDS:
+                return
+            self._resync_active()
+            for shard in router.shards:
+                self._refresh_shard(shard)
+            self.refreshed_at = time.time()
+    
+    def timeseries(self, metric='volume', bucket='day', group_by='none', start=None, end=None):
+        """Aggregate metric per time bucket (and group) over [start, end)
+        
+        start/end are epoch seconds. Returns {group: [(bucket_start, value), ...]}.
+        """
+        if metric not in METRICS:
+            raise ValueError(f"metric must be one of {', '.join(METRICS)}")
+        if bucket not in BUCKETS:
+            raise ValueError(f"bucket must be one of {', '.join(BUCKETS)}")
+        if group_by not in GROUP_BYS:
+            raise ValueError(f"group_by must be one of {', '.join(GROUP_BYS)}")
+        
+        # Build a row filter only when something is filtered out; selecting
+        # rows copies every column used below
+        alive = self.view('alive')
+        mask = None if alive.all() else alive
+        created = self.view('created_at')
+        for bound in (start, end):
+            if bound is not None:
+                cond = created >= bound if bound is start else created < bound
+                mask = cond if mask is None else mask & cond
+        
+        def column(name):
+            values = self.view(name)
+            return values if mask is None else values[mask]
+        
+        hours = column('hour')
+        if not len(hours):
+            return {}
+        width, shift = BUCKETS[bucket]
+        buckets = (hours + shift) // width if width > 1 else hours
+        origin = int(buckets.min())
+        buckets = buckets - origin
+        n_buckets = int(buckets.max()) + 1
+        
+        labels = ['all'] if group_by == 'none' else self.dictionaries[group_by].values
+        size = max(len(labels), 1) * n_buckets
+        if size > ANALYTICS_MAX_CELLS:
+            raise ValueError("Too many points requested; use a larger bucket or a shorter range")
+        if group_by == 'none':
+            keys = buckets
+        else:
+            # size fits in int32 after the check above
+            keys = column(group_by).astype(np.int32) * n_buckets + buckets
+        
+        counts = np.bincount(keys, minlength=size)
+        if metric == 'volume':
+            values = counts.astype(np.float64)
+        else:
+            weights = column('price' if metric in ('revenue', 'avg_price') else 'distance')
+            sums = np.bincount(keys, weights=weights, minlength=size)
+            if metric == 'revenue':
+                values = sums
+            else:
+                values = np.divide(sums, counts, out=np.zeros(size), where=counts > 0)
+        
+        cells = np.flatnonzero(counts)
+        groups = (cells // n_buckets).tolist()
+        starts = ((cells % n_buckets + origin) * width - shift) * 3600
+        result = {}
+        for g, t, v in zip(groups, starts.tolist(), values[cells].tolist()):
+            result.setdefault(labels[g], []).append((t, v))
+        return result
+
+
+def to_epoch(value):
+    """ISO timestamp (naive, like created_at) to epoch seconds; None passes through"""
+    if not value:
+        return None
+    return int(np.datetime64(value, 's').astype(np.int64))
+
+def from_epoch(seconds):
+    return str(np.datetime64(int(seconds), 's'))
+
+
+snapshot = ColumnSnapshot()
+
+def timeseries(metric='volume', bucket='day', group_by='none', start=None, end=None):
+    """Timeseries from the shared snapshot, refreshing it first if stale"""
+    snapshot.refresh()
+    return snapshot.timeseries(metric, bucket, group_by, start, end)
@@ -1,54 +1,89 @@
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, request, jsonify, g, Response
 from flask_cors import CORS
-import uuid
 from datetime import datetime
-import jwt
 import os
 from delivery_optimizer import Location, DistanceCalculator, PricingEngine
-from db_config import get_db_connection, init_db
+from db_config import init_db, router
 from aws_services import S3Service, SNSService, SESService
 from geocoder import geocode_ireland_address
+from search import search_packages, DEFAULT_PAGE_SIZE
+from archive import ArchiveUnavailable, find_archived_package
+import analytics
+from idempotency import idempotent
+import admission
+import static_assets
+import auth
+import eta
+import driver_locations
+import geofence
+import dispatch
+import ids
+import metrics
+import profiler
+import repository
 
-app = Flask(__name__)
+# serve_static below handles /static (Flask's built-in route would shadow it)
+app = Flask(__name__, static_folder=None)
+metrics.init_app(app)
+profiler.init_app(app)
 CORS(app)
+admission.init_app(app)
+static_assets.init_app(app)
 app.config['SECRET_KEY'] = 'quick-secret-123'
+auth.init_app(app)
 
 # Initialize database (SQLite or PostgreSQL based on DB_TYPE env var)
 init_db()
 
-# Helper function
+# Helper functions
 def get_db():
-    return get_db_connection()
+    """Connection to the home shard (unsharded tables such as users)"""
+    return router.connect(router.home_shard)
 
-def execute_db_query(conn, query, params=None):
-    """Execute query with proper parameter placeholders"""
-    cursor = conn.cursor()
-    
-    # Convert ? to %s for PostgreSQL
-    if os.getenv('DB_TYPE') == 'postgres':
-        query = query.replace('?', '%s')
-    
-    if params:
-        cursor.execute(query, params)
-    else:
-        cursor.execute(query)
-    
-    return cursor
+def get_package_db(package_id):
+    """Connection to the shard holding package_id (home shard if unknown)"""
+    shard = router.locate_package(package_id)
+    return router.connect(shard if shard is not None else router.home_shard)
+
+def insert_package(package_id, fields):
+    """Insert a package under a new tracking ID on its shard; returns the tracking ID
+    
+    fields are the INSERT_PACKAGE values after the tracking ID. If the ID is
+    already taken nothing is inserted and another is drawn, up to
+    ids.TRACKING_ID_ATTEMPTS times; any other conflict raises.
+    """
+    for _ in range(ids.TRACKING_ID_ATTEMPTS):
+        tracking_id = ids.tracking_id()
+        conn = router.connection_for(tracking_id)
+        inserted = repository.INSERT_PACKAGE.run(conn, (package_id, tracking_id) + fields)
+        conn.commit()
+        conn.close()
+        if inserted:
+            return tracking_id
+    raise RuntimeError(f"No free tracking ID after {ids.TRACKING_ID_ATTEMPTS} attempts")
+
+def archive_unavailable():
+    """503 for a lookup the archive could not answer in time"""
+    resp = jsonify({'error': 'Archive lookup timed out, please retry'})
+    resp.headers['Retry-After'] = '1'
+    return resp, 503
 
 # 1. REGISTER
 @app.route('/api/auth/register', methods=['POST'])
 def register():
     data = request.json
-    user_id = str(uuid.uuid4())
+    user_id = ids.new_id()
     
     conn = get_db()
-    cursor = execute_db_query(conn, 'INSERT INTO users VALUES (?, ?, ?, ?, ?)',
-                 (user_id, data['email'], data['password'], 
-                  data['name'], data['role']))
+    if repository.USER_ID_BY_EMAIL.scalar(conn, (data['email'],)):
+        conn.close()
+        return jsonify({'error': 'Email already registered'}), 409
+    repository.INSERT_USER.run(conn, (user_id, data['email'], data['password'],
+                                      data['name'], auth.DEFAULT_ROLE))
     conn.commit()
     conn.close()
     
-    token = jwt.encode({'user_id': user_id}, app.config['SECRET_KEY'], algorithm='HS256')
+    token = auth.issue_token(user_id)
     return jsonify({'token': token, 'user_id': user_id})
 
 # 2. LOGIN
@@ -56,23 +91,31 @@ def register():
 def login():
     data = request.json
     conn = get_db()
-    cursor = execute_db_query(conn, 'SELECT * FROM users WHERE email=? AND password=?',
-                       (data['email'], data['password']))
-    user = cursor.fetchone()
+    # Uses the unique index on users.email
+    user_id = repository.USER_ID_BY_LOGIN.scalar(conn, (data['email'], data['password']))
     conn.close()
     
-    if user:
-        # Convert to dict for PostgreSQL compatibility
-        if hasattr(user, 'keys'):
-            user = dict(user)
-        token = jwt.encode({'user_id': user['id']}, app.config['SECRET_KEY'], algorithm='HS256')
-        return jsonify({'token': token, 'user_id': user['id']})
+    if user_id:
+        token = auth.issue_token(user_id)
+        return jsonify({'token': token, 'user_id': user_id})
     return jsonify({'error': 'Invalid credentials'}), 401
 
+# LOGOUT (revokes the bearer token)
+@app.route('/api/auth/logout', methods=['POST'])
+def logout():
+    if g.get('user') is None:
+        return jsonify({'error': 'Authentication required'}), 401
+    auth.revoke_token(auth.bearer_token(), g.token_claims)
+    return jsonify({'message': 'Logged out'})
+
 # 3. CREATE PACKAGE
 @app.route('/api/packages', methods=['POST'])
+@idempotent
 def create_package():
     data = request.json
+    weight_kg = data.get('weight_kg', 1.0)
+    if not dispatch.valid_weight(weight_kg):
+        return jsonify({'error': 'weight_kg must be a positive number'}), 400
     
     # Get addresses
     pickup_address = data.get('pickup_address', '')
@@ -97,24 +140,19 @@ def create_package():
     
     # Calculate price using custom library
     pricing = PricingEngine()
-    price = pricing.calculate(distance, data.get('weight_kg', 1.0))
+    price = pricing.calculate(distance, weight_kg)
     
-    package_id = str(uuid.uuid4())
-    tracking_id = f"TRK{uuid.uuid4().hex[:8].upper()}"
+    package_id = ids.new_id()
     
     recipient_email = data.get('recipient_email', '')
     
-    conn = get_db()
     # Insert with email and driver_id (NULL initially)
-    # Column order: id, tracking_id, sender_id, recipient_name, recipient_email, 
-    #               recipient_address, pickup_address, status, distance, price, driver_id, created_at
-    execute_db_query(conn, 'INSERT INTO packages (id, tracking_id, sender_id, recipient_name, recipient_email, recipient_address, pickup_address, status, distance, price, driver_id, created_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
-                 (package_id, tracking_id, data.get('sender_id', 'guest'),
-                  data['recipient_name'], recipient_email, data['recipient_address'],
-                  data['pickup_address'], 'pending', distance, price, None,
-                  datetime.now().isoformat()))
-    conn.commit()
-    conn.close()
+    # Coordinates are stored for the geofences and dispatch waves (geocoding
+    # is jittered, so it cannot be repeated later); weight for van capacity
+    tracking_id = insert_package(package_id, (data.get('sender_id', 'guest'), data['recipient_name'],
+                                              recipient_email, data['recipient_address'], data['pickup_address'],
+                                              'pending', distance, price, None, datetime.now().isoformat(),
+                                              pickup_lat, pickup_lon, delivery_lat, delivery_lon, weight_kg))
     
     # Send email notification if email provided
     if recipient_email:
@@ -141,122 +179,149 @@ def create_package():
         'email_sent': bool(recipient_email)
     }), 201
 
+# SEARCH PACKAGES (recipient name, email, address)
+@app.route('/api/packages/search', methods=['GET'])
+def search():
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Query parameter q is required'}), 400
+    
+    page = request.args.get('page', 1, type=int)
+    per_page = request.args.get('per_page', DEFAULT_PAGE_SIZE, type=int)
+    result = search_packages(query, page, per_page)
+    result['query'] = query
+    return jsonify(result)
+
 # 4. TRACK PACKAGE
 @app.route('/api/packages/<tracking_id>', methods=['GET'])
 def track_package(tracking_id):
-    conn = get_db()
-    # Use explicit column names
-    cursor = execute_db_query(conn, '''
-        SELECT id, tracking_id, sender_id, recipient_name, recipient_email, 
-               recipient_address, pickup_address, status, distance, price, driver_id, created_at
-        FROM packages WHERE tracking_id=?
-    ''', (tracking_id,))
-    package = cursor.fetchone()
+    if ids.mistyped_tracking_id(tracking_id):
+        return jsonify({'error': 'Not found'}), 404
+    
+    conn = router.connection_for(tracking_id)
+    package = repository.TRACKED_PACKAGE.one(conn, (tracking_id,))
     conn.close()
     
     if package:
-        # Convert to dict for PostgreSQL/SQLite compatibility
-        if hasattr(package, 'keys'):
-            package = dict(package)
-        elif isinstance(package, tuple):
-            # Column order: id, tracking_id, sender_id, recipient_name, recipient_email, 
-            #               recipient_address, pickup_address, status, distance, price, driver_id, created_at
-            package = {
-                'id': package[0],
-                'tracking_id': package[1],
-                'sender_id': package[2],
-                'recipient_name': package[3],
-                'recipient_email': package[4] if len(package) > 4 and package[4] else '',
-                'recipient_address': package[5] if len(package) > 5 else '',
-                'pickup_address': package[6] if len(package) > 6 else '',
-                'status': package[7] if len(package) > 7 else '',
-                'distance': package[8] if len(package) > 8 else 0,
-                'price': package[9] if len(package) > 9 else 0,
-                'driver_id': package[10] if len(package) > 10 else None,
-                'created_at': package[11] if len(package) > 11 else ''
-            }
+        package = package._asdict()
+        package['eta'] = eta.package_eta(package, package.pop('accepted_at'))
+        return jsonify(package)
+    
+    # Delivered/cancelled parcels may have been moved to the archive
+    try:
+        package = find_archived_package(tracking_id=tracking_id)
+    except ArchiveUnavailable:
+        return archive_unavailable()
+    if package:
+        package['eta'] = None
         return jsonify(package)
     return jsonify({'error': 'Not found'}), 404
 
+# ETA FOR MANY PACKAGES
+@app.route('/api/eta/batch', methods=['POST'])
+def eta_batch():
+    tracking_ids = (request.json or {}).get('tracking_ids')
+    if not isinstance(tracking_ids, list) or not all(isinstance(t, str) for t in tracking_ids):
+        return jsonify({'error': 'tracking_ids must be a list of strings'}), 400
+    if len(tracking_ids) > eta.ETA_BATCH_LIMIT:
+        return jsonify({'error': f'At most {eta.ETA_BATCH_LIMIT} tracking_ids per request'}), 400
+    
+    etas = eta.batch_eta(tracking_ids)
+    return jsonify({
+        'etas': etas,
+        'not_found': [t for t in tracking_ids if t not in etas]
+    })
+
+# DRIVER LOCATION PINGS (batched)
+@app.route('/api/drivers/<driver_id>/locations', methods=['POST'])
+def record_driver_locations(driver_id):
+    try:
+        pings, rejected = driver_locations.parse_pings(request.get_json(silent=True))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    try:
+        driver_locations.record(driver_id, pings)
+    except driver_locations.BufferFull:
+        resp = jsonify({'error': 'Location buffer full, please retry'})
+        resp.headers['Retry-After'] = '1'
+        return resp, 503
+    geofence.observe(driver_id, pings)
+    return jsonify({'accepted': len(pings), 'rejected': rejected}), 202
+
+# LATEST DRIVER POSITIONS
+@app.route('/api/drivers/positions', methods=['GET'])
+def driver_positions():
+    max_age = request.args.get('max_age', type=float)
+    positions = driver_locations.latest_positions(max_age)
+    return jsonify({'drivers': positions, 'count': len(positions)})
+
+# DISPATCH WAVES FOR PENDING PACKAGES
+@app.route('/api/dispatch/waves', methods=['POST'])
+def dispatch_waves():
+    data = request.get_json(silent=True) or {}
+    try:
+        max_weight = float(data.get('max_weight_kg', dispatch.DISPATCH_MAX_WEIGHT_KG))
+        max_stops = int(data.get('max_stops', dispatch.DISPATCH_MAX_STOPS))
+        vehicles = data.get('vehicles')
+        vehicles = int(vehicles) if vehicles is not None else None
+    except (TypeError, ValueError):
+        return jsonify({'error': 'max_weight_kg, max_stops and vehicles must be numbers'}), 400
+    if max_weight <= 0 or max_stops <= 0 or (vehicles is not None and vehicles <= 0):
+        return jsonify({'error': 'max_weight_kg, max_stops and vehicles must be positive'}), 400
+    
+    packages = dispatch.pending_packages()
+    waves, unassigned = dispatch.plan_waves(packages, max_weight, max_stops, vehicles)
+    return jsonify({
+        'waves': waves,
+        'unassigned': unassigned,
+        'total_packages': len(packages),
+        'total_weight_kg': round(sum(w['weight_kg'] for w in waves), 2)
+    })
+
 # 5. LIST PACKAGES
 @app.route('/api/packages', methods=['GET'])
 def list_packages():
-    conn = get_db()
-    # Use explicit column names to ensure correct order
-    cursor = execute_db_query(conn, '''
-        SELECT id, tracking_id, sender_id, recipient_name, recipient_email, 
-               recipient_address, pickup_address, status, distance, price, driver_id, created_at
-        FROM packages ORDER BY created_at DESC LIMIT 10
-    ''')
-    packages = cursor.fetchall()
-    conn.close()
-    # Convert to dict for PostgreSQL compatibility
-    result = []
-    for p in packages:
-        if hasattr(p, 'keys'):
-            result.append(dict(p))
-        elif isinstance(p, tuple):
-            # Column order: id, tracking_id, sender_id, recipient_name, recipient_email, 
-            #               recipient_address, pickup_address, status, distance, price, driver_id, created_at
-            result.append({
-                'id': p[0],
-                'tracking_id': p[1],
-                'sender_id': p[2],
-                'recipient_name': p[3],
-                'recipient_email': p[4] if len(p) > 4 and p[4] else '',
-                'recipient_address': p[5] if len(p) > 5 else '',
-                'pickup_address': p[6] if len(p) > 6 else '',
-                'status': p[7] if len(p) > 7 else '',
-                'distance': p[8] if len(p) > 8 else 0,
-                'price': p[9] if len(p) > 9 else 0,
-                'driver_id': p[10] if len(p) > 10 else None,
-                'created_at': p[11] if len(p) > 11 else ''
-            })
-        else:
-            result.append(p)
-    return jsonify(result)
+    # Each shard returns its newest 10; the router merges them by created_at
+    packages = router.gather(repository.RECENT_PACKAGES, limit=10)
+    return jsonify([package._asdict() for package in packages])
 
 # 6. UPDATE STATUS
 @app.route('/api/packages/<package_id>/status', methods=['PUT'])
 def update_status(package_id):
     data = request.json
     new_status = data['status']
-    
-    conn = get_db()
+    change_package_status(package_id, new_status)
+    return jsonify({'success': True, 'status': new_status})
+
+def change_package_status(package_id, new_status, expected_status=None):
+    """Set a package's status, record the event and notify the recipient
+    
+    With expected_status the update only applies if the package still has
+    that status, so automatic transitions raised by several workers fire
+    once. Returns False if nothing was updated.
+    """
+    conn = get_package_db(package_id)
     # Get package info for notification
-    cursor = execute_db_query(conn, 'SELECT * FROM packages WHERE id=?', (package_id,))
-    package = cursor.fetchone()
+    package = repository.PACKAGE_BY_ID.one(conn, (package_id,))
     
-    execute_db_query(conn, 'UPDATE packages SET status=? WHERE id=?',
-                 (new_status, package_id))
+    if expected_status is None:
+        updated = repository.SET_STATUS.run(conn, (new_status, package_id)) > 0
+    else:
+        updated = repository.SET_STATUS_IF.run(conn, (new_status, package_id, expected_status)) > 0
+    if package and updated:
+        # Record the status change; delivery events feed the ETA tables
+        repository.INSERT_DELIVERY.run(conn, (ids.new_id(), package_id, package.driver_id,
+                                              new_status, datetime.now().isoformat()))
     conn.commit()
     conn.close()
     
     # Send notifications if package found
-    if package:
-        if hasattr(package, 'keys'):
-            package = dict(package)
-        elif isinstance(package, tuple):
-            # Handle tuple from PostgreSQL
-            package = {
-                'id': package[0],
-                'tracking_id': package[1],
-                'sender_id': package[2],
-                'recipient_name': package[3],
-                'recipient_email': package[4] if len(package) > 4 else '',
-                'recipient_address': package[5] if len(package) > 5 else '',
-                'pickup_address': package[6] if len(package) > 6 else '',
-                'status': package[7] if len(package) > 7 else '',
-                'distance': package[8] if len(package) > 8 else 0,
-                'price': package[9] if len(package) > 9 else 0,
-                'driver_id': package[10] if len(package) > 10 else None,
-                'created_at': package[11] if len(package) > 11 else ''
-            }
-        
-        tracking_id = package.get('tracking_id', '')
-        recipient_email = package.get('recipient_email', '')
-        recipient_name = package.get('recipient_name', 'Customer')
-        recipient_address = package.get('recipient_address', '')
+    if package and updated:
+        tracking_id = package.tracking_id
+        recipient_email = package.recipient_email or ''
+        recipient_name = package.recipient_name or 'Customer'
+        recipient_address = package.recipient_address or ''
         
         # Send email notification
         if recipient_email:
@@ -274,52 +339,41 @@ def update_status(package_id):
         except Exception as e:
             print(f"SNS notification error: {e}")
     
-    return jsonify({'success': True, 'status': new_status})
+    return updated
+
+geofence.init(change_package_status)
 
 # 7. ASSIGN DRIVER
 @app.route('/api/deliveries/accept/<package_id>', methods=['POST'])
+@idempotent
 def accept_delivery(package_id):
     data = request.json
     driver_id = data.get('driver_id', '')
     driver_name = data.get('driver_name', 'Driver')
     
-    delivery_id = str(uuid.uuid4())
+    delivery_id = ids.new_id()
     
-    conn = get_db()
+    conn = get_package_db(package_id)
     # Get package info before updating
-    cursor = execute_db_query(conn, 'SELECT * FROM packages WHERE id=?', (package_id,))
-    package = cursor.fetchone()
-    
-    execute_db_query(conn, 'INSERT INTO deliveries VALUES (?, ?, ?, ?, ?)',
-                 (delivery_id, package_id, driver_id,
-                  'accepted', datetime.now().isoformat()))
-    execute_db_query(conn, 'UPDATE packages SET status=?, driver_id=? WHERE id=?',
-                 ('assigned', driver_id, package_id))
+    package = repository.PACKAGE_BY_ID.one(conn, (package_id,))
+    
+    repository.INSERT_DELIVERY.run(conn, (delivery_id, package_id, driver_id,
+                                          'accepted', datetime.now().isoformat()))
+    repository.ASSIGN_DRIVER.run(conn, ('assigned', driver_id, package_id))
     conn.commit()
     conn.close()
     
     # Send email notification
-    if package:
-        if hasattr(package, 'keys'):
-            package = dict(package)
-        elif isinstance(package, tuple):
-            package = {
-                'tracking_id': package[1],
-                'recipient_name': package[3],
-                'recipient_email': package[4] if len(package) > 4 else ''
-            }
-        
-        recipient_email = package.get('recipient_email', '')
-        if recipient_email:
-            try:
-                SESService.send_driver_assigned_email(
-                    package.get('tracking_id', ''),
-                    package.get('recipient_name', 'Customer'),
-                    recipient_email,
-                    driver_name
-                )
-            except Exception as e:
-                print(f"Email notification error: {e}")
+    if package and package.recipient_email:
+        try:
+            SESService.send_driver_assigned_email(
+                package.tracking_id,
+                package.recipient_name or 'Customer',
+                package.recipient_email,
+                driver_name
+            )
+        except Exception as e:
+            print(f"Email notification error: {e}")
     
     return jsonify({'delivery_id': delivery_id, 'status': 'assigned'})
 
@@ -363,47 +417,34 @@ def get_package_file_url(package_id, file_name):
 # Serve UI
 @app.route('/')
 def index():
-    return send_from_directory('static', 'index.html')
+    return static_assets.send_index()
 
 @app.route('/static/<path:path>')
 def serve_static(path):
-    return send_from_directory('static', path)
+    return static_assets.send_static(path)
 
 # 10. DASHBOARD STATISTICS
 @app.route('/api/dashboard/stats', methods=['GET'])
 def dashboard_stats():
-    conn = get_db()
-    
-    # Total packages
-    cursor = execute_db_query(conn, 'SELECT COUNT(*) FROM packages')
-    total_packages = cursor.fetchone()[0] if cursor.fetchone() else 0
-    cursor = execute_db_query(conn, 'SELECT COUNT(*) FROM packages')
-    total = cursor.fetchone()
-    total_packages = total[0] if total else 0
+    # Aggregate per shard, then combine (AVG is rebuilt from SUM/COUNT)
+    total_packages = 0
+    total_revenue = 0.0
+    distance_sum = 0.0
+    distance_count = 0
+    for rows in router.scatter(repository.PACKAGE_TOTALS):
+        totals = rows[0]
+        total_packages += totals.total or 0
+        total_revenue += float(totals.revenue or 0)
+        distance_sum += float(totals.distance_sum or 0)
+        distance_count += totals.distance_count or 0
     
     # Packages by status
-    cursor = execute_db_query(conn, 'SELECT status, COUNT(*) FROM packages GROUP BY status')
     status_counts = {}
-    for row in cursor.fetchall():
-        status = row[0] if isinstance(row, tuple) else row['status']
-        count = row[1] if isinstance(row, tuple) else row['COUNT(*)']
-        status_counts[status] = count
-    
-    # Total revenue
-    cursor = execute_db_query(conn, 'SELECT SUM(price) FROM packages')
-    total_revenue = cursor.fetchone()[0] if cursor.fetchone() else 0
-    cursor = execute_db_query(conn, 'SELECT SUM(price) FROM packages')
-    revenue = cursor.fetchone()
-    total_revenue = float(revenue[0]) if revenue and revenue[0] else 0.0
-    
-    # Average distance
-    cursor = execute_db_query(conn, 'SELECT AVG(distance) FROM packages')
-    avg_distance = cursor.fetchone()[0] if cursor.fetchone() else 0
-    cursor = execute_db_query(conn, 'SELECT AVG(distance) FROM packages')
-    avg_dist = cursor.fetchone()
-    avg_distance = float(avg_dist[0]) if avg_dist and avg_dist[0] else 0.0
+    for rows in router.scatter(repository.STATUS_COUNTS):
+        for row in rows:
+            status_counts[row.status] = status_counts.get(row.status, 0) + row.count
     
-    conn.close()
+    avg_distance = distance_sum / distance_count if distance_count else 0.0
     
     return jsonify({
         'total_packages': total_packages,
@@ -412,57 +453,64 @@ def dashboard_stats():
         'average_distance': round(avg_distance, 2)
     })
 
+# ANALYTICS TIME SERIES
+@app.route('/api/analytics/timeseries', methods=['GET'])
+def analytics_timeseries():
+    metric = request.args.get('metric', 'volume')
+    bucket = request.args.get('bucket', 'day')
+    group_by = request.args.get('group_by', 'none')
+    try:
+        # start/end are ISO timestamps, bucketed the same way created_at is stored
+        start = analytics.to_epoch(request.args.get('start'))
+        end = analytics.to_epoch(request.args.get('end'))
+        series = analytics.timeseries(metric, bucket, group_by, start, end)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    return jsonify({
+        'metric': metric,
+        'bucket': bucket,
+        'group_by': group_by,
+        'series': [
+            {'group': group, 'points': [{'t': analytics.from_epoch(t), 'value': round(v, 2)} for t, v in points]}
+            for group, points in series.items()
+        ]
+    })
+
 # 11. GET PACKAGES BY STATUS
 @app.route('/api/packages/status/<status>', methods=['GET'])
 def get_packages_by_status(status):
-    conn = get_db()
-    cursor = execute_db_query(conn, 'SELECT * FROM packages WHERE status=? ORDER BY created_at DESC', (status,))
-    packages = cursor.fetchall()
-    conn.close()
-    
-    result = []
-    for p in packages:
-        if hasattr(p, 'keys'):
-            result.append(dict(p))
-        elif isinstance(p, tuple):
-            result.append({
-                'id': p[0],
-                'tracking_id': p[1],
-                'sender_id': p[2],
-                'recipient_name': p[3],
-                'recipient_email': p[4] if len(p) > 4 else '',
-                'recipient_address': p[5] if len(p) > 5 else '',
-                'pickup_address': p[6] if len(p) > 6 else '',
-                'status': p[7] if len(p) > 7 else '',
-                'distance': p[8] if len(p) > 8 else 0,
-                'price': p[9] if len(p) > 9 else 0,
-                'driver_id': p[10] if len(p) > 10 else None,
-                'created_at': p[11] if len(p) > 11 else ''
-            })
-        else:
-            result.append(p)
-    return jsonify(result)
+    packages = router.gather(repository.PACKAGES_BY_STATUS, (status,))
+    return jsonify([package._asdict() for package in packages])
 
 # 12. UPDATE PACKAGE (Full Update)
 @app.route('/api/packages/<package_id>', methods=['PUT'])
 def update_package(package_id):
     data = request.json
+    if data.get('weight_kg') is not None and not dispatch.valid_weight(data['weight_kg']):
+        return jsonify({'error': 'weight_kg must be a positive number'}), 400
     
-    conn = get_db()
+    conn = get_package_db(package_id)
     # Get existing package
-    cursor = execute_db_query(conn, 'SELECT * FROM packages WHERE id=?', (package_id,))
-    package = cursor.fetchone()
+    package = repository.PACKAGE_BY_ID.one(conn, (package_id,))
     
     if not package:
         conn.close()
         return jsonify({'error': 'Package not found'}), 404
     
     # Update package fields
-    recipient_name = data.get('recipient_name', package[3] if isinstance(package, tuple) else package.get('recipient_name'))
-    recipient_email = data.get('recipient_email', package[4] if isinstance(package, tuple) and len(package) > 4 else package.get('recipient_email', ''))
-    recipient_address = data.get('recipient_address', package[5] if isinstance(package, tuple) and len(package) > 5 else package.get('recipient_address'))
-    pickup_address = data.get('pickup_address', package[6] if isinstance(package, tuple) and len(package) > 6 else package.get('pickup_address'))
-    weight_kg = data.get('weight_kg', 1.0)
+    recipient_name = data.get('recipient_name', package.recipient_name)
+    recipient_email = data.get('recipient_email', package.recipient_email or '')
+    recipient_address = data.get('recipient_address', package.recipient_address)
+    pickup_address = data.get('pickup_address', package.pickup_address)
+    weight_kg = data.get('weight_kg')
+    if weight_kg is None:
+        # Packages created before weights were stored are priced as 1 kg
+        weight_kg = repository.PACKAGE_WEIGHT.scalar(conn, (package_id,))
+        if weight_kg is None:
+            weight_kg = 1.0
+    else:
+        repository.SET_WEIGHT.run(conn, (weight_kg, package_id))
     
     # Recalculate distance and price if addresses changed
     if 'recipient_address' in data or 'pickup_address' in data:
@@ -473,18 +521,14 @@ def update_package(package_id):
         distance = DistanceCalculator.calculate(pickup, delivery)
         pricing = PricingEngine()
         price = pricing.calculate(distance, weight_kg)
+        repository.SET_COORDINATES.run(conn, (pickup_lat, pickup_lon, delivery_lat, delivery_lon, package_id))
     else:
-        distance = package[8] if isinstance(package, tuple) and len(package) > 8 else package.get('distance', 0)
-        price = package[9] if isinstance(package, tuple) and len(package) > 9 else package.get('price', 0)
+        distance = package.distance
+        price = package.price
     
     # Update package
-    execute_db_query(conn, '''
-        UPDATE packages 
-        SET recipient_name=?, recipient_email=?, recipient_address=?, 
-            pickup_address=?, distance=?, price=?
-        WHERE id=?
-    ''', (recipient_name, recipient_email, recipient_address, 
-          pickup_address, distance, price, package_id))
+    repository.UPDATE_PACKAGE.run(conn, (recipient_name, recipient_email, recipient_address,
+                                         pickup_address, distance, price, package_id))
     conn.commit()
     conn.close()
     
@@ -499,26 +543,21 @@ def update_package(package_id):
 # 13. DELETE PACKAGE
 @app.route('/api/packages/<package_id>', methods=['DELETE'])
 def delete_package(package_id):
-    conn = get_db()
+    conn = get_package_db(package_id)
     
     # Check if package exists
-    cursor = execute_db_query(conn, 'SELECT * FROM packages WHERE id=?', (package_id,))
-    package = cursor.fetchone()
+    package = repository.PACKAGE_BY_ID.one(conn, (package_id,))
     
     if not package:
         conn.close()
         return jsonify({'error': 'Package not found'}), 404
     
     # Get tracking_id for notification
-    if isinstance(package, tuple):
-        tracking_id = package[1]
-        recipient_email = package[4] if len(package) > 4 else ''
-    else:
-        tracking_id = package.get('tracking_id', '')
-        recipient_email = package.get('recipient_email', '')
+    tracking_id = package.tracking_id
+    recipient_email = package.recipient_email or ''
     
     # Delete package
-    execute_db_query(conn, 'DELETE FROM packages WHERE id=?', (package_id,))
+    repository.DELETE_PACKAGE.run(conn, (package_id,))
     conn.commit()
     conn.close()
     
@@ -543,39 +582,55 @@ def delete_package(package_id):
 # 14. GET SINGLE PACKAGE BY ID
 @app.route('/api/packages/id/<package_id>', methods=['GET'])
 def get_package_by_id(package_id):
-    conn = get_db()
-    # Use explicit column names
-    cursor = execute_db_query(conn, '''
-        SELECT id, tracking_id, sender_id, recipient_name, recipient_email, 
-               recipient_address, pickup_address, status, distance, price, driver_id, created_at
-        FROM packages WHERE id=?
-    ''', (package_id,))
-    package = cursor.fetchone()
+    conn = get_package_db(package_id)
+    package = repository.PACKAGE_BY_ID.one(conn, (package_id,))
     conn.close()
     
     if package:
-        if hasattr(package, 'keys'):
-            package = dict(package)
-        elif isinstance(package, tuple):
-            # Column order: id, tracking_id, sender_id, recipient_name, recipient_email, 
-            #               recipient_address, pickup_address, status, distance, price, driver_id, created_at
-            package = {
-                'id': package[0],
-                'tracking_id': package[1],
-                'sender_id': package[2],
-                'recipient_name': package[3],
-                'recipient_email': package[4] if len(package) > 4 and package[4] else '',
-                'recipient_address': package[5] if len(package) > 5 else '',
-                'pickup_address': package[6] if len(package) > 6 else '',
-                'status': package[7] if len(package) > 7 else '',
-                'distance': package[8] if len(package) > 8 else 0,
-                'price': package[9] if len(package) > 9 else 0,
-                'driver_id': package[10] if len(package) > 10 else None,
-                'created_at': package[11] if len(package) > 11 else ''
-            }
+        return jsonify(package._asdict())
+    
+    try:
+        package = find_archived_package(package_id=package_id)
+    except ArchiveUnavailable:
+        return archive_unavailable()
+    if package:
         return jsonify(package)
     return jsonify({'error': 'Not found'}), 404
 
+# SLOW REQUESTS (this worker's captures; see profiler.py)
+@app.route('/api/admin/slow-requests', methods=['GET'])
+@auth.require_role(profiler.PROFILE_ROLE)
+def slow_requests():
+    captures = profiler.slow_requests.summaries()
+    return jsonify({'slow_requests': captures, 'count': len(captures), 'threshold_ms': profiler.SLOW_REQUEST_MS,
+                    'pid': os.getpid()})
+
+@app.route('/api/admin/slow-requests/<capture_id>', methods=['GET'])
+@auth.require_role(profiler.PROFILE_ROLE)
+def slow_request(capture_id):
+    entry = profiler.slow_requests.get(capture_id)
+    if entry is None:
+        return jsonify({'error': 'Not found', 'pid': os.getpid()}), 404
+    return jsonify(profiler.detail(entry))
+
+@app.route('/api/admin/slow-requests/<capture_id>/profile', methods=['GET'])
+@auth.require_role(profiler.PROFILE_ROLE)
+def slow_request_profile(capture_id):
+    fmt = request.args.get('format', 'pstats')
+    if fmt not in ('pstats', 'folded'):
+        return jsonify({'error': 'format must be pstats or folded'}), 400
+    entry = profiler.slow_requests.get(capture_id)
+    if entry is None:
+        return jsonify({'error': 'Not found', 'pid': os.getpid()}), 404
+    if fmt == 'pstats':
+        body, mimetype = profiler.pstats_file(entry), 'application/octet-stream'
+    else:
+        body, mimetype = profiler.collapsed(entry), 'text/plain'
+    if body is None:
+        return jsonify({'error': 'Request was not profiled'}), 404
+    filename = f"{capture_id}.{'prof' if fmt == 'pstats' else 'folded'}"
+    return Response(body, mimetype=mimetype, headers={'Content-Disposition': f'attachment; filename={filename}'})
+
 # HEALTH CHECK
 @app.route('/api/health', methods=['GET'])
 def health():
@@ -600,4 +655,5 @@ def health():
     })
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=5000, debug=False)
\ No newline at end of file
+    # Development server only; production runs under gunicorn (see serve.sh)
+    app.run(host='0.0.0.0', port=int(os.getenv('PORT', '5000')), debug=False)
\ No newline at end of file
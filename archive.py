@@ -0,0 +1,440 @@
+"""Hot/cold archival of delivered and cancelled packages
+
+Terminal-state packages older than a cutoff are moved out of the OLTP tables
+into compressed columnar files, partitioned by creation date:
+
+    <root>/date=2025-01-31/packages-<run>.col    one zlib block per column
+    <root>/date=2025-01-31/packages-<run>.idx    tracking_id/id -> row index
+    <root>/date=2025-01-31/packages-<run>.bloom  Bloom filter of those keys
+    <root>/date=2025-01-31/deliveries-<run>.col  deliveries of those packages
+
+The root is a local directory (ARCHIVE_DIR) or, when ARCHIVE_S3_PREFIX is
+set, a prefix in the S3_BUCKET. Every worker keeps each partition's Bloom
+filter in memory (about 4 bytes per archived package), so a point lookup
+only reads the .idx files of partitions that may hold the key (the most
+recently used ARCHIVE_INDEX_CACHE of them are kept in memory) and decodes a
+.col file when the key is actually found. A key that was never archived
+costs a read only on a false positive (about 0.05% per partition).
+"""
+import hashlib
+import json
+import os
+import struct
+import threading
+import time
+import uuid
+import zlib
+from array import array
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from db_config import DB_TYPE, router, execute_query, get_db_connection, rebuild_search_index
+
+ARCHIVE_DIR = os.getenv('ARCHIVE_DIR', 'archive')
+ARCHIVE_S3_PREFIX = os.getenv('ARCHIVE_S3_PREFIX', '')
+ARCHIVE_AFTER_DAYS = int(os.getenv('ARCHIVE_AFTER_DAYS', '30'))
+# How long a partition listing is trusted before the store is listed again
+ARCHIVE_LISTING_TTL = int(os.getenv('ARCHIVE_LISTING_TTL', '60'))
+# Partition indexes each worker keeps in memory
+ARCHIVE_INDEX_CACHE = int(os.getenv('ARCHIVE_INDEX_CACHE', '64'))
+# Seconds one lookup may spend fetching indexes, and the S3 timeout per call
+ARCHIVE_LOOKUP_TIMEOUT = float(os.getenv('ARCHIVE_LOOKUP_TIMEOUT', '2'))
+ARCHIVE_S3_TIMEOUT = float(os.getenv('ARCHIVE_S3_TIMEOUT', '1'))
+
+TERMINAL_STATUSES = ('delivered', 'cancelled')
+
+PACKAGE_COLUMNS = ['id', 'tracking_id', 'sender_id', 'recipient_name', 'recipient_email',
+                   'recipient_address', 'pickup_address', 'status', 'distance', 'price',
+                   'driver_id', 'created_at', 'pickup_lat', 'pickup_lon', 'delivery_lat', 'delivery_lon',
+                   'weight_kg']
+DELIVERY_COLUMNS = ['id', 'package_id', 'driver_id', 'status', 'created_at']
+REAL_COLUMNS = {'distance', 'price', 'pickup_lat', 'pickup_lon', 'delivery_lat', 'delivery_lon', 'weight_kg'}
+
+MAGIC = b'CDA1'
+# About 0.05% false positives with BloomFilter.HASHES hashes
+BLOOM_BITS_PER_KEY = 16
+
+
+# --- Columnar file format ---------------------------------------------------
+
+def encode_columns(columns, rows):
+    """Encode rows (dicts) as MAGIC, header length, JSON header, column blocks
+    
+    Text columns are stored as a JSON list, REAL columns as packed doubles
+    (NaN for NULL); each column is compressed on its own so a reader can
+    decode just the columns it needs.
+    """
+    blocks = []
+    header = {'rows': len(rows), 'columns': []}
+    offset = 0
+    for name in columns:
+        values = [row.get(name) for row in rows]
+        if name in REAL_COLUMNS:
+            raw = array('d', (float('nan') if v is None else float(v) for v in values)).tobytes()
+            kind = 'real'
+        else:
+            raw = json.dumps(values, separators=(',', ':')).encode('utf-8')
+            kind = 'text'
+        block = zlib.compress(raw, 9)
+        header['columns'].append({'name': name, 'type': kind, 'offset': offset, 'length': len(block)})
+        blocks.append(block)
+        offset += len(block)
+    head = json.dumps(header).encode('utf-8')
+    return MAGIC + struct.pack('>I', len(head)) + head + b''.join(blocks)
+
+def decode_columns(data, wanted=None):
+    """Decode a columnar file back into {column: [values]}"""
+    if data[:4] != MAGIC:
+        raise ValueError("Not an archive column file")
+    head_len = struct.unpack('>I', data[4:8])[0]
+    header = json.loads(data[8:8 + head_len])
+    base = 8 + head_len
+    result = {}
+    for col in header['columns']:
+        if wanted and col['name'] not in wanted:
+            continue
+        raw = zlib.decompress(data[base + col['offset']:base + col['offset'] + col['length']])
+        if col['type'] == 'real':
+            values = array('d')
+            values.frombytes(raw)
+            result[col['name']] = [None if v != v else v for v in values]
+        else:
+            result[col['name']] = json.loads(raw)
+    return result
+
+
+class BloomFilter:
+    """Set of strings with no false negatives and a small false positive rate"""
+    
+    HASHES = 11
+    
+    def __init__(self, count=0, bits=None, data=None):
+        self.bits = bits or max(64, count * BLOOM_BITS_PER_KEY)
+        self.data = bytearray(data) if data is not None else bytearray((self.bits + 7) // 8)
+    
+    @staticmethod
+    def hashes(value):
+        """The two hashes every filter derives its bit positions from; compute once per lookup"""
+        digest = hashlib.blake2b(value.encode('utf-8'), digest_size=16).digest()
+        return int.from_bytes(digest[:8], 'big'), int.from_bytes(digest[8:], 'big') | 1
+    
+    def add(self, value):
+        h1, h2 = self.hashes(value)
+        for i in range(self.HASHES):
+            p = (h1 + i * h2) % self.bits
+            self.data[p >> 3] |= 1 << (p & 7)
+    
+    def might_contain(self, hashes):
+        h1, h2 = hashes
+        for i in range(self.HASHES):
+            p = (h1 + i * h2) % self.bits
+            if not self.data[p >> 3] & (1 << (p & 7)):
+                return False
+        return True
+    
+    def to_bytes(self):
+        return struct.pack('>I', self.bits) + bytes(self.data)
+    
+    @classmethod
+    def from_bytes(cls, data):
+        return cls(bits=struct.unpack('>I', data[:4])[0], data=data[4:])
+    
+    @classmethod
+    def for_index(cls, index):
+        """Filter of an .idx file's keys, as "column:value" """
+        bloom = cls(len(index['tracking_id']) + len(index['id']))
+        for column in ('tracking_id', 'id'):
+            for value in index[column]:
+                bloom.add(f"{column}:{value}")
+        return bloom
+
+
+# --- Storage backends -------------------------------------------------------
+
+class LocalArchiveStore:
+    """Archive files under a local directory"""
+    
+    def __init__(self, root=ARCHIVE_DIR):
+        self.root = root
+    
+    def put(self, key, data):
+        path = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, path)
+    
+    def get(self, key):
+        with open(os.path.join(self.root, key), 'rb') as f:
+            return f.read()
+    
+    def list(self, suffix):
+        if not os.path.isdir(self.root):
+            return []
+        keys = []
+        for partition in sorted(os.listdir(self.root)):
+            folder = os.path.join(self.root, partition)
+            if os.path.isdir(folder):
+                keys.extend(f"{partition}/{name}" for name in sorted(os.listdir(folder))
+                            if name.endswith(suffix))
+        return keys
+
+
+class S3ArchiveStore:
+    """Archive files under a prefix in the S3 bucket
+    
+    With a timeout, calls use their own client that gives up after that many
+    seconds without retrying; S3 and network errors are raised as OSError.
+    """
+    
+    def __init__(self, prefix=ARCHIVE_S3_PREFIX, timeout=None):
+        from aws_services import s3_client, S3_BUCKET, AWS_REGION
+        if not s3_client or not S3_BUCKET:
+            raise RuntimeError("ARCHIVE_S3_PREFIX requires S3_BUCKET to be configured")
+        self.client = s3_client
+        if timeout:
+            import boto3
+            from botocore.config import Config
+            self.client = boto3.client('s3', region_name=AWS_REGION, config=Config(
+                connect_timeout=timeout, read_timeout=timeout, retries={'max_attempts': 1}))
+        self.bucket = S3_BUCKET
+        self.prefix = prefix.rstrip('/')
+    
+    def put(self, key, data):
+        self.client.put_object(Bucket=self.bucket, Key=f"{self.prefix}/{key}", Body=data)
+    
+    def get(self, key):
+        from botocore.exceptions import BotoCoreError, ClientError
+        try:
+            response = self.client.get_object(Bucket=self.bucket, Key=f"{self.prefix}/{key}")
+            return response['Body'].read()
+        except (BotoCoreError, ClientError) as e:
+            raise OSError(f"S3 get {key}: {e}") from e
+    
+    def list(self, suffix):
+        from botocore.exceptions import BotoCoreError, ClientError
+        keys = []
+        try:
+            paginator = self.client.get_paginator('list_objects_v2')
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=f"{self.prefix}/"):
+                for obj in page.get('Contents', []):
+                    key = obj['Key'][len(self.prefix) + 1:]
+                    if key.endswith(suffix):
+                        keys.append(key)
+        except (BotoCoreError, ClientError) as e:
+            raise OSError(f"S3 list {self.prefix}/: {e}") from e
+        return sorted(keys)
+
+
+def get_store(timeout=None):
+    return S3ArchiveStore(timeout=timeout) if ARCHIVE_S3_PREFIX else LocalArchiveStore()
+
+
+# --- Archival job -----------------------------------------------------------
+
+def _partition(created_at):
+    return f"date={(created_at or '')[:10] or 'unknown'}"
+
+def _raw_size(rows):
+    """Approximate on-disk size of rows in the live tables"""
+    return sum(len(str(v)) for row in rows for v in row.values() if v is not None)
+
+def archive_shard(shard, store, cutoff, dry_run=False, batch_size=5000):
+    """Archive one shard's terminal packages created before cutoff"""
+    conn = get_db_connection(shard)
+    marks = ', '.join('?' for _ in TERMINAL_STATUSES)
+    cursor = execute_query(conn, f'''
+        SELECT {', '.join(PACKAGE_COLUMNS)} FROM packages
+        WHERE status IN ({marks}) AND created_at < ?
+        ORDER BY created_at
+    ''', TERMINAL_STATUSES + (cutoff,))
+    columns = [col[0] for col in cursor.description]
+    packages = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    
+    report = {'packages': 0, 'deliveries': 0, 'partitions': 0, 'raw_bytes': 0, 'archive_bytes': 0}
+    partitions = {}
+    for package in packages:
+        partitions.setdefault(_partition(package['created_at']), []).append(package)
+    
+    run_id = f"{int(time.time())}-{uuid.uuid4().hex[:6]}"
+    for partition, rows in sorted(partitions.items()):
+        ids = [p['id'] for p in rows]
+        deliveries = []
+        for start in range(0, len(ids), batch_size):
+            chunk = ids[start:start + batch_size]
+            cursor = execute_query(conn, f'''
+                SELECT {', '.join(DELIVERY_COLUMNS)} FROM deliveries
+                WHERE package_id IN ({', '.join('?' for _ in chunk)})
+            ''', chunk)
+            deliveries.extend(dict(zip(DELIVERY_COLUMNS, row)) for row in cursor.fetchall())
+        
+        package_file = encode_columns(PACKAGE_COLUMNS, rows)
+        delivery_file = encode_columns(DELIVERY_COLUMNS, deliveries)
+        index = {'tracking_id': [p['tracking_id'] for p in rows], 'id': ids}
+        index_file = zlib.compress(json.dumps(index, separators=(',', ':')).encode('utf-8'), 9)
+        bloom_file = BloomFilter.for_index(index).to_bytes()
+        
+        report['packages'] += len(rows)
+        report['deliveries'] += len(deliveries)
+        report['partitions'] += 1
+        report['raw_bytes'] += _raw_size(rows) + _raw_size(deliveries)
+        report['archive_bytes'] += len(package_file) + len(delivery_file) + len(index_file) + len(bloom_file)
+        if dry_run:
+            continue
+        
+        # Write the archive before deleting: a crash in between leaves the
+        # rows in both places, never in neither
+        store.put(f"{partition}/packages-{run_id}.col", package_file)
+        store.put(f"{partition}/deliveries-{run_id}.col", delivery_file)
+        store.put(f"{partition}/packages-{run_id}.bloom", bloom_file)
+        store.put(f"{partition}/packages-{run_id}.idx", index_file)
+        for start in range(0, len(ids), batch_size):
+            chunk = ids[start:start + batch_size]
+            marks = ', '.join('?' for _ in chunk)
+            execute_query(conn, f'DELETE FROM deliveries WHERE package_id IN ({marks})', chunk)
+            execute_query(conn, f'DELETE FROM packages WHERE id IN ({marks})', chunk)
+        conn.commit()
+    conn.close()
+    return report
+
+def archive_packages(days=ARCHIVE_AFTER_DAYS, dry_run=False, store=None, vacuum=False):
+    """Archive terminal packages older than days on every shard
+    
+    Returns a summary with row counts and raw_bytes, the approximate space
+    the rows occupy in the database (reclaimed once the shard is vacuumed).
+    """
+    store = store or get_store()
+    cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+    summary = {'cutoff': cutoff, 'dry_run': dry_run, 'shards': {}}
+    totals = {'packages': 0, 'deliveries': 0, 'partitions': 0, 'raw_bytes': 0, 'archive_bytes': 0}
+    for shard in router.shards:
+        report = archive_shard(shard, store, cutoff, dry_run)
+        summary['shards'][shard or 'default'] = report
+        for key in totals:
+            totals[key] += report[key]
+        if vacuum and not dry_run and report['packages'] and DB_TYPE != 'postgres':
+            conn = get_db_connection(shard)
+            conn.execute('VACUUM')
+            conn.close()
+            rebuild_search_index(shard)
+    summary.update(totals)
+    archive_index.invalidate()
+    return summary
+
+
+# --- Lookups ----------------------------------------------------------------
+
+class ArchiveUnavailable(Exception):
+    """The archive could not be searched in time; the caller should retry"""
+
+
+class ArchiveIndex:
+    """Partition listing, every partition's Bloom filter, and an LRU cache of
+    partition tracking_id/id indexes
+    
+    Bloom filters are loaded once per partition (the .bloom file, or built
+    from the .idx of partitions archived before .bloom files were written)
+    and kept. A lookup fetches only the indexes whose filter may contain the
+    key, at most max_partitions of which are kept. A lookup that cannot
+    finish within ARCHIVE_LOOKUP_TIMEOUT (a slow store, or filters still to
+    load after a new listing) raises ArchiveUnavailable rather than holding
+    the request; what it did load stays for the retry.
+    """
+    
+    def __init__(self, store=None, max_partitions=ARCHIVE_INDEX_CACHE):
+        self._store = store
+        self.max_partitions = max_partitions
+        self._keys = []
+        self._bloom_files = set()
+        self._blooms = {}
+        self._indexes = OrderedDict()
+        self._listed_at = 0
+        self._lock = threading.Lock()
+    
+    @property
+    def store(self):
+        if self._store is None:
+            self._store = get_store(ARCHIVE_S3_TIMEOUT)
+        return self._store
+    
+    def invalidate(self):
+        self._listed_at = 0
+    
+    def _partitions(self, deadline):
+        """(index key, Bloom filter) per partition, newest first"""
+        if time.time() - self._listed_at >= ARCHIVE_LISTING_TTL:
+            with self._lock:
+                if time.time() - self._listed_at >= ARCHIVE_LISTING_TTL:
+                    keys = self.store.list(('.idx', '.bloom'))
+                    self._bloom_files = {k for k in keys if k.endswith('.bloom')}
+                    # Recently archived parcels are looked up most
+                    self._keys = sorted((k for k in keys if k.endswith('.idx')), reverse=True)
+                    self._blooms = {k: v for k, v in self._blooms.items() if k in self._keys}
+                    self._listed_at = time.time()
+        keys = self._keys
+        for key in keys:
+            if key not in self._blooms:
+                if time.monotonic() > deadline:
+                    raise ArchiveUnavailable("Archive lookup timed out")
+                self._blooms[key] = self._load_bloom(key)
+        return [(key, self._blooms[key]) for key in keys]
+    
+    def _load_bloom(self, key):
+        bloom_key = key[:-len('.idx')] + '.bloom'
+        if bloom_key in self._bloom_files:
+            return BloomFilter.from_bytes(self.store.get(bloom_key))
+        return BloomFilter.for_index(json.loads(zlib.decompress(self.store.get(key))))
+    
+    def _index(self, key, deadline):
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is not None:
+                self._indexes.move_to_end(key)
+                return index
+        if time.monotonic() > deadline:
+            raise ArchiveUnavailable("Archive lookup timed out")
+        # Fetched outside the lock so one slow partition does not stall other lookups
+        raw = json.loads(zlib.decompress(self.store.get(key)))
+        index = {
+            'tracking_id': {v: i for i, v in enumerate(raw['tracking_id'])},
+            'id': {v: i for i, v in enumerate(raw['id'])}
+        }
+        with self._lock:
+            self._indexes[key] = index
+            self._indexes.move_to_end(key)
+            while len(self._indexes) > self.max_partitions:
+                self._indexes.popitem(last=False)
+        return index
+    
+    def lookup(self, column, value):
+        """Return the archived package dict whose column equals value, or None"""
+        deadline = time.monotonic() + ARCHIVE_LOOKUP_TIMEOUT
+        hashes = BloomFilter.hashes(f"{column}:{value}")
+        try:
+            for key, bloom in self._partitions(deadline):
+                if not bloom.might_contain(hashes):
+                    continue
+                row = self._index(key, deadline)[column].get(value)
+                if row is None:
+                    continue
+                data = decode_columns(self.store.get(key[:-len('.idx')] + '.col'))
+                # Columns added after a partition was written read back as None
+                package = {name: data[name][row] if name in data else None for name in PACKAGE_COLUMNS}
+                package['archived'] = True
+                return package
+        except RuntimeError as e:
+            print(f"Archive lookup unavailable: {e}")
+            return None
+        except OSError as e:
+            print(f"Archive lookup failed: {e}")
+            raise ArchiveUnavailable(str(e)) from e
+        return None
+
+
+archive_index = ArchiveIndex()
+
+def find_archived_package(tracking_id=None, package_id=None):
+    """Look up an archived package by tracking_id or id (ArchiveUnavailable if it took too long)"""
+    if tracking_id is not None:
+        return archive_index.lookup('tracking_id', tracking_id)
+    return archive_index.lookup('id', package_id)
@@ -0,0 +1,37 @@
+"""Move old delivered/cancelled packages to compressed columnar archive files
+
+Usage:
+    python3 archive_packages.py [--days 30] [--dry-run] [--vacuum]
+
+Archives to ARCHIVE_DIR (default ./archive) or, when ARCHIVE_S3_PREFIX is
+set, to that prefix in S3_BUCKET. Schedule it daily, e.g. from cron.
+"""
+import argparse
+from archive import ARCHIVE_AFTER_DAYS, archive_packages
+
+def format_bytes(count):
+    for unit in ['B', 'KB', 'MB', 'GB']:
+        if count < 1024:
+            return f"{count:.1f} {unit}"
+        count /= 1024
+    return f"{count:.1f} TB"
+
+def main():
+    parser = argparse.ArgumentParser(description='Archive terminal-state packages')
+    parser.add_argument('--days', type=int, default=ARCHIVE_AFTER_DAYS,
+                        help='Archive packages created more than this many days ago')
+    parser.add_argument('--dry-run', action='store_true', help='Only report what would be archived')
+    parser.add_argument('--vacuum', action='store_true', help='VACUUM SQLite shards afterwards to free the space')
+    args = parser.parse_args()
+    
+    summary = archive_packages(days=args.days, dry_run=args.dry_run, vacuum=args.vacuum)
+    for shard, report in summary['shards'].items():
+        print(f"{shard}: {report['packages']} packages, {report['deliveries']} deliveries "
+              f"in {report['partitions']} partitions")
+    verb = 'Would archive' if args.dry_run else 'Archived'
+    print(f"{verb} {summary['packages']} packages created before {summary['cutoff']}")
+    print(f"Space reclaimed from the database: ~{format_bytes(summary['raw_bytes'])}")
+    print(f"Archive size: {format_bytes(summary['archive_bytes'])}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,566 @@
+"""ASGI entry point: the API routes as asyncio handlers
+
+    uvicorn asgi_app:app                       (single process)
+    ASGI=1 ./serve.sh start                    (gunicorn with uvicorn workers)
+
+The routes in app.py wait almost all of their time on the database and on
+SES/SNS, and a sync worker holds a whole thread (or process) for each request
+while it waits. Here the routes below run as coroutines on one event loop per
+worker, with the database through async_db.py (asyncpg / aiosqlite) and AWS
+through async_aws.py (aiobotocore), so a worker keeps many requests waiting
+at once. I/O that does not depend on each other runs concurrently: the email
+and SNS notification of a create or status change, the per-shard queries of
+list/status/dashboard reads, and the shard probes that locate a package.
+
+Responses match app.py: same JSON, status codes, CORS headers, gzip,
+admission control, bearer-token checks and request metrics. Everything else
+is served by the Flask app itself on a thread pool (ASGI_FLASK_THREADS):
+- the routes not listed here (search, ETA batch, driver locations, dispatch,
+  analytics, logout, admin, metrics, the UI)
+- CORS preflights (OPTIONS)
+- requests with an Idempotency-Key header, whose replay store lives in
+  idempotency.py
+Slow-request capture (profiler.py) only covers the Flask-served routes.
+"""
+import asyncio
+import contextlib
+import gzip
+import json
+import math
+import os
+import traceback
+from datetime import datetime
+from starlette.datastructures import UploadFile
+from starlette.responses import Response
+from starlette.routing import Route, Router
+from werkzeug.http import parse_accept_header
+from app import app as flask_app
+from archive import ArchiveUnavailable, find_archived_package
+from db_config import router
+from delivery_optimizer import Location, DistanceCalculator, PricingEngine
+from geocoder import geocode_ireland_address
+from static_assets import COMPRESS_MIN_BYTES, COMPRESS_LEVEL
+import admission
+import async_aws
+import async_db
+import auth
+import dispatch
+import eta
+import ids
+import metrics
+import repository
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    raise ImportError("a2wsgi is required for the ASGI app. Install with: pip install a2wsgi")
+
+ASGI_FLASK_THREADS = int(os.getenv('ASGI_FLASK_THREADS', '10'))
+
+flask_asgi = WSGIMiddleware(flask_app, workers=ASGI_FLASK_THREADS)
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+@metrics.timed('json')
+def dumps(body):
+    # As Flask's jsonify outside debug mode
+    return json.dumps(body, sort_keys=True, separators=(',', ':')) + '\n'
+
+def respond(request, body, status=200, headers=None):
+    """JSON response with app.py's CORS and compression headers"""
+    data = dumps(body).encode('utf-8')
+    headers = dict(headers or {})
+    vary = []
+    origin = request.headers.get('origin')
+    if origin:
+        headers['Access-Control-Allow-Origin'] = origin
+        vary.append('Origin')
+    if len(data) >= COMPRESS_MIN_BYTES:
+        vary.append('Accept-Encoding')
+        if parse_accept_header(request.headers.get('accept-encoding'))['gzip'] > 0:
+            data = gzip.compress(data, COMPRESS_LEVEL)
+            headers['Content-Encoding'] = 'gzip'
+    if vary:
+        headers['Vary'] = ', '.join(vary)
+    return Response(data, status, headers, media_type='application/json')
+
+async def json_body(request):
+    """Parsed JSON body, as Flask's request.json (415 unless sent as JSON, 400 if malformed)"""
+    content_type = request.headers.get('content-type', '').split(';')[0].strip().lower()
+    if content_type != 'application/json' and not content_type.endswith('+json'):
+        raise HTTPError(415, 'Request body must be JSON')
+    body = await request.body()
+    try:
+        return json.loads(body)
+    except ValueError:
+        raise HTTPError(400, 'Failed to decode JSON object')
+
+async def package_shard(package_id):
+    """Shard holding package_id (home shard if unknown)"""
+    shard = await async_db.locate_package(package_id)
+    return shard if shard is not None else router.home_shard
+
+async def insert_package(package_id, fields):
+    """app.insert_package: a new tracking ID, drawn again (a few times) if it is already taken"""
+    for _ in range(ids.TRACKING_ID_ATTEMPTS):
+        tracking_id = ids.tracking_id()
+        async with async_db.transaction(router.shard_for(tracking_id)) as conn:
+            inserted = await conn.run(repository.INSERT_PACKAGE, (package_id, tracking_id) + fields)
+        if inserted:
+            return tracking_id
+    raise RuntimeError(f"No free tracking ID after {ids.TRACKING_ID_ATTEMPTS} attempts")
+
+async def notify(call, kind):
+    """Await a notification; a failure is logged and does not fail the request"""
+    try:
+        await call
+    except Exception as e:
+        print(f"{kind} notification error: {e}")
+
+async def admit(request, route):
+    """admission.check for this request (token checks and the Redis buckets run off the event loop)"""
+    args = (request.headers.get('authorization', ''), request.headers.get('x-forwarded-for'),
+            request.client.host if request.client else None)
+    # A token's user may need a users-table lookup
+    client = await asyncio.to_thread(admission.client_key, *args) if args[0] else admission.client_key(*args)
+    if admission.RATE_LIMIT_REDIS_URL:
+        return await asyncio.to_thread(admission.check, route, client)
+    return admission.check(route, client)
+
+async def authorize(request, route):
+    """None, or the 401 app.py's auth.check_request would answer"""
+    if route in auth.PUBLIC_ENDPOINTS:
+        return None
+    header = request.headers.get('authorization')
+    # A cache miss queries the users and revoked_tokens tables
+    user, _, error = await asyncio.to_thread(auth.verify, header) if header else (None, None, None)
+    if error is None and user is None and auth.AUTH_REQUIRED:
+        error = 'Authentication required'
+    if error:
+        return respond(request, {'error': error}, 401, {'WWW-Authenticate': 'Bearer'})
+    return None
+
+def handler(fn):
+    """Wrap a route coroutine with admission, authentication, metrics and error handling"""
+    route = fn.__name__
+    
+    async def endpoint(request):
+        started = metrics.request_started()
+        status = 500
+        admitted = False
+        try:
+            if admission.ADMISSION_CONTROL:
+                rejected = await admit(request, route)
+                if rejected is not None:
+                    code, message, retry_after = rejected
+                    response = respond(request, {'error': message}, code,
+                                       {'Retry-After': str(max(1, math.ceil(retry_after)))})
+                    status = response.status_code
+                    return response
+                admitted = True
+            response = await authorize(request, route)
+            if response is None:
+                try:
+                    response = await fn(request, **request.path_params)
+                except HTTPError as e:
+                    response = respond(request, {'error': e.message}, e.status)
+                except Exception:
+                    traceback.print_exc()
+                    response = respond(request, {'error': 'Internal Server Error'}, 500)
+            status = response.status_code
+            return response
+        finally:
+            if admitted:
+                admission.limiter.release(route)
+            metrics.request_finished(started, route, request.method, status)
+    
+    endpoint.__name__ = route
+    return endpoint
+
+
+# 1. REGISTER
+async def register(request):
+    data = await json_body(request)
+    user_id = ids.new_id()
+    
+    async with async_db.transaction(router.home_shard) as conn:
+        if await conn.scalar(repository.USER_ID_BY_EMAIL, (data['email'],)):
+            return respond(request, {'error': 'Email already registered'}, 409)
+        await conn.run(repository.INSERT_USER, (user_id, data['email'], data['password'],
+                                                data['name'], auth.DEFAULT_ROLE))
+    
+    token = auth.issue_token(user_id)
+    return respond(request, {'token': token, 'user_id': user_id})
+
+# 2. LOGIN
+async def login(request):
+    data = await json_body(request)
+    async with async_db.connect(router.home_shard) as conn:
+        user_id = await conn.scalar(repository.USER_ID_BY_LOGIN, (data['email'], data['password']))
+    
+    if user_id:
+        token = auth.issue_token(user_id)
+        return respond(request, {'token': token, 'user_id': user_id})
+    return respond(request, {'error': 'Invalid credentials'}, 401)
+
+# 3. CREATE PACKAGE
+async def create_package(request):
+    data = await json_body(request)
+    weight_kg = data.get('weight_kg', 1.0)
+    if not dispatch.valid_weight(weight_kg):
+        raise HTTPError(400, 'weight_kg must be a positive number')
+    
+    pickup_address = data.get('pickup_address', '')
+    delivery_address = data.get('recipient_address', '')
+    
+    # In-memory lookups, nothing to wait on
+    pickup_lat, pickup_lon = geocode_ireland_address(pickup_address)
+    delivery_lat, delivery_lon = geocode_ireland_address(delivery_address)
+    
+    if 'pickup_lat' in data and 'pickup_lon' in data:
+        pickup_lat = data['pickup_lat']
+        pickup_lon = data['pickup_lon']
+    if 'delivery_lat' in data and 'delivery_lon' in data:
+        delivery_lat = data['delivery_lat']
+        delivery_lon = data['delivery_lon']
+    
+    pickup = Location(pickup_lat, pickup_lon, pickup_address)
+    delivery = Location(delivery_lat, delivery_lon, delivery_address)
+    distance = DistanceCalculator.calculate(pickup, delivery)
+    
+    pricing = PricingEngine()
+    price = pricing.calculate(distance, weight_kg)
+    
+    package_id = ids.new_id()
+    
+    recipient_email = data.get('recipient_email', '')
+    
+    tracking_id = await insert_package(package_id, (data.get('sender_id', 'guest'), data['recipient_name'],
+                                                    recipient_email, data['recipient_address'],
+                                                    data['pickup_address'], 'pending', distance, price, None,
+                                                    datetime.now().isoformat(), pickup_lat, pickup_lon,
+                                                    delivery_lat, delivery_lon, weight_kg))
+    
+    # Email and SNS at the same time
+    notifications = [notify(async_aws.notify_package_status(tracking_id, 'pending', recipient_email), 'SNS')]
+    if recipient_email:
+        notifications.append(notify(async_aws.send_package_created_email(
+            tracking_id, data['recipient_name'], recipient_email,
+            data['recipient_address'], distance, price
+        ), 'Email'))
+    await asyncio.gather(*notifications)
+    
+    return respond(request, {
+        'package_id': package_id,
+        'tracking_id': tracking_id,
+        'distance_km': distance,
+        'estimated_price': price,
+        'status': 'pending',
+        'email_sent': bool(recipient_email)
+    }, 201)
+
+# 4. TRACK PACKAGE
+async def track_package(request, tracking_id):
+    if ids.mistyped_tracking_id(tracking_id):
+        return respond(request, {'error': 'Not found'}, 404)
+    
+    async with async_db.connect(router.shard_for(tracking_id)) as conn:
+        package = await conn.one(repository.TRACKED_PACKAGE, (tracking_id,))
+    
+    if package:
+        package = package._asdict()
+        package['eta'] = eta.package_eta(package, package.pop('accepted_at'))
+        return respond(request, package)
+    
+    try:
+        package = await asyncio.to_thread(find_archived_package, tracking_id=tracking_id)
+    except ArchiveUnavailable:
+        return respond(request, {'error': 'Archive lookup timed out, please retry'}, 503, {'Retry-After': '1'})
+    if package:
+        package['eta'] = None
+        return respond(request, package)
+    return respond(request, {'error': 'Not found'}, 404)
+
+# 5. LIST PACKAGES
+async def list_packages(request):
+    packages = await async_db.gather(repository.RECENT_PACKAGES, limit=10)
+    return respond(request, [package._asdict() for package in packages])
+
+# 6. UPDATE STATUS
+async def update_status(request, package_id):
+    data = await json_body(request)
+    new_status = data['status']
+    await change_package_status(package_id, new_status)
+    return respond(request, {'success': True, 'status': new_status})
+
+async def change_package_status(package_id, new_status):
+    """app.change_package_status, with the email and SNS notification sent together"""
+    async with async_db.transaction(await package_shard(package_id)) as conn:
+        package = await conn.one(repository.PACKAGE_BY_ID, (package_id,))
+        updated = await conn.run(repository.SET_STATUS, (new_status, package_id)) > 0
+        if package and updated:
+            await conn.run(repository.INSERT_DELIVERY, (ids.new_id(), package_id, package.driver_id,
+                                                        new_status, datetime.now().isoformat()))
+    
+    if package and updated:
+        tracking_id = package.tracking_id
+        recipient_email = package.recipient_email or ''
+        recipient_name = package.recipient_name or 'Customer'
+        recipient_address = package.recipient_address or ''
+        
+        notifications = [notify(async_aws.notify_package_status(
+            tracking_id, new_status, recipient_email or 'customer@example.com'), 'SNS')]
+        if recipient_email:
+            notifications.append(notify(async_aws.send_status_update_email(
+                tracking_id, new_status, recipient_name, recipient_email, recipient_address
+            ), 'Email'))
+        await asyncio.gather(*notifications)
+    
+    return updated
+
+# 7. ASSIGN DRIVER
+async def accept_delivery(request, package_id):
+    data = await json_body(request)
+    driver_id = data.get('driver_id', '')
+    driver_name = data.get('driver_name', 'Driver')
+    
+    delivery_id = ids.new_id()
+    
+    async with async_db.transaction(await package_shard(package_id)) as conn:
+        package = await conn.one(repository.PACKAGE_BY_ID, (package_id,))
+        await conn.run(repository.INSERT_DELIVERY, (delivery_id, package_id, driver_id,
+                                                    'accepted', datetime.now().isoformat()))
+        await conn.run(repository.ASSIGN_DRIVER, ('assigned', driver_id, package_id))
+    
+    if package and package.recipient_email:
+        await notify(async_aws.send_driver_assigned_email(
+            package.tracking_id,
+            package.recipient_name or 'Customer',
+            package.recipient_email,
+            driver_name
+        ), 'Email')
+    
+    return respond(request, {'delivery_id': delivery_id, 'status': 'assigned'})
+
+# 8. UPLOAD FILE TO S3
+async def upload_package_file(request, package_id):
+    """Upload file/document for a package to S3"""
+    form = await request.form()
+    file = form.get('file')
+    if not isinstance(file, UploadFile):
+        return respond(request, {'error': 'No file provided'}, 400)
+    if not file.filename:
+        return respond(request, {'error': 'No file selected'}, 400)
+    
+    file_content = await file.read()
+    file_name = f"{package_id}_{file.filename}"
+    
+    s3_url = await async_aws.upload_file(file_content, file_name, file.content_type)
+    
+    if s3_url:
+        return respond(request, {
+            'success': True,
+            'file_url': s3_url,
+            'file_name': file_name
+        })
+    return respond(request, {'error': 'Failed to upload to S3'}, 500)
+
+# 9. GET S3 FILE URL
+async def get_package_file_url(request, package_id, file_name):
+    """Get presigned URL for package file"""
+    url = await async_aws.get_file_url(file_name)
+    if url:
+        return respond(request, {'file_url': url})
+    return respond(request, {'error': 'File not found'}, 404)
+
+# 10. DASHBOARD STATISTICS
+async def dashboard_stats(request):
+    # Both aggregates on every shard at once
+    totals_by_shard, counts_by_shard = await asyncio.gather(async_db.scatter(repository.PACKAGE_TOTALS),
+                                                            async_db.scatter(repository.STATUS_COUNTS))
+    total_packages = 0
+    total_revenue = 0.0
+    distance_sum = 0.0
+    distance_count = 0
+    for rows in totals_by_shard:
+        totals = rows[0]
+        total_packages += totals.total or 0
+        total_revenue += float(totals.revenue or 0)
+        distance_sum += float(totals.distance_sum or 0)
+        distance_count += totals.distance_count or 0
+    
+    status_counts = {}
+    for rows in counts_by_shard:
+        for row in rows:
+            status_counts[row.status] = status_counts.get(row.status, 0) + row.count
+    
+    avg_distance = distance_sum / distance_count if distance_count else 0.0
+    
+    return respond(request, {
+        'total_packages': total_packages,
+        'status_counts': status_counts,
+        'total_revenue': round(total_revenue, 2),
+        'average_distance': round(avg_distance, 2)
+    })
+
+# 11. GET PACKAGES BY STATUS
+async def get_packages_by_status(request, status):
+    packages = await async_db.gather(repository.PACKAGES_BY_STATUS, (status,))
+    return respond(request, [package._asdict() for package in packages])
+
+# 12. UPDATE PACKAGE (Full Update)
+async def update_package(request, package_id):
+    data = await json_body(request)
+    if data.get('weight_kg') is not None and not dispatch.valid_weight(data['weight_kg']):
+        raise HTTPError(400, 'weight_kg must be a positive number')
+    
+    async with async_db.transaction(await package_shard(package_id)) as conn:
+        package = await conn.one(repository.PACKAGE_BY_ID, (package_id,))
+        
+        if not package:
+            return respond(request, {'error': 'Package not found'}, 404)
+        
+        recipient_name = data.get('recipient_name', package.recipient_name)
+        recipient_email = data.get('recipient_email', package.recipient_email or '')
+        recipient_address = data.get('recipient_address', package.recipient_address)
+        pickup_address = data.get('pickup_address', package.pickup_address)
+        weight_kg = data.get('weight_kg')
+        if weight_kg is None:
+            # Packages created before weights were stored are priced as 1 kg
+            weight_kg = await conn.scalar(repository.PACKAGE_WEIGHT, (package_id,))
+            if weight_kg is None:
+                weight_kg = 1.0
+        else:
+            await conn.run(repository.SET_WEIGHT, (weight_kg, package_id))
+        
+        if 'recipient_address' in data or 'pickup_address' in data:
+            pickup_lat, pickup_lon = geocode_ireland_address(pickup_address)
+            delivery_lat, delivery_lon = geocode_ireland_address(recipient_address)
+            pickup = Location(pickup_lat, pickup_lon, pickup_address)
+            delivery = Location(delivery_lat, delivery_lon, recipient_address)
+            distance = DistanceCalculator.calculate(pickup, delivery)
+            pricing = PricingEngine()
+            price = pricing.calculate(distance, weight_kg)
+            await conn.run(repository.SET_COORDINATES, (pickup_lat, pickup_lon, delivery_lat, delivery_lon,
+                                                        package_id))
+        else:
+            distance = package.distance
+            price = package.price
+        
+        await conn.run(repository.UPDATE_PACKAGE, (recipient_name, recipient_email, recipient_address,
+                                                   pickup_address, distance, price, package_id))
+    
+    return respond(request, {
+        'success': True,
+        'message': 'Package updated successfully',
+        'package_id': package_id,
+        'distance_km': distance,
+        'price': price
+    })
+
+# 13. DELETE PACKAGE
+async def delete_package(request, package_id):
+    async with async_db.transaction(await package_shard(package_id)) as conn:
+        package = await conn.one(repository.PACKAGE_BY_ID, (package_id,))
+        if not package:
+            return respond(request, {'error': 'Package not found'}, 404)
+        await conn.run(repository.DELETE_PACKAGE, (package_id,))
+    
+    tracking_id = package.tracking_id
+    recipient_email = package.recipient_email or ''
+    
+    if recipient_email:
+        await notify(async_aws.send_email(
+            recipient_email,
+            f'Package {tracking_id} Deleted',
+            f'<p>Your package with tracking ID {tracking_id} has been deleted from the system.</p>',
+            f'Your package with tracking ID {tracking_id} has been deleted from the system.'
+        ), 'Email')
+    
+    return respond(request, {
+        'success': True,
+        'message': 'Package deleted successfully',
+        'tracking_id': tracking_id
+    })
+
+# 14. GET SINGLE PACKAGE BY ID
+async def get_package_by_id(request, package_id):
+    async with async_db.connect(await package_shard(package_id)) as conn:
+        package = await conn.one(repository.PACKAGE_BY_ID, (package_id,))
+    
+    if package:
+        return respond(request, package._asdict())
+    
+    try:
+        package = await asyncio.to_thread(find_archived_package, package_id=package_id)
+    except ArchiveUnavailable:
+        return respond(request, {'error': 'Archive lookup timed out, please retry'}, 503, {'Retry-After': '1'})
+    if package:
+        return respond(request, package)
+    return respond(request, {'error': 'Not found'}, 404)
+
+# HEALTH CHECK
+async def health(request):
+    s3_bucket = os.getenv('S3_BUCKET', '')
+    s3_status = 'configured' if s3_bucket else 'not configured'
+    
+    try:
+        async with async_db.connect(router.home_shard) as conn:
+            await conn.scalar(repository.PING)
+        db_status = 'connected'
+    except Exception:
+        db_status = 'disconnected'
+    
+    return respond(request, {
+        'status': 'ok',
+        'services': ['RDS', 'S3', 'SNS', 'SES', 'CloudWatch', 'IAM'],
+        's3_status': s3_status,
+        's3_bucket': s3_bucket if s3_bucket else 'not configured',
+        'database_status': db_status
+    })
+
+
+@contextlib.asynccontextmanager
+async def lifespan(_):
+    await async_aws.start()
+    try:
+        yield
+    finally:
+        await async_aws.stop()
+        await async_db.close()
+
+routes = [
+    Route('/api/auth/register', handler(register), methods=['POST']),
+    Route('/api/auth/login', handler(login), methods=['POST']),
+    Route('/api/packages', handler(create_package), methods=['POST']),
+    Route('/api/packages', handler(list_packages), methods=['GET']),
+    # Served by Flask; listed so /api/packages/{tracking_id} does not take it
+    Route('/api/packages/search', flask_asgi),
+    Route('/api/packages/{tracking_id}', handler(track_package), methods=['GET']),
+    Route('/api/packages/{package_id}', handler(update_package), methods=['PUT']),
+    Route('/api/packages/{package_id}', handler(delete_package), methods=['DELETE']),
+    Route('/api/packages/{package_id}/status', handler(update_status), methods=['PUT']),
+    Route('/api/deliveries/accept/{package_id}', handler(accept_delivery), methods=['POST']),
+    Route('/api/packages/{package_id}/upload', handler(upload_package_file), methods=['POST']),
+    Route('/api/packages/{package_id}/files/{file_name}', handler(get_package_file_url), methods=['GET']),
+    Route('/api/dashboard/stats', handler(dashboard_stats), methods=['GET']),
+    Route('/api/packages/status/{status}', handler(get_packages_by_status), methods=['GET']),
+    Route('/api/packages/id/{package_id}', handler(get_package_by_id), methods=['GET']),
+    Route('/api/health', handler(health), methods=['GET']),
+]
+
+native = Router(routes, default=flask_asgi, lifespan=lifespan)
+
+async def app(scope, receive, send):
+    """The native routes, with preflights and Idempotency-Key requests handed to Flask"""
+    if scope['type'] == 'http' and (scope['method'] == 'OPTIONS'
+                                    or any(name == b'idempotency-key' for name, _ in scope['headers'])):
+        await flask_asgi(scope, receive, send)
+    else:
+        await native(scope, receive, send)
@@ -0,0 +1,131 @@
+"""Async S3, SNS and SES for the ASGI app (asgi_app.py)
+
+The calls in aws_services.py on aiobotocore clients, so a request waiting on
+AWS does not hold a thread. Configuration, messages and return values are
+those of aws_services; the clients are opened by start() when a worker
+starts and closed by stop().
+"""
+import contextlib
+import aws_services
+from aws_services import SNSService, SESService, email_message, report_ses_error
+from botocore.exceptions import ClientError
+from metrics import timed
+
+s3_client = None
+sns_client = None
+ses_client = None
+_clients = None
+
+async def start():
+    """Open the clients configured in aws_services (any already set, such as fakes, are kept)"""
+    global s3_client, sns_client, ses_client, _clients
+    try:
+        from aiobotocore.session import get_session
+    except ImportError:
+        raise ImportError("aiobotocore is required for the ASGI app. Install with: pip install aiobotocore")
+    session = get_session()
+    _clients = contextlib.AsyncExitStack()
+    
+    async def client(service):
+        return await _clients.enter_async_context(session.create_client(service, region_name=aws_services.AWS_REGION))
+    
+    if s3_client is None and aws_services.S3_BUCKET:
+        s3_client = await client('s3')
+    if sns_client is None and aws_services.SNS_TOPIC_ARN:
+        sns_client = await client('sns')
+    if ses_client is None:
+        ses_client = await client('ses')
+
+async def stop():
+    global s3_client, sns_client, ses_client, _clients
+    if _clients is not None:
+        await _clients.aclose()
+        s3_client = sns_client = ses_client = _clients = None
+
+
+@timed('s3')
+async def upload_file(file_content, file_name, content_type='application/octet-stream'):
+    """Upload file to S3"""
+    bucket = aws_services.S3_BUCKET
+    if not s3_client or not bucket:
+        return None
+    
+    try:
+        key = f"packages/{file_name}"
+        await s3_client.put_object(Bucket=bucket, Key=key, Body=file_content, ContentType=content_type)
+        return f"https://{bucket}.s3.{aws_services.AWS_REGION}.amazonaws.com/{key}"
+    except ClientError as e:
+        print(f"Error uploading to S3: {e}")
+        return None
+
+@timed('s3')
+async def get_file_url(file_name):
+    """Get presigned URL for file"""
+    bucket = aws_services.S3_BUCKET
+    if not s3_client or not bucket:
+        return None
+    
+    try:
+        return await s3_client.generate_presigned_url(
+            'get_object',
+            Params={'Bucket': bucket, 'Key': f"packages/{file_name}"},
+            ExpiresIn=3600
+        )
+    except ClientError as e:
+        print(f"Error generating S3 URL: {e}")
+        return None
+
+@timed('sns')
+async def publish_notification(message, subject="Courier Delivery Update"):
+    """Publish notification to SNS topic"""
+    topic = aws_services.SNS_TOPIC_ARN
+    if not sns_client or not topic:
+        print("SNS not configured - skipping notification")
+        return False
+    
+    try:
+        response = await sns_client.publish(TopicArn=topic, Message=message, Subject=subject)
+        print(f"SNS notification sent: {response.get('MessageId')}")
+        return response.get('MessageId') is not None
+    except ClientError as e:
+        print(f"Error publishing to SNS: {e}")
+        return False
+
+async def notify_package_status(tracking_id, status, recipient_email):
+    """Send package status notification via SNS"""
+    return await publish_notification(*SNSService.status_notification(tracking_id, status))
+
+@timed('ses')
+async def send_email(to_email, subject, body_html=None, body_text=None, from_email=None):
+    """Send email using SES"""
+    try:
+        response = await ses_client.send_email(
+            Source=from_email or aws_services.SES_FROM_EMAIL,
+            Destination={'ToAddresses': [to_email]},
+            Message=email_message(subject, body_html, body_text)
+        )
+        print(f"Email sent successfully to {to_email}: {response.get('MessageId')}")
+        return response.get('MessageId') is not None
+    except ClientError as e:
+        report_ses_error(e, to_email)
+        return False
+    except Exception as e:
+        print(f"Unexpected error sending email: {e}")
+        return False
+
+async def send_package_created_email(tracking_id, recipient_name, recipient_email,
+                                     recipient_address, distance, price):
+    """Send email when package is created"""
+    return await send_email(recipient_email, *SESService.package_created_email(
+        tracking_id, recipient_name, recipient_address, distance, price))
+
+async def send_status_update_email(tracking_id, status, recipient_name, recipient_email,
+                                   recipient_address=None):
+    """Send email when package status is updated"""
+    return await send_email(recipient_email, *SESService.status_update_email(
+        tracking_id, status, recipient_name, recipient_address))
+
+async def send_driver_assigned_email(tracking_id, recipient_name, recipient_email, driver_name=None):
+    """Send email when driver is assigned"""
+    return await send_email(recipient_email, *SESService.driver_assigned_email(
+        tracking_id, recipient_name, driver_name))
@@ -0,0 +1,247 @@
+"""Async database access for the ASGI app (asgi_app.py)
+
+The same databases and shards as db_config, through asyncpg on PostgreSQL
+and aiosqlite on SQLite, running the queries declared in repository.py:
+
+    async with async_db.connect(shard) as conn:
+        package = await conn.one(repository.PACKAGE_BY_ID, (package_id,))
+    async with async_db.transaction(shard) as conn:
+        await conn.run(repository.SET_STATUS, ('delivered', package_id))
+
+Each worker keeps up to ASYNC_DB_POOL_SIZE connections per shard, opened on
+first use in its event loop. Unlike the sync app's per-request connections
+they outlive the request, so asyncpg's prepared statements and SQLite's
+statement cache are reused from one request to the next.
+"""
+import asyncio
+import contextlib
+import os
+import repository
+from db_config import DB_TYPE, DB_USER, DB_PASSWORD, SQLITE_PATH, _postgres_params, merge_sorted, router
+from metrics import timed
+
+ASYNC_DB_POOL_SIZE = int(os.getenv('ASYNC_DB_POOL_SIZE', '10'))
+
+
+class Connection:
+    """A pooled connection running repository.Query objects"""
+    
+    async def one(self, query, params=()):
+        """First row as a record, None if there is none"""
+        row = await self.fetch(self.text(query), params, one=True)
+        return query.record._make(row) if row is not None else None
+    
+    async def all(self, query, params=()):
+        make = query.record._make
+        return [make(row) for row in await self.fetch(self.text(query), params)]
+    
+    async def scalar(self, query, params=()):
+        """First column of the first row, None if there is no row"""
+        row = await self.fetch(self.text(query), params, one=True)
+        return row[0] if row is not None else None
+    
+    async def run(self, query, params=()):
+        """Run a write; returns the number of rows it changed"""
+        return await self.execute(self.text(query), params)
+
+
+class SQLiteConnection(Connection):
+    """aiosqlite connection; each runs its statements on a thread of its own"""
+    
+    def __init__(self, conn):
+        self.conn = conn
+    
+    @staticmethod
+    def text(query):
+        return query.sql
+    
+    @timed('db_query')
+    async def fetch(self, sql, params, one=False):
+        cursor = await self.conn.execute(sql, params)
+        try:
+            return await (cursor.fetchone() if one else cursor.fetchall())
+        finally:
+            await cursor.close()
+    
+    @timed('db_query')
+    async def execute(self, sql, params):
+        cursor = await self.conn.execute(sql, params)
+        await cursor.close()
+        return cursor.rowcount
+    
+    @contextlib.asynccontextmanager
+    async def transaction(self):
+        try:
+            yield
+        except BaseException:
+            await self.conn.rollback()
+            raise
+        await self.conn.commit()
+
+
+class PostgresConnection(Connection):
+    """asyncpg connection; statements with parameters are prepared and cached per connection"""
+    
+    def __init__(self, conn):
+        self.conn = conn
+    
+    @staticmethod
+    def text(query):
+        return query.numbered
+    
+    @timed('db_query')
+    async def fetch(self, sql, params, one=False):
+        if one:
+            return await self.conn.fetchrow(sql, *params)
+        return await self.conn.fetch(sql, *params)
+    
+    @timed('db_query')
+    async def execute(self, sql, params):
+        # Command tag: "UPDATE 2", "INSERT 0 1", "DELETE 0"
+        tag = await self.conn.execute(sql, *params)
+        count = tag.rsplit(' ', 1)[-1]
+        return int(count) if count.isdigit() else 0
+    
+    def transaction(self):
+        return self.conn.transaction()
+
+
+class SQLitePool:
+    """Up to size aiosqlite connections to one database file"""
+    
+    def __init__(self, path, size=ASYNC_DB_POOL_SIZE):
+        self.path = path
+        self.size = size
+        self.opened = 0
+        self.idle = []
+        self.waiters = asyncio.Queue()
+    
+    async def acquire(self):
+        if self.idle:
+            return self.idle.pop()
+        if self.opened >= self.size:
+            return await self.waiters.get()
+        try:
+            import aiosqlite
+        except ImportError:
+            raise ImportError("aiosqlite is required for the ASGI app on SQLite. Install with: pip install aiosqlite")
+        self.opened += 1
+        try:
+            return SQLiteConnection(await aiosqlite.connect(self.path))
+        except Exception:
+            self.opened -= 1
+            raise
+    
+    async def release(self, conn):
+        if conn.conn.in_transaction:
+            await conn.conn.rollback()
+        # Hand the connection straight to a waiting request, if there is one
+        if self.waiters._getters:
+            self.waiters.put_nowait(conn)
+        else:
+            self.idle.append(conn)
+    
+    async def close(self):
+        idle, self.idle = self.idle, []
+        for conn in idle:
+            await conn.conn.close()
+
+
+class PostgresPool:
+    """asyncpg pool for one shard, created on first use"""
+    
+    def __init__(self, shard, size=ASYNC_DB_POOL_SIZE):
+        self.shard = shard
+        self.size = size
+        self.pool = None
+        self._creating = asyncio.Lock()
+    
+    async def acquire(self):
+        if self.pool is None:
+            async with self._creating:
+                if self.pool is None:
+                    self.pool = await self._create()
+        return PostgresConnection(await self.pool.acquire())
+    
+    async def _create(self):
+        try:
+            import asyncpg
+        except ImportError:
+            raise ImportError("asyncpg is required for the ASGI app on PostgreSQL. Install with: pip install asyncpg")
+        host, port, name = _postgres_params(self.shard)
+        try:
+            return await asyncpg.create_pool(host=host, port=int(port), database=name, user=DB_USER,
+                                             password=DB_PASSWORD, ssl='require', min_size=1, max_size=self.size)
+        except Exception as e:
+            raise ConnectionError(f"Failed to connect to PostgreSQL: {e}")
+    
+    async def release(self, conn):
+        await self.pool.release(conn.conn)
+    
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
+
+
+_pools = {}
+
+def _pool(shard):
+    pool = _pools.get(shard)
+    if pool is None:
+        pool = _pools[shard] = PostgresPool(shard) if DB_TYPE == 'postgres' else SQLitePool(shard or SQLITE_PATH)
+    return pool
+
+@timed('db_connect')
+async def _acquire(pool):
+    return await pool.acquire()
+
+@contextlib.asynccontextmanager
+async def connect(shard):
+    """A pooled connection to shard (None is the single-node database)"""
+    pool = _pool(shard)
+    conn = await _acquire(pool)
+    try:
+        yield conn
+    finally:
+        await pool.release(conn)
+
+@contextlib.asynccontextmanager
+async def transaction(shard):
+    """A pooled connection whose writes are committed together on exit, or rolled back on error"""
+    async with connect(shard) as conn:
+        async with conn.transaction():
+            yield conn
+
+async def close():
+    """Close the idle connections of every pool (on worker shutdown)"""
+    pools = list(_pools.values())
+    _pools.clear()
+    for pool in pools:
+        await pool.close()
+
+
+async def locate_package(package_id):
+    """Shard holding package_id, or None; the shards are probed concurrently"""
+    if not router.is_sharded:
+        return router.home_shard
+    
+    async def probe(shard):
+        async with connect(shard) as conn:
+            return await conn.scalar(repository.PACKAGE_EXISTS, (package_id,))
+    
+    found = await asyncio.gather(*(probe(shard) for shard in router.shards))
+    for shard, hit in zip(router.shards, found):
+        if hit:
+            return shard
+    return None
+
+async def scatter(query, params=()):
+    """Run a read query on every shard concurrently, returning one list of records per shard"""
+    async def run(shard):
+        async with connect(shard) as conn:
+            return await conn.all(query, params)
+    return await asyncio.gather(*(run(shard) for shard in router.shards))
+
+async def gather(query, params=(), order_by='created_at', descending=True, limit=None):
+    """Scatter a query and merge the per-shard results, as ShardRouter.gather does"""
+    return merge_sorted(await scatter(query, params), order_by, descending, limit)
@@ -0,0 +1,270 @@
+"""Bearer token authentication for the API
+
+Tokens are HS256 JWTs carrying user_id, exp, iat and jti claims, sent as
+"Authorization: Bearer <token>". A before_request hook verifies them against
+three in-process caches, so a repeat request costs a few dict lookups:
+
+- verified claims, an LRU keyed by the raw token (signature checked once);
+- users and their roles, kept for AUTH_USER_CACHE_TTL seconds or until
+  invalidate_user() is called;
+- revoked token ids, re-read from the revoked_tokens table every
+  AUTH_REVOCATION_POLL_SECONDS (at once in the worker that revoked).
+
+With AUTH_REQUIRED=1 every endpoint outside PUBLIC_ENDPOINTS needs a valid
+token; otherwise a token is optional but must be valid when sent.
+"""
+import os
+import threading
+import time
+import uuid
+import jwt
+from collections import OrderedDict
+from functools import wraps
+from flask import request, jsonify, g
+from db_config import router, execute_query
+import metrics
+
+AUTH_REQUIRED = os.getenv('AUTH_REQUIRED', '0') == '1'
+AUTH_TOKEN_TTL_SECONDS = int(os.getenv('AUTH_TOKEN_TTL_SECONDS', '86400'))
+AUTH_CACHE_SIZE = int(os.getenv('AUTH_CACHE_SIZE', '10000'))
+AUTH_USER_CACHE_TTL = int(os.getenv('AUTH_USER_CACHE_TTL', '60'))
+AUTH_REVOCATION_POLL_SECONDS = float(os.getenv('AUTH_REVOCATION_POLL_SECONDS', '5'))
+
+ALGORITHM = 'HS256'
+# Role of every registered user; other roles are granted with set_user_role.py
+DEFAULT_ROLE = 'customer'
+PUBLIC_ENDPOINTS = {'register', 'login', 'health', 'index', 'serve_static', 'track_package', 'metrics'}
+
+_secret = None
+
+
+class ExpiringLRU:
+    """Bounded mapping with least-recently-used eviction and per-entry expiry"""
+    
+    def __init__(self, max_entries=AUTH_CACHE_SIZE):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self._entries)
+    
+    def get(self, key, now):
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                self.misses += 1
+                return None
+            if item[1] <= now:
+                del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return item[0]
+    
+    def put(self, key, value, expires_at):
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def pop(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+
+class RevocationList:
+    """Revoked token ids, polled from the revoked_tokens table"""
+    
+    # Re-read rows this far behind the newest one seen, in case another
+    # worker's clock is slightly behind ours
+    SKEW_SECONDS = 10
+    
+    def __init__(self):
+        self.expiry = {}  # jti -> token exp
+        self.since = 0
+        self.polled_at = 0
+        self._lock = threading.Lock()
+    
+    def is_revoked(self, jti, now):
+        # Only one thread polls; the others use the current list meanwhile
+        if now - self.polled_at >= AUTH_REVOCATION_POLL_SECONDS and self._lock.acquire(blocking=False):
+            try:
+                self.poll(now)
+            finally:
+                self._lock.release()
+        return jti in self.expiry
+    
+    def poll(self, now):
+        self.polled_at = now
+        conn = router.connect(router.home_shard)
+        try:
+            cursor = execute_query(conn, '''
+                SELECT jti, expires_at, revoked_at FROM revoked_tokens WHERE revoked_at >= ?
+            ''', (self.since - self.SKEW_SECONDS,))
+            rows = cursor.fetchall()
+        except Exception as e:
+            print(f"Revocation list refresh failed: {e}")
+            return
+        finally:
+            conn.close()
+        # Tokens past their exp are rejected anyway; stop tracking them
+        expiry = {jti: exp for jti, exp in self.expiry.items() if exp > now}
+        for row in rows:
+            if row[1] > now:
+                expiry[row[0]] = row[1]
+            self.since = max(self.since, row[2])
+        self.expiry = expiry
+    
+    def add(self, jti, expires_at):
+        self.expiry[jti] = expires_at
+
+
+claims_cache = ExpiringLRU()
+user_cache = ExpiringLRU()
+revocations = RevocationList()
+
+metrics.callback('auth_cache_entries', 'Entries in the verified token and user caches',
+                 lambda: {('claims',): len(claims_cache), ('users',): len(user_cache)}, ('cache',))
+metrics.callback('auth_cache_lookups', 'Verified token and user cache lookups',
+                 lambda: {('claims', 'hit'): claims_cache.hits, ('claims', 'miss'): claims_cache.misses,
+                          ('users', 'hit'): user_cache.hits, ('users', 'miss'): user_cache.misses},
+                 ('cache', 'result'), kind='counter')
+metrics.callback('auth_revoked_tokens', 'Unexpired revoked token ids held in memory',
+                 lambda: len(revocations.expiry))
+
+
+def issue_token(user_id):
+    now = int(time.time())
+    claims = {'user_id': user_id, 'iat': now, 'exp': now + AUTH_TOKEN_TTL_SECONDS, 'jti': uuid.uuid4().hex}
+    return jwt.encode(claims, _secret, algorithm=ALGORITHM)
+
+def get_user(user_id, now, fresh=False):
+    """User dict (id, email, name, role) from the cache or the users table; None if unknown
+    
+    fresh skips the cache, for checks that must see a role change at once.
+    """
+    user = None if fresh else user_cache.get(user_id, now)
+    if user is None:
+        conn = router.connect(router.home_shard)
+        try:
+            cursor = execute_query(conn, 'SELECT id, email, name, role FROM users WHERE id=?', (user_id,))
+            row = cursor.fetchone()
+        finally:
+            conn.close()
+        # Unknown ids are cached too (as False) so a deleted user's tokens
+        # do not cost a query each
+        user = {'id': row[0], 'email': row[1], 'name': row[2], 'role': row[3]} if row else False
+        user_cache.put(user_id, user, now + AUTH_USER_CACHE_TTL)
+    return user or None
+
+def invalidate_user(user_id):
+    """Drop a cached user after changing their role or deleting them"""
+    user_cache.pop(user_id)
+
+def verify(header):
+    """Resolve an Authorization header value to (user, claims, error), outside any Flask request
+    
+    May query the users and revoked_tokens tables on a cache miss.
+    """
+    if not header:
+        return None, None, None
+    scheme, _, token = header.partition(' ')
+    if scheme.lower() != 'bearer' or not token:
+        return None, None, 'Invalid authorization header'
+    now = time.time()
+    claims = claims_cache.get(token, now)
+    if claims is None:
+        try:
+            claims = jwt.decode(token, _secret, algorithms=[ALGORITHM],
+                                options={'require': ['exp', 'jti', 'user_id']})
+        except jwt.ExpiredSignatureError:
+            return None, None, 'Token expired'
+        except jwt.InvalidTokenError:
+            return None, None, 'Invalid token'
+        claims_cache.put(token, claims, claims['exp'])
+    if revocations.is_revoked(claims['jti'], now):
+        return None, None, 'Token revoked'
+    user = get_user(claims['user_id'], now)
+    if user is None:
+        return None, None, 'Unknown user'
+    return user, claims, None
+
+def authenticate(header):
+    """Resolve an Authorization header value to (user, error); (None, None) without one"""
+    user, claims, error = verify(header)
+    if user is not None:
+        g.token_claims = claims
+    return user, error
+
+def revoke_token(token, claims):
+    """Revoke a token for every worker (others see it within the poll interval)"""
+    conn = router.connect(router.home_shard)
+    try:
+        now = time.time()
+        execute_query(conn, '''
+            INSERT INTO revoked_tokens (jti, expires_at, revoked_at) VALUES (?, ?, ?)
+            ON CONFLICT (jti) DO NOTHING
+        ''', (claims['jti'], claims['exp'], now))
+        execute_query(conn, 'DELETE FROM revoked_tokens WHERE expires_at < ?', (now,))
+        conn.commit()
+    finally:
+        conn.close()
+    revocations.add(claims['jti'], claims['exp'])
+    claims_cache.pop(token)
+
+def bearer_token():
+    return request.headers.get('Authorization', '').partition(' ')[2]
+
+def _unauthorized(message):
+    resp = jsonify({'error': message})
+    resp.status_code = 401
+    resp.headers['WWW-Authenticate'] = 'Bearer'
+    return resp
+
+def has_role(user, role):
+    """True if the user holds role, confirmed against the users table
+    
+    Tokens carry only the user id, so roles come from the user cache; the
+    re-read makes a role taken away elsewhere stop working at once instead
+    of after AUTH_USER_CACHE_TTL. A granted role applies within that TTL.
+    """
+    if user is None or user['role'] != role:
+        return False
+    user = get_user(user['id'], time.time(), fresh=True)
+    return user is not None and user['role'] == role
+
+def require_role(role):
+    """View decorator: 401 without a user, 403 unless the user has the role (whatever AUTH_REQUIRED says)"""
+    def decorate(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            user = g.get('user')
+            if user is None:
+                return _unauthorized('Authentication required')
+            if not has_role(user, role):
+                return jsonify({'error': f'Requires the {role} role'}), 403
+            return view(*args, **kwargs)
+        return wrapper
+    return decorate
+
+def check_request():
+    """before_request hook: set g.user, or answer 401 for a bad or missing token"""
+    if request.method == 'OPTIONS' or request.endpoint is None or request.endpoint in PUBLIC_ENDPOINTS:
+        return None
+    user, error = authenticate(request.headers.get('Authorization'))
+    if error:
+        return _unauthorized(error)
+    if user is None and AUTH_REQUIRED:
+        return _unauthorized('Authentication required')
+    g.user = user
+    return None
+
+def init_app(app):
+    global _secret
+    _secret = app.config['SECRET_KEY']
+    app.before_request(check_request)
@@ -2,6 +2,7 @@
 import os
 import boto3
 from botocore.exceptions import ClientError
+from metrics import timed
 
 # AWS Configuration
 AWS_REGION = os.getenv('AWS_REGION', 'us-east-1')
@@ -14,10 +15,38 @@ s3_client = boto3.client('s3', region_name=AWS_REGION) if S3_BUCKET else None
 sns_client = boto3.client('sns', region_name=AWS_REGION) if SNS_TOPIC_ARN else None
 ses_client = boto3.client('ses', region_name=AWS_REGION)
 
+def email_message(subject, body_html=None, body_text=None):
+    """SES Message for an email, either body filled in from the other"""
+    # If no HTML provided, use text as both
+    if not body_html:
+        body_html = body_text.replace('\n', '<br>') if body_text else ''
+    if not body_text:
+        body_text = body_html.replace('<br>', '\n').replace('<p>', '').replace('</p>', '\n')
+    return {
+        'Subject': {'Data': subject, 'Charset': 'UTF-8'},
+        'Body': {
+            'Text': {'Data': body_text, 'Charset': 'UTF-8'},
+            'Html': {'Data': body_html, 'Charset': 'UTF-8'}
+        }
+    }
+
+def report_ses_error(e, to_email):
+    error_code = e.response.get('Error', {}).get('Code', '')
+    error_message = e.response.get('Error', {}).get('Message', str(e))
+    if error_code == 'MessageRejected':
+        print(f"Email not sent - address not verified: {to_email}")
+        print(f"  Note: Verify email in SES: aws ses verify-email-identity --email-address {to_email}")
+    elif 'Email address not verified' in error_message or 'not verified' in error_message.lower():
+        print(f"Email not sent - address not verified: {to_email}")
+        print(f"  Note: Check your email inbox and click the verification link from AWS SES")
+    else:
+        print(f"Error sending email via SES: {error_code} - {error_message}")
+
 class S3Service:
     """S3 service for storing package documents/images"""
     
     @staticmethod
+    @timed('s3')
     def upload_file(file_content, file_name, content_type='application/octet-stream'):
         """Upload file to S3"""
         if not s3_client or not S3_BUCKET:
@@ -38,6 +67,7 @@ class S3Service:
             return None
     
     @staticmethod
+    @timed('s3')
     def get_file_url(file_name):
         """Get presigned URL for file"""
         if not s3_client or not S3_BUCKET:
@@ -59,6 +89,7 @@ class SNSService:
     """SNS service for notifications"""
     
     @staticmethod
+    @timed('sns')
     def publish_notification(message, subject="Courier Delivery Update"):
         """Publish notification to SNS topic"""
         if not sns_client or not SNS_TOPIC_ARN:
@@ -80,6 +111,11 @@ class SNSService:
     @staticmethod
     def notify_package_status(tracking_id, status, recipient_email):
         """Send package status notification via SNS"""
+        return SNSService.publish_notification(*SNSService.status_notification(tracking_id, status))
+    
+    @staticmethod
+    def status_notification(tracking_id, status):
+        """Message and subject of a package status notification"""
         message = f"""Package Tracking Update
 
 Tracking ID: {tracking_id}
@@ -87,53 +123,25 @@ Status: {status}
 
 Your package status has been updated.
 """
-        return SNSService.publish_notification(
-            message,
-            f"Package {tracking_id} - Status Update"
-        )
+        return message, f"Package {tracking_id} - Status Update"
 
 class SESService:
     """SES service for sending emails"""
     
     @staticmethod
+    @timed('ses')
     def send_email(to_email, subject, body_html=None, body_text=None, from_email=None):
         """Send email using SES"""
-        if not from_email:
-            from_email = SES_FROM_EMAIL
-        
-        # If no HTML provided, use text as both
-        if not body_html:
-            body_html = body_text.replace('\n', '<br>') if body_text else ''
-        if not body_text:
-            body_text = body_html.replace('<br>', '\n').replace('<p>', '').replace('</p>', '\n')
-        
         try:
-            message = {
-                'Subject': {'Data': subject, 'Charset': 'UTF-8'},
-                'Body': {
-                    'Text': {'Data': body_text, 'Charset': 'UTF-8'},
-                    'Html': {'Data': body_html, 'Charset': 'UTF-8'}
-                }
-            }
-            
             response = ses_client.send_email(
-                Source=from_email,
+                Source=from_email or SES_FROM_EMAIL,
                 Destination={'ToAddresses': [to_email]},
-                Message=message
+                Message=email_message(subject, body_html, body_text)
             )
             print(f"Email sent successfully to {to_email}: {response.get('MessageId')}")
             return response.get('MessageId') is not None
         except ClientError as e:
-            error_code = e.response.get('Error', {}).get('Code', '')
-            error_message = e.response.get('Error', {}).get('Message', str(e))
-            if error_code == 'MessageRejected':
-                print(f"Email not sent - address not verified: {to_email}")
-                print(f"  Note: Verify email in SES: aws ses verify-email-identity --email-address {to_email}")
-            elif 'Email address not verified' in error_message or 'not verified' in error_message.lower():
-                print(f"Email not sent - address not verified: {to_email}")
-                print(f"  Note: Check your email inbox and click the verification link from AWS SES")
-            else:
-                print(f"Error sending email via SES: {error_code} - {error_message}")
+            report_ses_error(e, to_email)
             return False
         except Exception as e:
             print(f"Unexpected error sending email: {e}")
@@ -143,6 +151,12 @@ class SESService:
     def send_package_created_email(tracking_id, recipient_name, recipient_email, 
                                    recipient_address, distance, price):
         """Send email when package is created"""
+        return SESService.send_email(recipient_email, *SESService.package_created_email(
+            tracking_id, recipient_name, recipient_address, distance, price))
+    
+    @staticmethod
+    def package_created_email(tracking_id, recipient_name, recipient_address, distance, price):
+        """Subject, HTML and text of the package created email"""
         subject = f"📦 Package Created - Tracking ID: {tracking_id}"
         
         body_html = f"""
@@ -182,12 +196,18 @@ You can track your package using the tracking ID above.
 Thank you for using our courier service!
 """
         
-        return SESService.send_email(recipient_email, subject, body_html, body_text)
+        return subject, body_html, body_text
     
     @staticmethod
     def send_status_update_email(tracking_id, status, recipient_name, recipient_email, 
                                  recipient_address=None):
         """Send email when package status is updated"""
+        return SESService.send_email(recipient_email, *SESService.status_update_email(
+            tracking_id, status, recipient_name, recipient_address))
+    
+    @staticmethod
+    def status_update_email(tracking_id, status, recipient_name, recipient_address=None):
+        """Subject, HTML and text of the status update email"""
         status_messages = {
             'pending': 'Your package is pending and awaiting assignment.',
             'assigned': 'A driver has been assigned to your package.',
@@ -236,11 +256,17 @@ You can track your package using the tracking ID above.
 Thank you for using our courier service!
 """
         
-        return SESService.send_email(recipient_email, subject, body_html, body_text)
+        return subject, body_html, body_text
     
     @staticmethod
     def send_driver_assigned_email(tracking_id, recipient_name, recipient_email, driver_name=None):
         """Send email when driver is assigned"""
+        return SESService.send_email(recipient_email, *SESService.driver_assigned_email(
+            tracking_id, recipient_name, driver_name))
+    
+    @staticmethod
+    def driver_assigned_email(tracking_id, recipient_name, driver_name=None):
+        """Subject, HTML and text of the driver assigned email"""
         subject = f"🚚 Driver Assigned - Package {tracking_id}"
         
         driver_info = f"Driver: {driver_name}" if driver_name else "A driver has been assigned"
@@ -276,4 +302,4 @@ Status: ASSIGNED
 Your package will be picked up soon!
 """
         
-        return SESService.send_email(recipient_email, subject, body_html, body_text)
+        return subject, body_html, body_text
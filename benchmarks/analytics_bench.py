@@ -0,0 +1,64 @@
+"""Benchmark vectorized time-series group-bys on a large column snapshot
+
+Usage (from the repository root):
+    python3 -m benchmarks.analytics_bench [--rows 10000000]
+
+Fills a ColumnSnapshot with synthetic packages directly (no database) and
+times every metric/bucket/group_by combination the API accepts.
+"""
+import argparse
+import time
+import numpy as np
+from analytics import ColumnSnapshot, METRICS, BUCKETS, GROUP_BYS
+
+def build(rows, seed=7):
+    rng = np.random.default_rng(seed)
+    snapshot = ColumnSnapshot(capacity=rows)
+    start = int(np.datetime64('2025-01-01T00:00:00', 's').astype(np.int64))
+    for name, count in [('status', 6), ('zone', 40), ('driver', 500)]:
+        for i in range(count):
+            snapshot.dictionaries[name].encode(f"{name}_{i}")
+    created = np.sort(rng.integers(start, start + 365 * 86400, rows))
+    snapshot.append({
+        'created_at': created,
+        'hour': created // 3600,
+        'price': rng.uniform(5, 500, rows),
+        'distance': rng.uniform(1, 250, rows),
+        'status': rng.integers(0, 6, rows),
+        'zone': rng.integers(0, 40, rows),
+        'driver': rng.integers(0, 500, rows),
+        'alive': np.ones(rows, np.bool_),
+    })
+    return snapshot, start
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000000)
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+    
+    began = time.perf_counter()
+    snapshot, start = build(args.rows)
+    print(f"Built {args.rows} row snapshot in {time.perf_counter() - began:.1f}s")
+    
+    print(f"{'metric':<13} {'bucket':<6} {'group_by':<8} {'groups':>6} {'ms':>8}")
+    for metric in METRICS:
+        for bucket in BUCKETS:
+            for group_by in GROUP_BYS:
+                began = time.perf_counter()
+                try:
+                    for _ in range(args.repeats):
+                        result = snapshot.timeseries(metric, bucket, group_by)
+                except ValueError as e:
+                    print(f"{metric:<13} {bucket:<6} {group_by:<8} {'-':>6} {'':>8} ({e})")
+                    continue
+                elapsed = (time.perf_counter() - began) / args.repeats * 1000
+                print(f"{metric:<13} {bucket:<6} {group_by:<8} {len(result):>6} {elapsed:>8.1f}")
+    
+    # A bounded range (last 30 days) only touches the rows inside it
+    began = time.perf_counter()
+    snapshot.timeseries('revenue', 'hour', 'zone', start + 335 * 86400, start + 365 * 86400)
+    print(f"revenue/hour/zone over the last 30 days: {(time.perf_counter() - began) * 1000:.1f} ms")
+
+if __name__ == '__main__':
+    main()
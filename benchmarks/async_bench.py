@@ -0,0 +1,193 @@
+"""Compare requests in flight per GB of RAM for the sync and asyncio apps
+
+Usage (from the repository root):
+    python3 -m benchmarks.async_bench [--concurrency 64,256,1024] [--duration 10] [--latency 0.05]
+
+For each concurrency, serves app.py (gunicorn gthread workers, with enough
+threads between them for every connection) and then asgi_app.py (gunicorn
+with uvicorn workers) on a scratch SQLite database, with in-memory AWS
+clients that wait --latency seconds per call (benchmarks/fake_aws.py) so the
+routes spend their time waiting as they do against real SES and SNS. Each
+keep-alive connection loops over a create / track x3 / status update /
+accept sequence.
+
+Reported per server: throughput, latency, the requests it had in flight on
+average (throughput x mean latency), the peak proportional set size (PSS)
+of its process tree during the run, and in flight per GB of that memory.
+Admission control is disabled so the limiter does not shed the load.
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from benchmarks.server_bench import wait_ready
+
+CREATE = json.dumps({'recipient_name': 'Bench', 'recipient_address': 'Dublin 2', 'pickup_address': 'Cork',
+                     'recipient_email': 'bench@example.com'})
+JSON = {'Content-Type': 'application/json'}
+
+
+def serve(mode, port, workers, threads, latency):
+    """Run one server in this process (the --serve child)"""
+    from gunicorn.app.base import BaseApplication
+    from benchmarks import fake_aws
+    fake_aws.install(latency)
+    fake_aws.install_async(latency)
+    if mode == 'async':
+        from asgi_app import app
+        options = {'worker_class': 'uvicorn.workers.UvicornWorker'}
+    else:
+        from app import app
+        options = {'worker_class': 'gthread' if threads > 1 else 'sync', 'threads': threads}
+    options.update(bind=f'127.0.0.1:{port}', workers=workers, loglevel='warning', accesslog=None,
+                   pidfile=None, timeout=120, preload_app=True)
+    
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in options.items():
+                self.cfg.set(key, value)
+        
+        def load(self):
+            return app
+    
+    Server().run()
+
+def process_tree(root):
+    """root and all its descendants"""
+    parents = {}
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    # The command name may contain spaces; ppid follows its closing parenthesis
+                    parents[int(entry)] = int(f.read().rsplit(')', 1)[1].split()[1])
+            except (OSError, IndexError, ValueError):
+                continue
+    tree = [root]
+    for pid in tree:
+        tree.extend(child for child, parent in parents.items() if parent == pid)
+    return tree
+
+def memory_kb(pid):
+    """PSS of one process (shared pages split between their users), RSS without smaps_rollup"""
+    for path, field in ((f'/proc/{pid}/smaps_rollup', 'Pss:'), (f'/proc/{pid}/status', 'VmRSS:')):
+        try:
+            with open(path) as f:
+                for line in f:
+                    if line.startswith(field):
+                        return int(line.split()[1])
+        except OSError:
+            continue
+    return 0
+
+def client(args):
+    port, duration, connections = args
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    
+    def request(conn, method, path, body=None):
+        began = time.perf_counter()
+        conn.request(method, path, body, JSON if body else {})
+        resp = conn.getresponse()
+        data = resp.read()
+        if resp.status >= 400:
+            raise http.client.HTTPException(f'{method} {path}: {resp.status}')
+        return time.perf_counter() - began, data
+    
+    def run():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        local = []
+        end = time.time() + duration
+        while time.time() < end:
+            try:
+                elapsed, data = request(conn, 'POST', '/api/packages', CREATE)
+                local.append(elapsed)
+                created = json.loads(data)
+                for _ in range(3):
+                    local.append(request(conn, 'GET', f"/api/packages/{created['tracking_id']}")[0])
+                local.append(request(conn, 'PUT', f"/api/packages/{created['package_id']}/status",
+                                     json.dumps({'status': 'in_transit'}))[0])
+                local.append(request(conn, 'POST', f"/api/deliveries/accept/{created['package_id']}",
+                                     json.dumps({'driver_id': 'bench-driver'}))[0])
+            except (OSError, http.client.HTTPException, ValueError, KeyError):
+                errors[0] += 1
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        with lock:
+            latencies.extend(local)
+    
+    threads = [threading.Thread(target=run) for _ in range(connections)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, errors[0]
+
+def bench(name, mode, workers, threads, concurrency, args, env, port):
+    command = [sys.executable, '-m', 'benchmarks.async_bench', '--serve', mode, '--port', str(port),
+               '--latency', str(args.latency), '--workers', str(workers), '--threads', str(threads)]
+    proc = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_ready(port):
+            print(f"{name}: server did not start")
+            return
+        processes = min(concurrency, os.cpu_count() or 1, 4)
+        per_process = max(1, concurrency // processes)
+        peak_kb = 0
+        with multiprocessing.Pool(processes) as pool:
+            pending = pool.map_async(client, [(port, args.duration, per_process)] * processes)
+            while not pending.ready():
+                peak_kb = max(peak_kb, sum(memory_kb(pid) for pid in process_tree(proc.pid)))
+                pending.wait(0.5)
+            results = pending.get()
+        latencies = sorted(l for r in results for l in r[0])
+        errors = sum(r[1] for r in results)
+        if not latencies:
+            print(f"{name}: no successful requests")
+            return
+        throughput = len(latencies) / args.duration
+        in_flight = throughput * sum(latencies) / len(latencies)
+        p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+        print(f"{concurrency:>5} {name:<16} {throughput:>7.0f} {p(0.5):>8.1f} {p(0.99):>8.1f} {in_flight:>9.1f} "
+              f"{peak_kb / 1024:>7.0f} {in_flight / (peak_kb / 1024 ** 2):>10.0f} {errors:>7}")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', default='64,256,1024', help='client connections, comma-separated')
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per fake AWS call')
+    parser.add_argument('--sync-workers', type=int, default=4)
+    parser.add_argument('--async-workers', type=int, default=1)
+    parser.add_argument('--serve', choices=('sync', 'async'), help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--workers', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--threads', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.serve, args.port, args.workers, args.threads, args.latency)
+        return
+    
+    print(f"{'conns':>5} {'server':<16} {'req/s':>7} {'p50 ms':>8} {'p99 ms':>8} {'in flight':>9} {'PSS MB':>7} "
+          f"{'flight/GB':>10} {'errors':>7}")
+    for concurrency in (int(c) for c in args.concurrency.split(',')):
+        # A sync worker thread waits out each request, so every connection needs one
+        threads = -(-concurrency // args.sync_workers)
+        for name, mode, workers, threads, port in (
+                (f'sync {args.sync_workers}x{threads}', 'sync', args.sync_workers, threads, 5211),
+                (f'async {args.async_workers}', 'async', args.async_workers, 1, 5212)):
+            with tempfile.TemporaryDirectory() as tmp:
+                env = dict(os.environ, ADMISSION_CONTROL='0', SQLITE_PATH=os.path.join(tmp, 'bench.db'))
+                bench(name, mode, workers, threads, concurrency, args, env, port)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,65 @@
+"""Measure per-request authentication overhead and login lookup cost
+
+Usage (from the repository root):
+    python3 -m benchmarks.auth_bench [--users 100000] [--iterations 100000]
+
+Creates users in a temporary SQLite database, then times the before_request
+auth hook on a cache hit (the target is under 50 us), a cold verification
+(JWT signature check plus user query), and the login query by email with
+and without the users.email index.
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+import uuid
+
+def per_call(fn, iterations):
+    began = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - began) / iterations * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--iterations', type=int, default=100000)
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'auth.db')
+        os.environ.update(SQLITE_PATH=path, ADMISSION_CONTROL='0')
+        from app import app
+        import auth
+        
+        conn = sqlite3.connect(path)
+        conn.executemany('INSERT INTO users VALUES (?, ?, ?, ?, ?)',
+                         ((str(uuid.uuid4()), f"user{i}@example.ie", 'secret', f"User {i}", 'customer')
+                          for i in range(args.users)))
+        conn.commit()
+        user_id, email = conn.execute('SELECT id, email FROM users ORDER BY rowid DESC LIMIT 1').fetchone()
+        header = f"Bearer {auth.issue_token(user_id)}"
+        
+        print(f"{'case':<34} {'us/request':>10}")
+        with app.test_request_context('/api/packages', headers={'Authorization': header}):
+            assert auth.check_request() is None
+            hit = per_call(auth.check_request, args.iterations)
+            print(f"{'auth hook, cache hit':<34} {hit:>10.2f}")
+            
+            def cold():
+                auth.claims_cache.pop(header[len('Bearer '):])
+                auth.user_cache.pop(user_id)
+                auth.check_request()
+            print(f"{'auth hook, cold (verify + query)':<34} {per_call(cold, args.iterations // 10):>10.2f}")
+        
+        login = lambda: conn.execute('SELECT id FROM users WHERE email=? AND password=?', (email, 'secret')).fetchone()
+        print(f"{'login query, email index':<34} {per_call(login, 1000):>10.2f}")
+        conn.execute('DROP INDEX idx_users_email')
+        print(f"{'login query, full scan':<34} {per_call(login, 20):>10.2f}")
+        conn.close()
+        
+        print(f"Cache hit {'within' if hit < 50 else 'OVER'} the 50 us budget")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+"""Benchmark ETA training, lookup speed and accuracy on synthetic deliveries
+
+Usage (from the repository root):
+    python3 -m benchmarks.eta_bench [--deliveries 200000]
+
+Generates delivery histories whose duration depends on the zone pair,
+distance and a rush-hour slowdown, trains the tables (no database), then
+times single estimates and compares held-out error against the
+distance-only fallback.
+"""
+import argparse
+import random
+import time
+import numpy as np
+from eta import ETAModel, hour_of_week
+
+ZONES = ['d01', 'd02', 'd04', 'd08', 'd12', 'd15', 'd24', 't12', 't23', 'v94', 'h91', 'x91']
+START = int(np.datetime64('2025-01-06T00:00:00', 's').astype(np.int64))
+
+def iso(seconds):
+    return str(np.datetime64(int(seconds), 's'))
+
+def synthesize(count, seed=11):
+    rng = random.Random(seed)
+    # Each zone pair has its own typical trip time (traffic, parking, stairs)
+    pair_minutes = {(a, b): rng.uniform(20, 150) for a in ZONES for b in ZONES}
+    history = []
+    for _ in range(count):
+        origin, dest = rng.choice(ZONES), rng.choice(ZONES)
+        created = START + rng.randrange(0, 8 * 7 * 86400)
+        accepted = created + rng.expovariate(1 / 1800)
+        hour = int(hour_of_week(accepted)) % 24
+        rush = 1.6 if hour in (8, 9, 17, 18) else 1.0
+        minutes = pair_minutes[origin, dest] * rush * rng.lognormvariate(0, 0.25)
+        history.append({
+            'pickup_address': f"1 Main Street, {origin.upper()} AB12",
+            'recipient_address': f"2 High Street, {dest.upper()} CD34",
+            'distance': pair_minutes[origin, dest] / 3 * rng.uniform(0.8, 1.2),
+            'created_at': iso(created),
+            'accepted_at': iso(accepted),
+            'delivered_at': iso(accepted + minutes * 60),
+        })
+    return history
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--deliveries', type=int, default=200000)
+    parser.add_argument('--lookups', type=int, default=100000)
+    args = parser.parse_args()
+    
+    history = synthesize(args.deliveries)
+    split = int(len(history) * 0.9)
+    train, test = history[:split], history[split:]
+    
+    began = time.perf_counter()
+    model = ETAModel.train(train)
+    print(f"Trained on {len(train)} deliveries in {time.perf_counter() - began:.2f}s "
+          f"({model.travel.nbytes / 1024:.0f} KB travel table)")
+    
+    package = dict(test[0], status='in_transit')
+    accepted = float(np.datetime64(test[0]['accepted_at'], 's').astype(np.int64))
+    began = time.perf_counter()
+    for _ in range(args.lookups):
+        model.estimate(package, accepted, now=accepted)
+    print(f"Single estimate: {(time.perf_counter() - began) / args.lookups * 1e6:.1f} us")
+    
+    fallback = ETAModel.untrained()
+    fallback.base, fallback.per_km = model.base, model.per_km
+    errors = {'tables': [], 'distance only': []}
+    for row in test:
+        accepted = float(np.datetime64(row['accepted_at'], 's').astype(np.int64))
+        actual = float(np.datetime64(row['delivered_at'], 's').astype(np.int64)) - accepted
+        package = dict(row, status='in_transit')
+        for name, m in (('tables', model), ('distance only', fallback)):
+            # now=-inf disables the "never in the past" floor
+            errors[name].append(abs(m.estimate(package, accepted, now=float('-inf')) - accepted - actual))
+    for name, values in errors.items():
+        print(f"{name:<14} median abs error {np.median(values) / 60:5.1f} min")
+
+if __name__ == '__main__':
+    main()
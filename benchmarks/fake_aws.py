@@ -0,0 +1,107 @@
+"""In-memory stand-ins for the S3, SNS and SES clients in aws_services
+
+install() swaps them in for the boto3 clients so the app can be exercised
+offline: uploads are kept in a dict, notifications and emails are counted,
+and every call can be given a fixed delay to mimic the network round trip.
+install_async() does the same for the aiobotocore clients in async_aws,
+waiting with asyncio.sleep instead of blocking the thread.
+"""
+import asyncio
+import threading
+import time
+import uuid
+import async_aws
+import aws_services
+
+
+class FakeClient:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls = {}
+        self._lock = threading.Lock()
+    
+    def _call(self, name):
+        if self.latency:
+            time.sleep(self.latency)
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        return {'MessageId': uuid.uuid4().hex}
+
+
+class FakeS3(FakeClient):
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self.objects = {}
+    
+    def put_object(self, Bucket, Key, Body, ContentType=None):
+        self.objects[(Bucket, Key)] = Body
+        return self._call('put_object')
+    
+    def generate_presigned_url(self, operation, Params, ExpiresIn=3600):
+        self._call('generate_presigned_url')
+        return f"https://{Params['Bucket']}.s3.fake/{Params['Key']}?expires={ExpiresIn}"
+
+
+class FakeSNS(FakeClient):
+    def publish(self, TopicArn, Message, Subject=None):
+        return self._call('publish')
+
+
+class FakeSES(FakeClient):
+    def send_email(self, Source, Destination, Message):
+        return self._call('send_email')
+
+
+def install(latency=0.0):
+    """Replace the aws_services clients; returns {'s3': .., 'sns': .., 'ses': ..}"""
+    fakes = {'s3': FakeS3(latency), 'sns': FakeSNS(latency), 'ses': FakeSES(latency)}
+    aws_services.S3_BUCKET = aws_services.S3_BUCKET or 'bench-bucket'
+    aws_services.SNS_TOPIC_ARN = aws_services.SNS_TOPIC_ARN or 'arn:aws:sns:eu-west-1:000000000000:bench'
+    aws_services.s3_client = fakes['s3']
+    aws_services.sns_client = fakes['sns']
+    aws_services.ses_client = fakes['ses']
+    return fakes
+
+
+class AsyncFakeClient(FakeClient):
+    async def _wait(self, name):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+        return {'MessageId': uuid.uuid4().hex}
+
+
+class AsyncFakeS3(AsyncFakeClient):
+    def __init__(self, latency=0.0):
+        super().__init__(latency)
+        self.objects = {}
+    
+    async def put_object(self, Bucket, Key, Body, ContentType=None):
+        self.objects[(Bucket, Key)] = Body
+        return await self._wait('put_object')
+    
+    async def generate_presigned_url(self, operation, Params, ExpiresIn=3600):
+        await self._wait('generate_presigned_url')
+        return f"https://{Params['Bucket']}.s3.fake/{Params['Key']}?expires={ExpiresIn}"
+
+
+class AsyncFakeSNS(AsyncFakeClient):
+    async def publish(self, TopicArn, Message, Subject=None):
+        return await self._wait('publish')
+
+
+class AsyncFakeSES(AsyncFakeClient):
+    async def send_email(self, Source, Destination, Message):
+        return await self._wait('send_email')
+
+
+def install_async(latency=0.0):
+    """Replace the async_aws clients (async_aws.start() keeps them); returns the fakes as install() does"""
+    fakes = {'s3': AsyncFakeS3(latency), 'sns': AsyncFakeSNS(latency), 'ses': AsyncFakeSES(latency)}
+    aws_services.S3_BUCKET = aws_services.S3_BUCKET or 'bench-bucket'
+    aws_services.SNS_TOPIC_ARN = aws_services.SNS_TOPIC_ARN or 'arn:aws:sns:eu-west-1:000000000000:bench'
+    async_aws.s3_client = fakes['s3']
+    async_aws.sns_client = fakes['sns']
+    async_aws.ses_client = fakes['ses']
+    return fakes
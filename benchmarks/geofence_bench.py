@@ -0,0 +1,72 @@
+"""Measure geofence evaluation throughput against a large set of active fences
+
+Usage (from the repository root):
+    python3 -m benchmarks.geofence_bench [--fences 100000] [--drivers 20000] [--positions 200000]
+
+Builds a fence index for that many active packages shared among the drivers
+(pickup and delivery points scattered over the greater Dublin area), then
+feeds it driver positions: some wandering nearby, some parked inside a
+pickup fence long enough to dwell and leave. Reports positions/sec for
+single positions and for batches (the target is 10,000/sec), the index
+build time, and how many transitions fired.
+"""
+import argparse
+import time
+import numpy as np
+from geofence import FenceIndex, GEOFENCE_DWELL_SECONDS
+
+STATUSES = ('assigned', 'in_transit', 'out_for_delivery')
+
+def make_packages(count, drivers, rng):
+    lat = 53.2 + rng.random((count, 2)) * 0.4
+    lon = -6.5 + rng.random((count, 2)) * 0.5
+    return [{'id': f"pkg{i}", 'driver_id': f"drv{i % drivers}", 'status': STATUSES[i % 3],
+             'pickup_lat': lat[i, 0], 'pickup_lon': lon[i, 0],
+             'delivery_lat': lat[i, 1], 'delivery_lon': lon[i, 1]} for i in range(count)]
+
+def make_positions(packages, count, batch, rng):
+    """(driver_id, pings) batches: half random, half sitting on a pickup then driving off"""
+    batches = []
+    now = time.time()
+    for b in range(count // batch):
+        package = packages[rng.integers(len(packages))]
+        if b % 2:
+            lat = np.full(batch, package['pickup_lat']) + rng.normal(0, 1e-4, batch)
+            lon = np.full(batch, package['pickup_lon'])
+            lat[-1] += 0.01
+        else:
+            lat = 53.2 + rng.random() * 0.4 + np.arange(batch) * 1e-4
+            lon = np.full(batch, -6.5 + rng.random() * 0.5)
+        ts = now + b + np.linspace(0, GEOFENCE_DWELL_SECONDS * 2, batch)
+        batches.append((package['driver_id'], np.column_stack([ts, lat, lon])))
+    return batches
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--fences', type=int, default=100000, help='active packages')
+    parser.add_argument('--drivers', type=int, default=20000)
+    parser.add_argument('--positions', type=int, default=200000)
+    args = parser.parse_args()
+    
+    rng = np.random.default_rng(42)
+    packages = make_packages(args.fences, args.drivers, rng)
+    began = time.perf_counter()
+    index = FenceIndex(packages)
+    print(f"Indexed {len(index)} packages ({len(index.cells)} driver cells) in {time.perf_counter() - began:.2f}s")
+    
+    print(f"{'positions/call':>14} {'positions/sec':>14} {'transitions':>12}")
+    for batch in (1, 10, 50):
+        index = FenceIndex(packages)
+        batches = make_positions(packages, args.positions if batch > 1 else args.positions // 4, batch, rng)
+        began = time.perf_counter()
+        transitions = 0
+        for driver_id, pings in batches:
+            transitions += len(index.evaluate(driver_id, pings))
+        rate = len(batches) * batch / (time.perf_counter() - began)
+        print(f"{batch:>14} {rate:>14,.0f} {transitions:>12}")
+        if batch == 1:
+            single = rate
+    print(f"Single positions {'within' if single >= 10000 else 'BELOW'} the 10,000/sec target")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Insert throughput on a large packages table: random vs time-ordered ids
+
+Usage (from the repository root):
+    python3 -m benchmarks.ids_bench [--rows 500000] [--inserts 50000] [--batch 20] [--cache-mb 8]
+
+For each id scheme, fills a scratch SQLite database (the app's schema, with
+its indexes and full-text triggers) with --rows packages, then inserts
+--inserts more through repository.INSERT_PACKAGE, committing every --batch
+rows, with a --cache-mb page cache so the indexes do not fit in it, as on a
+large production table. Schemes:
+- uuid4: random package ids and TRK + 8 hex tracking IDs, as before
+- uuid7: ids.new_id() package ids (the fill is backdated, oldest first) and
+  ids.tracking_id() tracking IDs
+
+Reported: inserts per second overall and over the last tenth, the size of
+the primary key index after the run and how full its pages are (dbstat).
+Tracking IDs are random in both schemes, so their index costs the same.
+"""
+import argparse
+import os
+import sqlite3
+import tempfile
+import time
+import uuid
+
+DB_DIR = tempfile.mkdtemp(prefix='ids_bench_')
+os.environ.setdefault('DB_TYPE', 'sqlite')
+
+import ids
+import repository
+from db_config import init_shard
+
+SCHEMES = {
+    'uuid4': (lambda at=None: str(uuid.uuid4()), lambda: f"TRK{uuid.uuid4().hex[:8].upper()}"),
+    'uuid7': (ids.new_id, ids.tracking_id),
+}
+
+
+def package(package_id, tracking_id, i):
+    return (package_id, tracking_id, 'guest', f'Recipient {i}', f'r{i}@example.com', f'{i % 200} Main Street, Cork',
+            'Dublin 2', 'pending', 210.5, 431.0, None, f'2025-01-01T00:00:{i:09d}', 51.9, -8.5, 53.3, -6.3, 1.0)
+
+def fill(path, scheme, rows):
+    new_id, tracking_id = SCHEMES[scheme]
+    init_shard(path)
+    conn = sqlite3.connect(path)
+    started = time.time() - rows
+    # One second apart, oldest first, as if created over the table's lifetime
+    conn.executemany(repository.INSERT_PACKAGE.sql,
+                     (package(new_id(started + i), tracking_id(), i) for i in range(rows)))
+    conn.commit()
+    conn.close()
+
+def insert(path, scheme, count, batch, cache_mb, start):
+    new_id, tracking_id = SCHEMES[scheme]
+    conn = sqlite3.connect(path)
+    conn.execute(f'PRAGMA cache_size = -{cache_mb * 1024}')
+    checkpoints = []
+    began = time.perf_counter()
+    for i in range(count):
+        repository.INSERT_PACKAGE.run(conn, package(new_id(), tracking_id(), start + i))
+        if (i + 1) % batch == 0:
+            conn.commit()
+        if (i + 1) % max(1, count // 10) == 0:
+            checkpoints.append(time.perf_counter() - began)
+    conn.commit()
+    conn.close()
+    total = time.perf_counter() - began
+    last_tenth = total - checkpoints[-2] if len(checkpoints) > 1 else total
+    return count / total, count / 10 / last_tenth
+
+def primary_key_stats(path):
+    """(MB, fill) of the packages primary key index, or None without dbstat"""
+    conn = sqlite3.connect(path)
+    try:
+        size, unused = conn.execute("SELECT SUM(pgsize), SUM(unused) FROM dbstat "
+                                    "WHERE name = 'sqlite_autoindex_packages_1'").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    finally:
+        conn.close()
+    return size / 1024 ** 2, 1 - unused / size
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=500000, help='packages already in the table')
+    parser.add_argument('--inserts', type=int, default=50000)
+    parser.add_argument('--batch', type=int, default=20, help='inserts per commit')
+    parser.add_argument('--cache-mb', type=int, default=8, help='SQLite page cache during the inserts')
+    args = parser.parse_args()
+
+    print(f"{'scheme':<8} {'inserts/s':>10} {'last 10%':>10} {'pk index MB':>12} {'pk fill':>8}")
+    for scheme in SCHEMES:
+        path = os.path.join(DB_DIR, f'{scheme}.db')
+        fill(path, scheme, args.rows)
+        overall, last = insert(path, scheme, args.inserts, args.batch, args.cache_mb, args.rows)
+        stats = primary_key_stats(path)
+        size, fill_ratio = (f'{stats[0]:.1f}', f'{stats[1]:.0%}') if stats else ('-', '-')
+        print(f"{scheme:<8} {overall:>10.0f} {last:>10.0f} {size:>12} {fill_ratio:>8}")
+        os.remove(path)
+
+if __name__ == '__main__':
+    main()
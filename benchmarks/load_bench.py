@@ -0,0 +1,245 @@
+"""End-to-end load benchmark with AWS stand-ins, per-endpoint latency and baselines
+
+Usage (from the repository root):
+    python3 -m benchmarks.load_bench [--concurrency 16] [--duration 30] [--output load_bench.json]
+                                     [--baseline FILE [--update-baseline]] [--db sqlite|postgres]
+
+Runs the app in this process behind a threaded WSGI server, with the boto3
+S3/SNS/SES clients replaced by in-memory fakes (benchmarks.fake_aws). The
+default is a scratch SQLite database; --db postgres uses the DB_* settings
+as they are, so point them at a disposable local database. After seeding
+packages it replays a mix of tracking reads, creates, status updates,
+dashboard polls and uploads from --concurrency client threads. Reported per
+endpoint: throughput, errors and p50/p95/p99 latency. They are written to
+--output as JSON.
+
+With --baseline the run is compared with an earlier output file. An
+endpoint regresses when its p95 rises or its throughput falls by more than
+--tolerance; the exit status is then 1, so CI can fail on it.
+--update-baseline stores this run as the new baseline instead.
+"""
+import argparse
+import contextlib
+import http.client
+import json
+import logging
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+import uuid
+import numpy as np
+
+# Share of requests per operation
+DEFAULT_MIX = {'track': 60, 'create': 10, 'status': 10, 'dashboard': 15, 'upload': 5}
+STATUSES = ('assigned', 'in_transit', 'out_for_delivery', 'delivered')
+ADDRESSES = ('Dublin 2', 'D08 XY12', 'Cork', 'T12 AB34', 'Galway', 'Limerick', 'Waterford', 'Dublin 15')
+UPLOAD_BYTES = 16 * 1024
+
+
+def parse_mix(text):
+    mix = {}
+    for part in text.split(','):
+        name, _, weight = part.partition('=')
+        if name not in DEFAULT_MIX:
+            raise argparse.ArgumentTypeError(f"unknown operation {name!r} (one of {', '.join(DEFAULT_MIX)})")
+        mix[name] = float(weight)
+    return mix
+
+
+class Workload:
+    """Known packages, shared by the client threads, and the request for each operation"""
+    
+    def __init__(self, packages):
+        self.packages = packages  # [(package_id, tracking_id)]
+        self._lock = threading.Lock()
+        self.upload = os.urandom(UPLOAD_BYTES)
+    
+    def pick(self, rng):
+        return self.packages[rng.randrange(len(self.packages))]
+    
+    def add(self, package):
+        with self._lock:
+            self.packages.append(package)
+    
+    def request(self, op, rng):
+        """(method, path, body, headers) for one operation"""
+        if op == 'track':
+            return 'GET', f'/api/packages/{self.pick(rng)[1]}', None, {}
+        if op == 'dashboard':
+            return 'GET', '/api/dashboard/stats', None, {}
+        if op == 'status':
+            body = json.dumps({'status': rng.choice(STATUSES)})
+            return 'PUT', f'/api/packages/{self.pick(rng)[0]}/status', body, {'Content-Type': 'application/json'}
+        if op == 'upload':
+            boundary = uuid.uuid4().hex
+            body = (f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="label.pdf"\r\n'
+                    f'Content-Type: application/pdf\r\n\r\n').encode() + self.upload + f'\r\n--{boundary}--\r\n'.encode()
+            return ('POST', f'/api/packages/{self.pick(rng)[0]}/upload', body,
+                    {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+        return 'POST', '/api/packages', json.dumps(new_package(rng)), {'Content-Type': 'application/json'}
+
+
+def new_package(rng):
+    return {
+        'recipient_name': f"Recipient {rng.randrange(100000)}",
+        'recipient_email': f"r{rng.randrange(100000)}@example.ie",
+        'recipient_address': rng.choice(ADDRESSES),
+        'pickup_address': rng.choice(ADDRESSES),
+        'weight_kg': round(rng.uniform(0.5, 20), 1),
+    }
+
+def seed(app, count, rng):
+    client = app.test_client()
+    packages = []
+    for _ in range(count):
+        data = client.post('/api/packages', json=new_package(rng)).get_json()
+        packages.append((data['package_id'], data['tracking_id']))
+    return packages
+
+def run_clients(port, workload, mix, concurrency, duration, seed_value):
+    """Drive the mix for `duration` seconds; returns {op: [latency seconds]} and {op: errors}"""
+    ops, weights = list(mix), list(mix.values())
+    latencies = {op: [] for op in ops}
+    errors = {op: 0 for op in ops}
+    lock = threading.Lock()
+    
+    def run(t):
+        rng = random.Random(seed_value * 1000 + t)
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+        local = {op: [] for op in ops}
+        failed = {op: 0 for op in ops}
+        end = time.time() + duration
+        while time.time() < end:
+            op = rng.choices(ops, weights)[0]
+            method, path, body, headers = workload.request(op, rng)
+            began = time.perf_counter()
+            try:
+                conn.request(method, path, body, headers)
+                resp = conn.getresponse()
+                payload = resp.read()
+            except (OSError, http.client.HTTPException):
+                failed[op] += 1
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=30)
+                continue
+            local[op].append(time.perf_counter() - began)
+            if resp.status >= 400:
+                failed[op] += 1
+            elif op == 'create':
+                data = json.loads(payload)
+                workload.add((data['package_id'], data['tracking_id']))
+        conn.close()
+        with lock:
+            for op in ops:
+                latencies[op].extend(local[op])
+                errors[op] += failed[op]
+    
+    threads = [threading.Thread(target=run, args=(t,)) for t in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return latencies, errors
+
+def summarize(latencies, errors, duration):
+    def stats(values, failed):
+        ms = np.array(values) * 1000 if values else np.zeros(1)
+        p50, p95, p99 = np.percentile(ms, [50, 95, 99]).tolist()
+        return {'requests': len(values), 'errors': failed, 'throughput_rps': round(len(values) / duration, 1),
+                'p50_ms': round(p50, 2), 'p95_ms': round(p95, 2), 'p99_ms': round(p99, 2)}
+    endpoints = {op: stats(latencies[op], errors[op]) for op in latencies}
+    total = stats([l for values in latencies.values() for l in values], sum(errors.values()))
+    return endpoints, total
+
+def compare(result, baseline, tolerance):
+    """Print this run against the baseline; returns the regressed endpoints"""
+    regressions = []
+    print(f"\n{'vs baseline':<12} {'p95 ms':>17} {'req/s':>17}")
+    for op, now in sorted(result['endpoints'].items()):
+        before = baseline.get('endpoints', {}).get(op)
+        if not before or not before['requests']:
+            print(f"{op:<12} {'(not in baseline)':>35}")
+            continue
+        slower = now['p95_ms'] > before['p95_ms'] * (1 + tolerance)
+        fewer = now['throughput_rps'] < before['throughput_rps'] * (1 - tolerance)
+        flag = '  REGRESSION' if slower or fewer else ''
+        print(f"{op:<12} {before['p95_ms']:>7.2f} -> {now['p95_ms']:>7.2f} "
+              f"{before['throughput_rps']:>7.1f} -> {now['throughput_rps']:>7.1f}{flag}")
+        if flag:
+            regressions.append(op)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--warmup', type=float, default=3)
+    parser.add_argument('--seed-packages', type=int, default=1000)
+    parser.add_argument('--mix', type=parse_mix, default=DEFAULT_MIX,
+                        help='weights, e.g. track=60,create=10,status=10,dashboard=15,upload=5')
+    parser.add_argument('--aws-latency-ms', type=float, default=0, help='delay added to every fake AWS call')
+    parser.add_argument('--db', choices=('sqlite', 'postgres'), default='sqlite')
+    parser.add_argument('--output', default='load_bench.json')
+    parser.add_argument('--baseline', help='earlier --output file to compare with')
+    parser.add_argument('--update-baseline', action='store_true', help='write this run to --baseline')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative change (default 0.2)')
+    parser.add_argument('--port', type=int, default=5204)
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['ADMISSION_CONTROL'] = '0'
+        if args.db == 'sqlite':
+            os.environ.update(DB_TYPE='sqlite', SQLITE_PATH=os.path.join(tmp, 'load.db'))
+        else:
+            os.environ['DB_TYPE'] = 'postgres'
+        from werkzeug.serving import make_server
+        from benchmarks import fake_aws
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        
+        # The app and aws_services print for every email and notification
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            from app import app
+            fakes = fake_aws.install(args.aws_latency_ms / 1000)
+            workload = Workload(seed(app, args.seed_packages, random.Random(0)))
+            server = make_server('127.0.0.1', args.port, app, threaded=True)
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            try:
+                if args.warmup:
+                    run_clients(args.port, workload, args.mix, args.concurrency, args.warmup, 1)
+                latencies, errors = run_clients(args.port, workload, args.mix, args.concurrency, args.duration, 2)
+            finally:
+                server.shutdown()
+    
+    endpoints, total = summarize(latencies, errors, args.duration)
+    result = {
+        'config': {'concurrency': args.concurrency, 'duration': args.duration, 'db': args.db,
+                   'mix': args.mix, 'aws_latency_ms': args.aws_latency_ms, 'seed_packages': args.seed_packages},
+        'endpoints': endpoints,
+        'total': total,
+        'aws_calls': {name: dict(fake.calls) for name, fake in fakes.items()},
+    }
+    print(f"{'endpoint':<12} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for op, s in sorted(endpoints.items()) + [('total', total)]:
+        print(f"{op:<12} {s['throughput_rps']:>8.1f} {s['p50_ms']:>8.2f} {s['p95_ms']:>8.2f} "
+              f"{s['p99_ms']:>8.2f} {s['errors']:>7}")
+    with open(args.output, 'w') as f:
+        json.dump(result, f, indent=2)
+    print(f"Wrote {args.output}")
+    
+    if args.baseline and args.update_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(result, f, indent=2)
+        print(f"Updated baseline {args.baseline}")
+    elif args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        if regressions:
+            print(f"Regressed beyond {args.tolerance:.0%}: {', '.join(regressions)}")
+            sys.exit(1)
+        print("No regressions")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""Load test driver location ingestion against the production server
+
+Usage (from the repository root):
+    python3 -m benchmarks.location_bench [--drivers 2000] [--batch 50] [--duration 30]
+
+Starts gunicorn on a scratch SQLite database and has client processes post
+ping batches for many simulated drivers over keep-alive connections. Reports
+sustained pings/sec, the server's memory (all processes) every few seconds
+to show it stays bounded, and checks every accepted ping reached the
+database once the flusher has caught up.
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from benchmarks.server_bench import wait_ready
+
+PORT = 5203
+
+def rss_kb(root_pid):
+    """Resident memory of a process and its children, from /proc"""
+    total = 0
+    pids = [str(root_pid)]
+    try:
+        children = subprocess.run(['ps', '-o', 'pid=', '--ppid', str(root_pid)],
+                                  capture_output=True, text=True).stdout.split()
+        pids += children
+    except OSError:
+        pass
+    for pid in pids:
+        try:
+            with open(f'/proc/{pid}/status') as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        total += int(line.split()[1])
+        except OSError:
+            continue
+    return total
+
+def client(args):
+    worker, drivers, batch, duration, threads = args
+    counts = [0] * threads
+    errors = [0] * threads
+    
+    def run(t):
+        rng = random.Random(worker * 1000 + t)
+        conn = http.client.HTTPConnection('127.0.0.1', PORT, timeout=10)
+        ids = [f"drv{worker}-{t}-{i}" for i in range(drivers)]
+        end = time.time() + duration
+        sent = 0
+        while time.time() < end:
+            # Round-robin, like drivers each uploading a batch every few seconds
+            driver = ids[sent % len(ids)]
+            sent += 1
+            now = time.time()
+            lat, lon = 53.35 + rng.random() * 0.1, -6.26 + rng.random() * 0.1
+            pings = [[now - (batch - i), lat + i * 1e-5, lon] for i in range(batch)]
+            try:
+                conn.request('POST', f'/api/drivers/{driver}/locations', json.dumps({'pings': pings}),
+                             {'Content-Type': 'application/json'})
+                resp = conn.getresponse()
+                body = resp.read()
+                if resp.status == 202:
+                    counts[t] += json.loads(body)['accepted']
+                else:
+                    errors[t] += 1
+            except (OSError, http.client.HTTPException):
+                errors[t] += 1
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', PORT, timeout=10)
+    
+    workers = [threading.Thread(target=run, args=(t,)) for t in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return sum(counts), sum(errors)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--drivers', type=int, default=2000)
+    parser.add_argument('--batch', type=int, default=50, help='pings per request')
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=None, help='gunicorn workers')
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        db = os.path.join(tmp, 'locations.db')
+        env = dict(os.environ, ADMISSION_CONTROL='0', SQLITE_PATH=db, BIND=f'127.0.0.1:{PORT}',
+                   GUNICORN_PIDFILE=os.path.join(tmp, 'gunicorn.pid'), GUNICORN_ACCESS_LOG='/dev/null',
+                   GUNICORN_MAX_REQUESTS='0')
+        if args.workers:
+            env['WEB_CONCURRENCY'] = str(args.workers)
+        server = subprocess.Popen([sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'],
+                                  env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            if not wait_ready(PORT):
+                print("Server did not start")
+                return
+            processes = min(args.concurrency, os.cpu_count() or 1, 4)
+            threads = max(1, args.concurrency // processes)
+            per_thread = max(1, args.drivers // (processes * threads))
+            print(f"{processes * threads * per_thread} drivers, {args.batch} pings/request, {args.duration:.0f}s")
+            
+            began = time.time()
+            with multiprocessing.Pool(processes) as pool:
+                pending = pool.map_async(client, [(w, per_thread, args.batch, args.duration, threads)
+                                                  for w in range(processes)])
+                while not pending.ready():
+                    pending.wait(5)
+                    print(f"  t={time.time() - began:5.1f}s  server RSS {rss_kb(server.pid) / 1024:7.1f} MB")
+                results = pending.get()
+            elapsed = time.time() - began
+            accepted = sum(r[0] for r in results)
+            errors = sum(r[1] for r in results)
+            print(f"Accepted {accepted} pings: {accepted / elapsed:,.0f} pings/sec ({errors} failed requests)")
+            
+            time.sleep(3)  # let the flushers catch up
+            stored = sqlite3.connect(db).execute('SELECT COUNT(*) FROM driver_locations').fetchone()[0]
+            print(f"Stored {stored} pings ({accepted - stored} not yet flushed or dropped)")
+        finally:
+            server.terminate()
+            server.wait()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Measure the cost of metrics on the tracking path
+
+Usage (from the repository root):
+    python3 -m benchmarks.metrics_bench [--requests 5000] [--rounds 5]
+
+Two measurements:
+
+- instrumentation cost: how many timed calls one GET /api/packages/<id>
+  makes (read back from the registry), times the measured cost of a
+  timed call and of the request hooks, as a share of the request time.
+  This is the figure to hold to the 1% budget; it does not depend on
+  machine noise.
+- end to end: the same request in fresh processes with METRICS_ENABLED=1
+  and 0 (decorators are applied at import), alternating rounds and taking
+  the best of each. Differences of a few percent are within run-to-run
+  noise on a busy machine.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+def per_call(fn, iterations=200000):
+    began = time.perf_counter()
+    for _ in range(iterations):
+        fn()
+    return (time.perf_counter() - began) / iterations * 1e6
+
+def seed(client):
+    data = client.post('/api/packages', json={
+        'recipient_name': 'Bench', 'recipient_address': 'Dublin 2', 'pickup_address': 'Cork'}).get_json()
+    return f"/api/packages/{data['tracking_id']}"
+
+def time_requests(client, path, requests):
+    for _ in range(200):
+        client.get(path)
+    began = time.perf_counter()
+    for _ in range(requests):
+        client.get(path)
+    return (time.perf_counter() - began) / requests * 1e6
+
+def child(requests):
+    from app import app
+    client = app.test_client()
+    path = seed(client)
+    print(json.dumps({'us': time_requests(client, path, requests)}))
+
+def end_to_end(enabled, requests, tmp):
+    env = dict(os.environ, METRICS_ENABLED=enabled, ADMISSION_CONTROL='0',
+               SQLITE_PATH=os.path.join(tmp, f'metrics_{enabled}.db'))
+    out = subprocess.run([sys.executable, '-m', 'benchmarks.metrics_bench', '--child', '--requests', str(requests)],
+                         env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])['us']
+
+def instrumentation_cost(requests, tmp):
+    os.environ.update(METRICS_ENABLED='1', ADMISSION_CONTROL='0', SQLITE_PATH=os.path.join(tmp, 'metrics_cost.db'))
+    from flask import Response
+    from app import app
+    import metrics
+    client = app.test_client()
+    path = seed(client)
+    
+    def stage_calls():
+        return sum(sum(child.snapshot()[0]) for child in list(metrics.STAGE_SECONDS._children.values()))
+    before = stage_calls()
+    request_us = time_requests(client, path, requests)
+    calls = (stage_calls() - before) / (requests + 200)
+    
+    plain = lambda: None
+    timed = metrics.timed('bench')(plain)
+    call_us = per_call(timed) - per_call(plain)
+    with app.test_request_context(path):
+        response = Response('')
+        hooks_us = per_call(lambda: metrics.record_request(metrics.start_timer() or response))
+    cost = calls * call_us + hooks_us
+    print(f"timed calls per request {calls:.1f} x {call_us:.2f} us + request hooks {hooks_us:.2f} us "
+          f"= {cost:.1f} us of {request_us:.0f} us ({cost / request_us * 100:.2f}%)")
+    return cost / request_us * 100
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--rounds', type=int, default=5)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.requests)
+        return
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        share = instrumentation_cost(args.requests, tmp)
+        times = {'1': [], '0': []}
+        for _ in range(args.rounds):
+            for enabled in ('1', '0'):
+                times[enabled].append(end_to_end(enabled, args.requests, tmp))
+    on, off = min(times['1']), min(times['0'])
+    print(f"end to end: metrics off {off:.0f} us, on {on:.0f} us ({(on - off) / off * 100:+.1f}%)")
+    print(f"Instrumentation {'within' if share < 1 else 'OVER'} the 1% budget")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Measure the cost of slow request capture and profiling on the tracking path
+
+Usage (from the repository root):
+    python3 -m benchmarks.profiler_bench [--requests 5000] [--rounds 3]
+
+Times GET /api/packages/<id> through the test client in fresh processes:
+capture off (SLOW_REQUEST_MS=0), the default (every request's calls
+recorded, none kept), and every request profiled (PROFILE_SAMPLE_RATE=1,
+the cost an X-Profile request pays). Also reports the direct cost of the
+capture bookkeeping per request, which is steadier than the end-to-end
+difference on a noisy machine.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+MODES = {
+    'capture off': {'SLOW_REQUEST_MS': '0', 'PROFILE_SAMPLE_RATE': '0'},
+    'default': {'SLOW_REQUEST_MS': '1000', 'PROFILE_SAMPLE_RATE': '0'},
+    'all profiled': {'SLOW_REQUEST_MS': '60000', 'PROFILE_SAMPLE_RATE': '1'},
+}
+
+
+def time_requests(client, path, requests):
+    for _ in range(200):
+        client.get(path)
+    began = time.perf_counter()
+    for _ in range(requests):
+        client.get(path)
+    return (time.perf_counter() - began) / requests * 1e6
+
+def child(requests):
+    from app import app
+    import profiler
+    client = app.test_client()
+    data = client.post('/api/packages', json={
+        'recipient_name': 'Bench', 'recipient_address': 'Dublin 2', 'pickup_address': 'Cork'}).get_json()
+    path = f"/api/packages/{data['tracking_id']}"
+    request_us = time_requests(client, path, requests)
+    
+    # The middleware around a stub app that only runs the after_request hook
+    with app.test_request_context(path):
+        response = app.response_class('')
+        stub = lambda environ, start_response: profiler.finish_capture(response)
+        middleware = profiler.CaptureMiddleware(app)
+        middleware.wsgi_app = stub
+        environ = {'PATH_INFO': path}
+        iterations = 100000
+        began = time.perf_counter()
+        for _ in range(iterations):
+            stub(environ, None)
+        bare = time.perf_counter() - began
+        began = time.perf_counter()
+        for _ in range(iterations):
+            middleware(environ, None)
+        capture_us = (time.perf_counter() - began - bare) / iterations * 1e6
+    print(json.dumps({'us': request_us, 'capture_us': capture_us}))
+
+def run(env, requests, db):
+    env = dict(os.environ, ADMISSION_CONTROL='0', SQLITE_PATH=db, **env)
+    out = subprocess.run([sys.executable, '-m', 'benchmarks.profiler_bench', '--child', '--requests', str(requests)],
+                         env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(out.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--child', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(args.requests)
+        return
+    
+    results = {mode: [] for mode in MODES}
+    with tempfile.TemporaryDirectory() as tmp:
+        for round_ in range(args.rounds):
+            for i, (mode, env) in enumerate(MODES.items()):
+                results[mode].append(run(env, args.requests, os.path.join(tmp, f'{i}_{round_}.db')))
+    base = min(r['us'] for r in results['capture off'])
+    for mode, runs in results.items():
+        us = min(r['us'] for r in runs)
+        capture = min(r['capture_us'] for r in runs)
+        print(f"{mode:<14} {us:>7.0f} us/request ({(us - base) / base * 100:+.1f}%)   capture bookkeeping {capture:.2f} us")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,101 @@
+"""Measure the per-query overhead of the repository layer on SQLite
+
+Usage (from the repository root):
+    python3 -m benchmarks.repository_bench [--packages 10000] [--queries 20000]
+
+Fills a temporary database with packages, then runs the same lookups by id
+and status updates on one connection (best of --rounds) through:
+- the sqlite3 driver directly (the floor), with and without its statement cache
+- the inline path the routes used before: execute_query, rewritten per call,
+  read back as a dict
+- repository.Query, giving a record and then a dict as the routes serialise it
+
+All but the raw driver calls include the db_query timing from metrics.py.
+"""
+import argparse
+import os
+import random
+import sqlite3
+import tempfile
+import time
+
+DB_DIR = tempfile.mkdtemp(prefix='repository_bench_')
+os.environ['SQLITE_PATH'] = os.path.join(DB_DIR, 'bench.db')
+os.environ.setdefault('DB_TYPE', 'sqlite')
+
+from db_config import execute_query, init_shard, SQLITE_PATH
+import repository
+
+INLINE_SELECT = f'SELECT {repository.PACKAGE_COLUMNS} FROM packages WHERE id=?'
+INLINE_UPDATE = 'UPDATE packages SET status=? WHERE id=?'
+
+
+def fill(count):
+    init_shard()
+    conn = sqlite3.connect(SQLITE_PATH)
+    rng = random.Random(0)
+    ids = [f'pkg-{i:08d}' for i in range(count)]
+    for package_id in ids:
+        repository.INSERT_PACKAGE.run(conn, (package_id, f'TRK{package_id[-8:]}', 'guest', 'Bench', 'b@example.com',
+                                             'Dublin 2', 'Cork', 'pending', rng.uniform(1, 300), rng.uniform(5, 500),
+                                             None, '2025-01-01T00:00:00', 51.9, -8.5, 53.3, -6.3, 1.0))
+    conn.commit()
+    conn.close()
+    return ids
+
+def per_call_us(fn, ids):
+    for package_id in ids[:500]:
+        fn(package_id)
+    began = time.perf_counter()
+    for package_id in ids:
+        fn(package_id)
+    return (time.perf_counter() - began) / len(ids) * 1e6
+
+def connect(cached_statements=128):
+    conn = sqlite3.connect(SQLITE_PATH, cached_statements=cached_statements)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--packages', type=int, default=10000)
+    parser.add_argument('--queries', type=int, default=20000)
+    parser.add_argument('--rounds', type=int, default=3, help='best of this many rounds per variant')
+    args = parser.parse_args()
+    
+    ids = fill(args.packages)
+    rng = random.Random(1)
+    lookups = [rng.choice(ids) for _ in range(args.queries)]
+    
+    # Each variant: statement cache size, lookup by id, status update
+    variants = {
+        'driver, statement cache': (128,
+            lambda conn, i: conn.execute(INLINE_SELECT, (i,)).fetchone(),
+            lambda conn, i: conn.execute(INLINE_UPDATE, ('assigned', i))),
+        'driver, no cache': (0,
+            lambda conn, i: conn.execute(INLINE_SELECT, (i,)).fetchone(),
+            lambda conn, i: conn.execute(INLINE_UPDATE, ('assigned', i))),
+        'inline execute_query': (128,
+            lambda conn, i: dict(execute_query(conn, INLINE_SELECT, (i,)).fetchone()),
+            lambda conn, i: execute_query(conn, INLINE_UPDATE, ('assigned', i)).rowcount),
+        'repository': (128,
+            lambda conn, i: repository.PACKAGE_BY_ID.one(conn, (i,))._asdict(),
+            lambda conn, i: repository.SET_STATUS.run(conn, ('assigned', i))),
+    }
+    results = {name: (float('inf'), float('inf')) for name in variants}
+    for _ in range(args.rounds):
+        for name, (cache, select, update) in variants.items():
+            conn = connect(cache)
+            timings = (per_call_us(lambda i: select(conn, i), lookups),
+                       per_call_us(lambda i: update(conn, i), lookups))
+            conn.rollback()
+            conn.close()
+            results[name] = tuple(map(min, results[name], timings))
+    
+    base_select, base_update = results['driver, statement cache']
+    print(f"{'':<26} {'select by id':>14} {'update status':>16}")
+    for name, (select, update) in results.items():
+        print(f"{name:<26} {select:>7.2f} us {select - base_select:+5.2f} {update:>8.2f} us {update - base_update:+5.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""Benchmark road-network distance queries on a synthetic road graph
+
+Usage (from the repository root):
+    python3 -m benchmarks.road_bench [--side 150] [--queries 2000] [--graph road_graph.npz]
+
+Without --graph, builds a town-like network: a jittered grid around Dublin
+with some streets missing, some one-way, faster arterial roads every tenth
+row and column, and a bay cut through the middle crossed by two bridges, so
+road and straight-line distances differ the way they do around Cork harbour.
+It is contracted (timed), then checked against plain Dijkstra on sample
+pairs. Reported: contraction time, point-to-point, one-to-many and snapping
+queries per second, and the mean road/straight-line ratio.
+"""
+import argparse
+import heapq
+import random
+import time
+import numpy as np
+from road_network import RoadNetwork, contract, to_csr, haversine_meters, INF
+
+ORIGIN = (53.30, -6.35)
+SPACING_DEG = (0.0018, 0.003)  # ~200 m
+
+
+def synthetic_graph(side, seed=0):
+    """(lat, lon, src, dst, metres) of a side x side street grid with a bay"""
+    rng = np.random.default_rng(seed)
+    rows, cols = np.divmod(np.arange(side * side), side)
+    lat = ORIGIN[0] + rows * SPACING_DEG[0] + rng.normal(0, SPACING_DEG[0] / 8, side * side)
+    lon = ORIGIN[1] + cols * SPACING_DEG[1] + rng.normal(0, SPACING_DEG[1] / 8, side * side)
+    src, dst = [], []
+    bay_row = side // 2
+    bridges = {side // 4, 3 * side // 4}
+    for r in range(side):
+        for c in range(side):
+            v = r * side + c
+            for nr, nc in ((r, c + 1), (r + 1, c)):
+                if nr >= side or nc >= side:
+                    continue
+                # The bay: no crossing between bay_row and bay_row + 1 except at the bridges
+                if r == bay_row and nr == bay_row + 1 and c not in bridges:
+                    continue
+                arterial = r % 10 == 0 or c % 10 == 0
+                if not arterial and rng.random() < 0.1:
+                    continue
+                w = nr * side + nc
+                one_way = not arterial and rng.random() < 0.1
+                src.append(v), dst.append(w)
+                if not one_way:
+                    src.append(w), dst.append(v)
+    src, dst = np.array(src), np.array(dst)
+    metres = haversine_meters(lat[src], lon[src], lat[dst], lon[dst])
+    # Arterials are preferred, as routing on travel time would
+    arterial = ((rows[src] == rows[dst]) & (rows[src] % 10 == 0)) | ((cols[src] == cols[dst]) & (cols[src] % 10 == 0))
+    metres = np.where(arterial, metres * 0.8, metres)
+    return lat, lon, src, dst, metres
+
+def dijkstra(offsets, targets, weights, source, target):
+    dist = {source: 0.0}
+    heap = [(0.0, source)]
+    while heap:
+        d, x = heapq.heappop(heap)
+        if x == target:
+            return d
+        if d > dist[x]:
+            continue
+        for i in range(offsets[x], offsets[x + 1]):
+            y, nd = targets[i], d + weights[i]
+            if nd < dist.get(y, INF):
+                dist[y] = nd
+                heapq.heappush(heap, (nd, y))
+    return INF
+
+def rate(fn, items):
+    began = time.perf_counter()
+    for item in items:
+        fn(item)
+    elapsed = time.perf_counter() - began
+    return len(items) / elapsed, elapsed / len(items) * 1e6
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--side', type=int, default=150, help='grid side (nodes = side^2)')
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--targets', type=int, default=50, help='destinations per one-to-many query')
+    parser.add_argument('--check', type=int, default=50, help='pairs checked against plain Dijkstra')
+    parser.add_argument('--graph', help='benchmark an existing graph file instead')
+    args = parser.parse_args()
+    rng = random.Random(1)
+    
+    if args.graph:
+        network = RoadNetwork.load(args.graph)
+        print(f"Loaded {args.graph}: {len(network)} nodes")
+    else:
+        lat, lon, src, dst, metres = synthetic_graph(args.side)
+        n = len(lat)
+        print(f"Synthetic graph: {n} nodes, {len(src)} directed edges")
+        began = time.perf_counter()
+        _, up, down = contract(n, src, dst, metres)
+        network = RoadNetwork(lat, lon, to_csr(n, *up), to_csr(n, *down))
+        print(f"Contraction: {time.perf_counter() - began:.1f}s, {len(up[0]) + len(down[0])} hierarchy edges "
+              f"({(len(up[0]) + len(down[0])) / len(src):.2f}x the road edges)")
+        
+        plain = tuple(a.tolist() for a in to_csr(n, src, dst, metres))
+        pairs = [(rng.randrange(n), rng.randrange(n)) for _ in range(args.check)]
+        began = time.perf_counter()
+        expected = [dijkstra(*plain, s, t) for s, t in pairs]
+        dijkstra_us = (time.perf_counter() - began) / len(pairs) * 1e6
+        for (s, t), length in zip(pairs, expected):
+            for got in (network.distance(s, t), network.distances(s, [t])[0]):
+                if not (length == got == INF or abs(length - got) <= 1e-3 * max(length, 1.0)):
+                    raise SystemExit(f"Mismatch {s}->{t}: dijkstra {length} ch {got}")
+        print(f"Matches plain Dijkstra on {args.check} random pairs ({dijkstra_us:.0f} us/query)")
+    
+    n = len(network)
+    pairs = [(rng.randrange(n), rng.randrange(n)) for _ in range(args.queries)]
+    per_sec, us = rate(lambda p: network.distance(*p), pairs)
+    print(f"point-to-point  {per_sec:>9.0f} queries/s  {us:>8.1f} us/query")
+    
+    batches = [(rng.randrange(n), [rng.randrange(n) for _ in range(args.targets)])
+               for _ in range(max(1, args.queries // args.targets))]
+    per_sec, us = rate(lambda b: network.distances(*b), batches)
+    print(f"one-to-{args.targets:<8} {per_sec * args.targets:>9.0f} distances/s {us / args.targets:>7.1f} us/distance")
+    
+    lo, hi = (float(network.lat.min()), float(network.lon.min())), (float(network.lat.max()), float(network.lon.max()))
+    points = [(rng.uniform(lo[0], hi[0]), rng.uniform(lo[1], hi[1])) for _ in range(args.queries)]
+    per_sec, us = rate(lambda p: network.snap(*p), points)
+    print(f"snap            {per_sec:>9.0f} points/s   {us:>8.1f} us/point")
+    
+    ratios = []
+    for a, b in zip(points[::2], points[1::2]):
+        road = network.route_meters(a, [b])[0]
+        if road is not None:
+            ratios.append(road / float(haversine_meters(*a, *b)))
+    print(f"road / straight-line distance: mean {np.mean(ratios):.2f}, max {np.max(ratios):.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""Benchmark full-text package search on a large SQLite table
+
+Usage (from the repository root):
+    python3 -m benchmarks.search_bench [--rows 1000000]
+
+Loads synthetic packages into a temporary database (the FTS index is filled
+by the insert trigger) and reports latency for typical customer-service
+queries: partial names, email fragments and EIRCODEs.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+import ids
+import db_config
+
+INSERT_PACKAGE = '''
+    INSERT INTO packages (id, tracking_id, sender_id, recipient_name, recipient_email, recipient_address,
+                          pickup_address, status, distance, price, driver_id, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+FIRST = ['Jane', 'John', 'Aoife', 'Sean', 'Niamh', 'Conor', 'Ciara', 'Patrick', 'Siobhan', 'Liam']
+LAST = ['Murphy', 'Kelly', 'Byrne', 'Ryan', "O'Brien", 'Walsh', 'Doyle', 'McCarthy', 'Gallagher', 'Doherty']
+TOWNS = ['Dublin D02 AF30', 'Cork T12 X7F2', 'Galway H91 E2K3', 'Limerick V94 T9PX', 'Waterford X91 K7D4']
+QUERIES = ['murphy', 'murph', 'jan', 'aoife doyle', 'kelly@', 'd02', 'gallagher galway', 'zzzz']
+
+def email(first, last, i):
+    # Roughly one address in five carries a number, as in real data; each
+    # numbered address adds a distinct token that prefix queries expand over
+    suffix = str(i) if i % 5 == 0 else ''
+    domain = random.choice(['gmail.com', 'eircom.net', 'outlook.ie'])
+    return f"{first}.{last}{suffix}@{domain}".lower().replace("'", '')
+
+def rows(count):
+    for i in range(count):
+        first, last = random.choice(FIRST), random.choice(LAST)
+        yield (ids.new_id(), ids.tracking_id(), 'guest',
+               f"{first} {last}", email(first, last, i),
+               f"{random.randint(1, 200)} Main Street, {random.choice(TOWNS)}",
+               random.choice(TOWNS), 'pending', 10.0, 25.0, None, f"2025-01-01T00:00:{i:09d}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--repeats', type=int, default=20)
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'search.db')
+        db_config.init_shard(path)
+        db_config.router = db_config.ShardRouter([path])
+        import search
+        search.router = db_config.router
+        
+        began = time.perf_counter()
+        conn = db_config.get_db_connection(path)
+        conn.executemany(INSERT_PACKAGE, rows(args.rows))
+        conn.commit()
+        conn.close()
+        print(f"Loaded {args.rows} rows in {time.perf_counter() - began:.1f}s")
+        
+        print(f"{'query':<20} {'hits':>5} {'ms/query':>9}")
+        for query in QUERIES:
+            result = search.search_packages(query)
+            began = time.perf_counter()
+            for _ in range(args.repeats):
+                search.search_packages(query)
+            elapsed = (time.perf_counter() - began) / args.repeats * 1000
+            print(f"{query:<20} {len(result['results']):>5} {elapsed:>9.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,120 @@
+"""Compare requests/sec of the Flask dev server and the gunicorn setup
+
+Usage (from the repository root):
+    python3 -m benchmarks.server_bench [--concurrency 16] [--duration 10]
+
+Starts each server on a scratch SQLite database, seeds one package, then
+drives a tracking-heavy mix (GET /api/packages/<tracking_id> and
+/api/health) from several client processes with keep-alive connections.
+Admission control is disabled so the limiter does not shed the load.
+"""
+import argparse
+import http.client
+import json
+import multiprocessing
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+def wait_ready(port, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            conn = http.client.HTTPConnection('127.0.0.1', port, timeout=1)
+            conn.request('GET', '/api/health')
+            if conn.getresponse().status == 200:
+                return True
+        except OSError:
+            time.sleep(0.2)
+    return False
+
+def seed(port):
+    conn = http.client.HTTPConnection('127.0.0.1', port)
+    body = json.dumps({'recipient_name': 'Bench', 'recipient_address': 'Dublin 2', 'pickup_address': 'Cork'})
+    conn.request('POST', '/api/packages', body, {'Content-Type': 'application/json'})
+    return json.loads(conn.getresponse().read())['tracking_id']
+
+def client(args):
+    port, paths, duration, threads = args
+    import threading
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    
+    def run():
+        conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+        local = []
+        end = time.time() + duration
+        i = 0
+        while time.time() < end:
+            path = paths[i % len(paths)]
+            i += 1
+            began = time.perf_counter()
+            try:
+                conn.request('GET', path)
+                resp = conn.getresponse()
+                resp.read()
+                if resp.status >= 500:
+                    errors[0] += 1
+            except (OSError, http.client.HTTPException):
+                errors[0] += 1
+                conn.close()
+                conn = http.client.HTTPConnection('127.0.0.1', port, timeout=10)
+                continue
+            local.append(time.perf_counter() - began)
+        with lock:
+            latencies.extend(local)
+    
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    return latencies, errors[0]
+
+def bench(name, command, port, env, concurrency, duration):
+    proc = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        if not wait_ready(port):
+            print(f"{name}: server did not start")
+            return
+        tracking_id = seed(port)
+        paths = [f'/api/packages/{tracking_id}'] * 3 + ['/api/health']
+        processes = min(concurrency, os.cpu_count() or 1, 4)
+        per_process = max(1, concurrency // processes)
+        with multiprocessing.Pool(processes) as pool:
+            results = pool.map(client, [(port, paths, duration, per_process)] * processes)
+        latencies = sorted(l for r in results for l in r[0])
+        errors = sum(r[1] for r in results)
+        if not latencies:
+            print(f"{name}: no successful requests")
+            return
+        p = lambda q: latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000
+        print(f"{name:<10} {len(latencies) / duration:>9.0f} {p(0.5):>8.2f} {p(0.99):>8.2f} {errors:>7}")
+    finally:
+        proc.terminate()
+        proc.wait()
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10)
+    parser.add_argument('--workers', type=int, default=None, help='gunicorn workers (default: gunicorn.conf.py)')
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, ADMISSION_CONTROL='0', SQLITE_PATH=os.path.join(tmp, 'bench.db'),
+                   GUNICORN_PIDFILE=os.path.join(tmp, 'gunicorn.pid'), GUNICORN_ACCESS_LOG='/dev/null')
+        if args.workers:
+            env['WEB_CONCURRENCY'] = str(args.workers)
+        
+        print(f"{'server':<10} {'req/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        bench('dev', [sys.executable, 'app.py'], 5201, dict(env, PORT='5201'),
+              args.concurrency, args.duration)
+        bench('gunicorn', [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'app:app'], 5202,
+              dict(env, BIND='127.0.0.1:5202'), args.concurrency, args.duration)
+
+if __name__ == '__main__':
+    main()
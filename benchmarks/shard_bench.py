@@ -0,0 +1,95 @@
+"""Benchmark the shard router against N local SQLite shards
+
+Usage (from the repository root):
+    python3 -m benchmarks.shard_bench [--rows 20000] [--shards 1,2,4,8]
+
+Reports insert rate, point lookups/sec by tracking_id and scatter-gather
+listing latency for each shard count, plus the share of rows a rebalance
+moves when one shard is added.
+"""
+import argparse
+import os
+import random
+import tempfile
+import time
+import ids
+from datetime import datetime, timedelta
+from db_config import ShardRouter, init_shard, execute_query, rebalance_shards
+
+INSERT_PACKAGE = '''
+    INSERT INTO packages (id, tracking_id, sender_id, recipient_name, recipient_email, recipient_address,
+                          pickup_address, status, distance, price, driver_id, created_at)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+'''
+
+LIST_QUERY = '''
+    SELECT id, tracking_id, sender_id, recipient_name, recipient_email,
+           recipient_address, pickup_address, status, distance, price, driver_id, created_at
+    FROM packages ORDER BY created_at DESC LIMIT 10
+'''
+
+def make_packages(count):
+    start = datetime(2025, 1, 1)
+    statuses = ['pending', 'assigned', 'in_transit', 'delivered']
+    return [(ids.new_id(), ids.tracking_id(), 'guest',
+             f"Recipient {i}", f"r{i}@example.com", 'Dublin 2', 'Cork',
+             random.choice(statuses), round(random.uniform(1, 250), 2),
+             round(random.uniform(5, 500), 2), None,
+             (start + timedelta(seconds=i)).isoformat())
+            for i in range(count)]
+
+def load(router, packages):
+    by_shard = {}
+    for package in packages:
+        by_shard.setdefault(router.shard_for(package[1]), []).append(package)
+    began = time.perf_counter()
+    for shard, rows in by_shard.items():
+        conn = router.connect(shard)
+        conn.executemany(INSERT_PACKAGE, rows)
+        conn.commit()
+        conn.close()
+    return time.perf_counter() - began
+
+def bench_lookups(router, tracking_ids):
+    began = time.perf_counter()
+    for tracking_id in tracking_ids:
+        conn = router.connection_for(tracking_id)
+        execute_query(conn, 'SELECT * FROM packages WHERE tracking_id=?', (tracking_id,)).fetchone()
+        conn.close()
+    return len(tracking_ids) / (time.perf_counter() - began)
+
+def bench_listing(router, repeats=50):
+    began = time.perf_counter()
+    for _ in range(repeats):
+        router.gather(LIST_QUERY, limit=10)
+    return (time.perf_counter() - began) / repeats * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--shards', default='1,2,4,8')
+    parser.add_argument('--lookups', type=int, default=5000)
+    args = parser.parse_args()
+    
+    packages = make_packages(args.rows)
+    sample = [p[1] for p in random.sample(packages, min(args.lookups, len(packages)))]
+    
+    print(f"{'shards':>6} {'insert rows/s':>14} {'lookups/s':>10} {'list ms':>8}")
+    for count in [int(n) for n in args.shards.split(',')]:
+        with tempfile.TemporaryDirectory() as tmp:
+            shards = [os.path.join(tmp, f"shard_{i}.db") for i in range(count)]
+            for shard in shards:
+                init_shard(shard)
+            router = ShardRouter(shards)
+            insert_time = load(router, packages)
+            print(f"{count:>6} {args.rows / insert_time:>14.0f} "
+                  f"{bench_lookups(router, sample):>10.0f} {bench_listing(router):>8.2f}")
+            
+            grown = shards + [os.path.join(tmp, f"shard_{count}.db")]
+            moves = rebalance_shards(shards, grown, dry_run=True)
+            moved = sum(moves.values())
+            print(f"{'':>6} adding shard {count + 1} moves {moved} rows "
+                  f"({moved / args.rows:.1%}, ideal {1 / (count + 1):.1%})")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,26 @@
+"""Build minified, fingerprinted and precompressed UI assets
+
+Usage:
+    python3 build_assets.py
+
+Writes static/dist/ (see static_assets.py). Brotli variants need the Brotli
+package; without it only gzip variants are written. Restart or reload the
+server afterwards to pick up the new build.
+"""
+import os
+from static_assets import STATIC_DIR, DIST_DIR, ENCODINGS, build, _brotli
+
+def main():
+    if _brotli() is None:
+        print("Brotli not installed (pip install Brotli); writing gzip variants only")
+    manifest = build()
+    source = os.path.getsize(os.path.join(STATIC_DIR, 'index.html'))
+    print(f"static/index.html: {source} bytes")
+    for name, info in manifest.items():
+        path = os.path.join(DIST_DIR, name)
+        sizes = [f"{os.path.getsize(path)} raw"] + [f"{os.path.getsize(path + suffix)} {encoding}"
+                                                    for encoding, suffix in ENCODINGS if encoding in info['encodings']]
+        print(f"dist/{name}: {', '.join(sizes)} bytes")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,153 @@
+"""Build the road graph for road_network.py from an OpenStreetMap extract
+
+Usage:
+    python3 build_road_graph.py ireland-and-northern-ireland-latest.osm.pbf [--output road_graph.npz]
+
+Reads the drivable ways (.osm.pbf needs pyosmium; .osm and .osm.bz2 XML
+are read with the standard library), splits them into edges at junctions,
+keeps the largest connected network, contracts it and writes ROAD_GRAPH_PATH
+(default ./road_graph.npz). Running servers pick up the new file within
+ROAD_RELOAD_SECONDS. Contraction is the slow part; run it offline when the
+extract is updated, not on the servers.
+"""
+import argparse
+import bz2
+import time
+import xml.etree.ElementTree as ET
+import numpy as np
+from road_network import ROAD_GRAPH_PATH, RoadNetwork, haversine_meters, largest_component
+
+HIGHWAYS = {
+    'motorway', 'motorway_link', 'trunk', 'trunk_link', 'primary', 'primary_link',
+    'secondary', 'secondary_link', 'tertiary', 'tertiary_link', 'unclassified',
+    'residential', 'living_street', 'service', 'road',
+}
+NO_ACCESS = {'no', 'private'}
+# Directions a way can be driven: 1 along its nodes, -1 against them, 0 both
+FORWARD, BACKWARD, BOTH = 1, -1, 0
+
+
+def way_direction(tags):
+    """Drivable direction of a way from its tags, None if vans cannot use it"""
+    if tags.get('highway') not in HIGHWAYS or tags.get('area') == 'yes':
+        return None
+    if tags.get('access') in NO_ACCESS or tags.get('motor_vehicle') in NO_ACCESS:
+        return None
+    if tags.get('service') == 'parking_aisle':
+        return None
+    oneway = tags.get('oneway')
+    if oneway in ('yes', 'true', '1'):
+        return FORWARD
+    if oneway == '-1':
+        return BACKWARD
+    if oneway is None and (tags['highway'] == 'motorway' or tags.get('junction') == 'roundabout'):
+        return FORWARD
+    return BOTH
+
+def read_pbf(path):
+    try:
+        import osmium
+    except ImportError:
+        raise ImportError("osmium is required for .osm.pbf files. Install with: pip install osmium")
+    
+    ways, coords = [], {}
+    
+    class Handler(osmium.SimpleHandler):
+        def way(self, way):
+            direction = way_direction({tag.k: tag.v for tag in way.tags})
+            if direction is None:
+                return
+            refs = []
+            for node in way.nodes:
+                if node.location.valid():
+                    coords[node.ref] = (node.location.lat, node.location.lon)
+                    refs.append(node.ref)
+            ways.append((refs, direction))
+    
+    Handler().apply_file(path, locations=True)
+    return ways, coords
+
+def osm_elements(path):
+    """Top-level elements (node, way, relation) of an OSM XML file, each freed after use"""
+    opener = bz2.open if path.endswith('.bz2') else open
+    with opener(path, 'rb') as f:
+        context = ET.iterparse(f, events=('start', 'end'))
+        _, root = next(context)
+        for event, elem in context:
+            if event == 'end' and elem.tag in ('node', 'way', 'relation'):
+                yield elem
+                root.clear()
+
+def read_xml(path):
+    """Two passes: ways first, then the coordinates of the nodes they use"""
+    ways, needed = [], set()
+    for elem in osm_elements(path):
+        if elem.tag == 'way':
+            direction = way_direction({t.get('k'): t.get('v') for t in elem.iter('tag')})
+            if direction is not None:
+                refs = [int(nd.get('ref')) for nd in elem.iter('nd')]
+                ways.append((refs, direction))
+                needed.update(refs)
+    coords = {}
+    for elem in osm_elements(path):
+        if elem.tag == 'node' and int(elem.get('id')) in needed:
+            coords[int(elem.get('id'))] = (float(elem.get('lat')), float(elem.get('lon')))
+    return ways, coords
+
+def build_edges(ways, coords):
+    """Split ways at junctions: (node ids, src, dst, metres)"""
+    uses = {}
+    for refs, _ in ways:
+        refs = [r for r in refs if r in coords]
+        for i, ref in enumerate(refs):
+            # Way ends count twice, so they are always kept
+            uses[ref] = uses.get(ref, 0) + (2 if i in (0, len(refs) - 1) else 1)
+    index = {}
+    src, dst, metres = [], [], []
+    for refs, direction in ways:
+        refs = [r for r in refs if r in coords]
+        if len(refs) < 2:
+            continue
+        lat, lon = np.array([coords[r] for r in refs]).T
+        steps = haversine_meters(lat[:-1], lon[:-1], lat[1:], lon[1:]).tolist()
+        start, length = refs[0], 0.0
+        for ref, step in zip(refs[1:], steps):
+            length += step
+            if uses[ref] < 2:
+                continue
+            a, b = index.setdefault(start, len(index)), index.setdefault(ref, len(index))
+            if direction != BACKWARD:
+                src.append(a), dst.append(b), metres.append(length)
+            if direction != FORWARD:
+                src.append(b), dst.append(a), metres.append(length)
+            start, length = ref, 0.0
+    ids = np.empty(len(index), np.int64)
+    ids[list(index.values())] = list(index.keys())
+    return ids, np.array(src, np.int64), np.array(dst, np.int64), np.array(metres)
+
+def main():
+    parser = argparse.ArgumentParser(description='Build the road graph from an OpenStreetMap extract')
+    parser.add_argument('extract', help='.osm.pbf, .osm or .osm.bz2 file')
+    parser.add_argument('--output', default=ROAD_GRAPH_PATH)
+    args = parser.parse_args()
+    
+    began = time.time()
+    ways, coords = read_pbf(args.extract) if args.extract.endswith('.pbf') else read_xml(args.extract)
+    ids, src, dst, metres = build_edges(ways, coords)
+    print(f"Read {len(ways)} drivable ways: {len(ids)} junctions, {len(src)} directed edges")
+    
+    keep = largest_component(len(ids), src, dst)
+    renumber = np.cumsum(keep) - 1
+    inside = keep[src] & keep[dst]
+    src, dst, metres = renumber[src[inside]], renumber[dst[inside]], metres[inside]
+    lat, lon = np.array([coords[ref] for ref in ids[keep].tolist()]).T
+    print(f"Largest connected network: {len(lat)} junctions, {len(src)} edges")
+    
+    progress = lambda done, total: print(f"  contracted {done}/{total} ({time.time() - began:.0f}s)")
+    network = RoadNetwork.build(lat, lon, src, dst, metres, progress=progress)
+    network.save(args.output)
+    print(f"Wrote {args.output}: {len(network.up[1]) + len(network.down[1])} hierarchy edges "
+          f"in {time.time() - began:.0f}s")
+
+if __name__ == '__main__':
+    main()
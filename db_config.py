@@ -1,6 +1,12 @@
 """Database configuration - supports both SQLite (local) and PostgreSQL (AWS RDS)"""
 import os
 import sqlite3
+import bisect
+import hashlib
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+from ids import TRACKING_ID_LENGTH
+from metrics import timed
 
 # Database type: 'sqlite' or 'postgres'
 DB_TYPE = os.getenv('DB_TYPE', 'sqlite')
@@ -12,17 +18,42 @@ DB_NAME = os.getenv('DB_NAME', 'courier_db')
 DB_USER = os.getenv('DB_USER', 'admin')
 DB_PASSWORD = os.getenv('DB_PASSWORD', '')
 
-def get_db_connection():
-    """Get database connection based on DB_TYPE"""
+# SQLite database file (single-node mode)
+SQLITE_PATH = os.getenv('SQLITE_PATH', 'courier.db')
+
+# Package sharding: comma-separated shard list. Each entry is a SQLite file
+# path in sqlite mode, or "host[:port][/dbname]" in postgres mode.
+# Empty means a single database configured as above.
+DB_SHARDS = [s.strip() for s in os.getenv('DB_SHARDS', '').split(',') if s.strip()]
+DB_SHARD_VNODES = int(os.getenv('DB_SHARD_VNODES', '64'))
+
+def _postgres_params(shard):
+    """Split a "host[:port][/dbname]" shard name into connection params"""
+    host, port, name = DB_HOST, DB_PORT, DB_NAME
+    if shard:
+        host, _, name_part = shard.partition('/')
+        host, _, port_part = host.partition(':')
+        port = port_part or DB_PORT
+        name = name_part or DB_NAME
+    return host, port, name
+
+@timed('db_connect')
+def get_db_connection(shard=None):
+    """Get database connection based on DB_TYPE
+
+    shard selects one of the DB_SHARDS databases; None uses the default
+    single-node database.
+    """
     if DB_TYPE == 'postgres':
         try:
             import psycopg2
             from psycopg2.extras import RealDictCursor
             
+            host, port, name = _postgres_params(shard)
             conn = psycopg2.connect(
-                host=DB_HOST,
-                port=DB_PORT,
-                database=DB_NAME,
+                host=host,
+                port=port,
+                database=name,
                 user=DB_USER,
                 password=DB_PASSWORD,
                 sslmode='require'
@@ -34,10 +65,11 @@ def get_db_connection():
             raise ConnectionError(f"Failed to connect to PostgreSQL: {e}")
     else:
         # SQLite (default)
-        conn = sqlite3.connect('courier.db')
+        conn = sqlite3.connect(shard or SQLITE_PATH)
         conn.row_factory = sqlite3.Row
         return conn
 
+@timed('db_query')
 def execute_query(conn, query, params=None):
     """Execute query with proper parameter placeholders for SQLite or PostgreSQL"""
     cursor = conn.cursor()
@@ -53,9 +85,19 @@ def execute_query(conn, query, params=None):
     
     return cursor
 
+def rows_to_dicts(cursor):
+    """Fetch all rows from cursor as plain dicts (works for both drivers)"""
+    columns = [col[0] for col in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
 def init_db():
-    """Initialize database tables"""
-    conn = get_db_connection()
+    """Initialize database tables on every shard"""
+    for shard in router.shards:
+        init_shard(shard)
+
+def init_shard(shard=None):
+    """Create tables and indexes on a single database"""
+    conn = get_db_connection(shard)
     cursor = conn.cursor()
     
     if DB_TYPE == 'postgres':
@@ -96,6 +138,43 @@ def init_db():
                 created_at TEXT
             )
         ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS idempotency_keys (
+                key TEXT PRIMARY KEY,
+                fingerprint TEXT,
+                status INTEGER,
+                body TEXT,
+                content_type TEXT,
+                created_at DOUBLE PRECISION
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS revoked_tokens (
+                jti TEXT PRIMARY KEY,
+                expires_at DOUBLE PRECISION,
+                revoked_at DOUBLE PRECISION
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS driver_locations (
+                driver_id TEXT,
+                ts DOUBLE PRECISION,
+                lat DOUBLE PRECISION,
+                lon DOUBLE PRECISION
+            )
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS driver_positions (
+                driver_id TEXT PRIMARY KEY,
+                ts DOUBLE PRECISION,
+                lat DOUBLE PRECISION,
+                lon DOUBLE PRECISION
+            )
+        ''')
     else:
         # SQLite syntax
         cursor.execute('''
@@ -117,7 +196,378 @@ def init_db():
             (id TEXT PRIMARY KEY, package_id TEXT, driver_id TEXT,
              status TEXT, created_at TEXT)
         ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS idempotency_keys
+            (key TEXT PRIMARY KEY, fingerprint TEXT, status INTEGER,
+             body TEXT, content_type TEXT, created_at REAL)
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS revoked_tokens
+            (jti TEXT PRIMARY KEY, expires_at REAL, revoked_at REAL)
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS driver_locations
+            (driver_id TEXT, ts REAL, lat REAL, lon REAL)
+        ''')
+        
+        cursor.execute('''
+            CREATE TABLE IF NOT EXISTS driver_positions
+            (driver_id TEXT PRIMARY KEY, ts REAL, lat REAL, lon REAL)
+        ''')
+    
+    # Columns added after the original schema
+    add_columns(cursor, 'packages', [
+        ('pickup_lat', 'REAL'), ('pickup_lon', 'REAL'),
+        ('delivery_lat', 'REAL'), ('delivery_lon', 'REAL'), ('weight_kg', 'REAL'),
+    ])
+    
+    # Indexes used by shard point lookups and scatter-gather listings
+    create_tracking_index(cursor)
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_packages_created_at ON packages (created_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_packages_status ON packages (status)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_deliveries_package_id ON deliveries (package_id)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_revoked_tokens_revoked_at ON revoked_tokens (revoked_at)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_driver_locations_driver_ts ON driver_locations (driver_id, ts)')
+    cursor.execute('CREATE INDEX IF NOT EXISTS idx_driver_locations_ts ON driver_locations (ts)')
+    
+    # Login looks users up by email; emails must be unique, but an existing
+    # database with duplicates still gets a (non-unique) index
+    cursor.execute('SELECT email FROM users GROUP BY email HAVING COUNT(*) > 1 LIMIT 1')
+    if cursor.fetchone():
+        print("Warning: duplicate emails in users; creating a non-unique email index")
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_users_email ON users (email)')
+    else:
+        cursor.execute('CREATE UNIQUE INDEX IF NOT EXISTS idx_users_email ON users (email)')
+    
+    init_search_index(cursor)
     
     conn.commit()
     conn.close()
 
+# Predicate of the partial unique index, and of INSERT_PACKAGE's conflict target
+CURRENT_TRACKING_ID = f'length(tracking_id) = {TRACKING_ID_LENGTH}'
+
+def create_tracking_index(cursor):
+    """Unique index on packages.tracking_id, replacing the plain one of older databases
+
+    A tracking ID always routes to the same shard, so uniqueness per shard
+    is uniqueness overall. A database already holding duplicates (which can
+    only be older TRK + 8 hex IDs) keeps the plain index, with a warning,
+    and gets a unique index over current-format IDs only: every ID inserted
+    now has that format, and repository.INSERT_PACKAGE names the same
+    predicate so its ON CONFLICT matches either index. Once the duplicates
+    are cleaned up, the next start replaces that partial index with a full one.
+    """
+    if DB_TYPE == 'postgres':
+        cursor.execute("SELECT indexdef FROM pg_indexes WHERE indexname = 'idx_packages_tracking_id_unique'")
+    else:
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type='index' AND name='idx_packages_tracking_id_unique'")
+    row = cursor.fetchone()
+    partial = row is not None and ' WHERE ' in row[0].upper()
+    if row is not None and not partial:
+        return
+    cursor.execute('SELECT tracking_id FROM packages GROUP BY tracking_id HAVING COUNT(*) > 1 LIMIT 1')
+    if cursor.fetchone():
+        if partial:
+            return
+        print("Warning: duplicate tracking IDs in packages; only current-format tracking IDs are kept unique")
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_packages_tracking_id ON packages (tracking_id)')
+        cursor.execute(f'CREATE UNIQUE INDEX idx_packages_tracking_id_unique ON packages (tracking_id) '
+                       f'WHERE {CURRENT_TRACKING_ID}')
+        return
+    if partial:
+        cursor.execute('DROP INDEX idx_packages_tracking_id_unique')
+    cursor.execute('CREATE UNIQUE INDEX idx_packages_tracking_id_unique ON packages (tracking_id)')
+    cursor.execute('DROP INDEX IF EXISTS idx_packages_tracking_id')
+
+def add_columns(cursor, table, columns):
+    """Add (name, type) columns to an existing table unless already present"""
+    if DB_TYPE == 'postgres':
+        for name, kind in columns:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN IF NOT EXISTS {name} {kind}')
+        return
+    cursor.execute(f'PRAGMA table_info({table})')
+    existing = {row[1] for row in cursor.fetchall()}
+    for name, kind in columns:
+        if name not in existing:
+            cursor.execute(f'ALTER TABLE {table} ADD COLUMN {name} {kind}')
+
+def init_search_index(cursor):
+    """Create the recipient/address full-text index and its sync triggers
+
+    SQLite uses an external-content FTS5 table over packages; PostgreSQL
+    keeps a tsvector column with a GIN index. Both are maintained by
+    triggers, so writers do not need to know the index exists.
+    
+    The FTS5 table is keyed by packages.rowid, which SQLite may renumber
+    on VACUUM; run rebuild_search_index() after vacuuming a shard.
+    """
+    if DB_TYPE == 'postgres':
+        cursor.execute('ALTER TABLE packages ADD COLUMN IF NOT EXISTS search_vector tsvector')
+        cursor.execute('''
+            CREATE OR REPLACE FUNCTION packages_search_update() RETURNS trigger AS $$
+            BEGIN
+                NEW.search_vector := to_tsvector('simple', regexp_replace(
+                    coalesce(NEW.recipient_name, '') || ' ' || coalesce(NEW.recipient_email, '') || ' ' ||
+                    coalesce(NEW.recipient_address, '') || ' ' || coalesce(NEW.pickup_address, ''),
+                    '[^[:alnum:]]+', ' ', 'g'));
+                RETURN NEW;
+            END
+            $$ LANGUAGE plpgsql
+        ''')
+        cursor.execute('DROP TRIGGER IF EXISTS packages_search_trigger ON packages')
+        cursor.execute('''
+            CREATE TRIGGER packages_search_trigger
+            BEFORE INSERT OR UPDATE OF recipient_name, recipient_email, recipient_address, pickup_address
+            ON packages FOR EACH ROW EXECUTE FUNCTION packages_search_update()
+        ''')
+        cursor.execute('CREATE INDEX IF NOT EXISTS idx_packages_search ON packages USING GIN (search_vector)')
+        # Backfill rows written before the trigger existed
+        cursor.execute('UPDATE packages SET recipient_name = recipient_name WHERE search_vector IS NULL')
+        return
+    
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='packages_fts'")
+    exists = cursor.fetchone() is not None
+    # prefix indexes keep short prefix queries ("jo*", "d02*") fast on large tables
+    cursor.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS packages_fts USING fts5(
+            recipient_name, recipient_email, recipient_address, pickup_address,
+            content='packages', content_rowid='rowid', prefix='2 3'
+        )
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS packages_fts_insert AFTER INSERT ON packages BEGIN
+            INSERT INTO packages_fts (rowid, recipient_name, recipient_email, recipient_address, pickup_address)
+            VALUES (new.rowid, new.recipient_name, new.recipient_email, new.recipient_address, new.pickup_address);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS packages_fts_delete AFTER DELETE ON packages BEGIN
+            INSERT INTO packages_fts (packages_fts, rowid, recipient_name, recipient_email, recipient_address, pickup_address)
+            VALUES ('delete', old.rowid, old.recipient_name, old.recipient_email, old.recipient_address, old.pickup_address);
+        END
+    ''')
+    cursor.execute('''
+        CREATE TRIGGER IF NOT EXISTS packages_fts_update
+        AFTER UPDATE OF recipient_name, recipient_email, recipient_address, pickup_address ON packages BEGIN
+            INSERT INTO packages_fts (packages_fts, rowid, recipient_name, recipient_email, recipient_address, pickup_address)
+            VALUES ('delete', old.rowid, old.recipient_name, old.recipient_email, old.recipient_address, old.pickup_address);
+            INSERT INTO packages_fts (rowid, recipient_name, recipient_email, recipient_address, pickup_address)
+            VALUES (new.rowid, new.recipient_name, new.recipient_email, new.recipient_address, new.pickup_address);
+        END
+    ''')
+    if not exists:
+        # Index rows written before the FTS table existed
+        cursor.execute("INSERT INTO packages_fts (packages_fts) VALUES ('rebuild')")
+
+def rebuild_search_index(shard=None):
+    """Re-index every package on a SQLite shard (e.g. after VACUUM)"""
+    if DB_TYPE == 'postgres':
+        return
+    conn = get_db_connection(shard)
+    conn.execute("INSERT INTO packages_fts (packages_fts) VALUES ('rebuild')")
+    conn.commit()
+    conn.close()
+
+
+class HashRing:
+    """Consistent-hash ring with virtual nodes
+
+    Adding or removing a node only remaps the keys that land on that
+    node's virtual points, so rebalancing moves roughly 1/N of the rows.
+    """
+    
+    def __init__(self, nodes=(), vnodes=DB_SHARD_VNODES):
+        self.vnodes = vnodes
+        self._points = []
+        self._owners = []
+        for node in nodes:
+            self.add_node(node)
+    
+    @staticmethod
+    def _hash(value):
+        digest = hashlib.md5(value.encode('utf-8')).digest()
+        return int.from_bytes(digest[:8], 'big')
+    
+    def add_node(self, node):
+        for i in range(self.vnodes):
+            point = self._hash(f"{node}#{i}")
+            idx = bisect.bisect(self._points, point)
+            self._points.insert(idx, point)
+            self._owners.insert(idx, node)
+    
+    def remove_node(self, node):
+        keep = [(p, o) for p, o in zip(self._points, self._owners) if o != node]
+        self._points = [p for p, _ in keep]
+        self._owners = [o for _, o in keep]
+    
+    def get_node(self, key):
+        if not self._points:
+            raise ValueError("Hash ring has no nodes")
+        idx = bisect.bisect(self._points, self._hash(key)) % len(self._points)
+        return self._owners[idx]
+
+
+class ShardRouter:
+    """Routes package rows to shards by tracking_id
+
+    The tracking ID is the shard key: a package and its deliveries live on
+    the shard that owns its tracking_id on the ring. Lookups by package id
+    probe every shard in parallel on the primary key and stop at the owner.
+    Users are not sharded and live on the first shard.
+    """
+    
+    def __init__(self, shards=None, vnodes=DB_SHARD_VNODES):
+        # None stands for the default single-node database
+        self.shards = list(shards) if shards else [None]
+        self.ring = HashRing(self.shards, vnodes) if len(self.shards) > 1 else None
+        self._pool = ThreadPoolExecutor(max_workers=len(self.shards)) if self.ring else None
+    
+    @property
+    def is_sharded(self):
+        return self.ring is not None
+    
+    @property
+    def home_shard(self):
+        """Shard holding unsharded tables (users)"""
+        return self.shards[0]
+    
+    def shard_for(self, tracking_id):
+        if not self.ring:
+            return self.shards[0]
+        return self.ring.get_node(tracking_id)
+    
+    def connect(self, shard):
+        return get_db_connection(shard)
+    
+    def connection_for(self, tracking_id):
+        """Connection to the shard owning tracking_id"""
+        return self.connect(self.shard_for(tracking_id))
+    
+    def _map(self, fn):
+        """Run fn(shard) on every shard, in parallel when sharded"""
+        if not self._pool:
+            return [fn(self.shards[0])]
+        return list(self._pool.map(fn, self.shards))
+    
+    def scatter(self, query, params=None):
+        """Run a read query on every shard, returning one list of rows per shard
+
+        query is SQL text, giving dicts, or a repository.Query, giving its records.
+        """
+        def run(shard):
+            conn = self.connect(shard)
+            try:
+                if isinstance(query, str):
+                    return rows_to_dicts(execute_query(conn, query, params))
+                return query.all(conn, params or ())
+            finally:
+                conn.close()
+        return self._map(run)
+    
+    def gather(self, query, params=None, order_by='created_at', descending=True, limit=None):
+        """Scatter a query and merge the per-shard results by order_by
+
+        Each shard's query must already be sorted by order_by in the same
+        direction (and limited, if limit is given) so the merge is a
+        streaming k-way merge rather than a full re-sort.
+        """
+        return merge_sorted(self.scatter(query, params), order_by, descending, limit)
+    
+    def locate_package(self, package_id):
+        """Return the shard holding package_id, or None if it does not exist"""
+        if not self.ring:
+            return self.shards[0]
+        def probe(shard):
+            conn = self.connect(shard)
+            try:
+                cursor = execute_query(conn, 'SELECT 1 FROM packages WHERE id=?', (package_id,))
+                return shard if cursor.fetchone() else None
+            finally:
+                conn.close()
+        for shard in self._map(probe):
+            if shard is not None:
+                return shard
+        return None
+
+
+def _sort_key(row, column):
+    # NULLs sort below every value instead of failing to compare
+    value = row.get(column) if isinstance(row, dict) else getattr(row, column)
+    return (value is not None, value)
+
+def merge_sorted(results, order_by='created_at', descending=True, limit=None):
+    """Merge per-shard row lists, each already sorted by order_by (a column or a tuple of them)"""
+    if len(results) == 1:
+        merged = results[0]
+    else:
+        columns = order_by if isinstance(order_by, tuple) else (order_by,)
+        merged = heapq.merge(*results, key=lambda row: tuple(_sort_key(row, c) for c in columns),
+                             reverse=descending)
+    if limit is not None:
+        return [row for row, _ in zip(merged, range(limit))]
+    return list(merged)
+
+def rebalance_shards(old_shards, new_shards, dry_run=False, batch_size=500):
+    """Move packages (and their deliveries) whose owner changed between rings
+
+    Returns a dict of {(source, target): moved_count}. Every shard in
+    new_shards must already have its schema (see init_shard).
+    """
+    old_router = ShardRouter(old_shards)
+    new_router = ShardRouter(new_shards)
+    moves = {}
+    for source in old_router.shards:
+        src = get_db_connection(source)
+        cursor = execute_query(src, 'SELECT * FROM packages')
+        columns = [col[0] for col in cursor.description]
+        pending = {}
+        for row in cursor:
+            package = dict(zip(columns, row))
+            target = new_router.shard_for(package['tracking_id'])
+            if target != source:
+                pending.setdefault(target, []).append(package)
+        
+        for target, packages in pending.items():
+            moves[(source, target)] = len(packages)
+            if dry_run:
+                continue
+            dst = get_db_connection(target)
+            try:
+                for start in range(0, len(packages), batch_size):
+                    _move_packages(src, dst, columns, packages[start:start + batch_size])
+            finally:
+                dst.close()
+        src.close()
+    return moves
+
+def _move_packages(src, dst, columns, packages):
+    """Copy one batch of packages plus deliveries to dst, then delete from src"""
+    ids = [p['id'] for p in packages]
+    marks = ', '.join('?' for _ in ids)
+    cursor = execute_query(src, f'SELECT * FROM deliveries WHERE package_id IN ({marks})', ids)
+    deliveries = cursor.fetchall()
+    
+    # Clear leftovers from an interrupted earlier run so the copy is idempotent
+    execute_query(dst, f'DELETE FROM deliveries WHERE package_id IN ({marks})', ids)
+    execute_query(dst, f'DELETE FROM packages WHERE id IN ({marks})', ids)
+    insert = f"INSERT INTO packages ({', '.join(columns)}) VALUES ({', '.join('?' for _ in columns)})"
+    for package in packages:
+        execute_query(dst, insert, [package[c] for c in columns])
+    for delivery in deliveries:
+        execute_query(dst, f"INSERT INTO deliveries VALUES ({', '.join('?' for _ in delivery)})", tuple(delivery))
+    # Commit on the target first: a crash in between leaves a duplicate
+    # (safe to re-run) instead of a lost row
+    dst.commit()
+    
+    execute_query(src, f'DELETE FROM deliveries WHERE package_id IN ({marks})', ids)
+    execute_query(src, f'DELETE FROM packages WHERE id IN ({marks})', ids)
+    src.commit()
+
+
+# Process-wide router built from DB_SHARDS
+router = ShardRouter(DB_SHARDS)
+
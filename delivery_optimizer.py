@@ -1,5 +1,7 @@
 """Minimal delivery optimizer library - all in one file"""
 import math
+from metrics import timed
+import road_network
 
 class Location:
     def __init__(self, lat, lon, address=""):
@@ -9,7 +11,22 @@ class Location:
 
 class DistanceCalculator:
     @staticmethod
+    @timed('distance')
     def calculate(loc1, loc2):
+        """Driving distance in km over the road graph, straight-line without one"""
+        km = road_network.distance_km((loc1.lat, loc1.lon), (loc2.lat, loc2.lon))
+        return round(km, 2) if km is not None else DistanceCalculator.haversine(loc1, loc2)
+    
+    @staticmethod
+    @timed('distance')
+    def calculate_many(origin, destinations):
+        """Driving distances in km from one location to several"""
+        kms = road_network.distances_km((origin.lat, origin.lon), [(d.lat, d.lon) for d in destinations])
+        return [round(km, 2) if km is not None else DistanceCalculator.haversine(origin, d)
+                for km, d in zip(kms, destinations)]
+    
+    @staticmethod
+    def haversine(loc1, loc2):
         """Haversine distance in km"""
         R = 6371
         lat1, lon1 = math.radians(loc1.lat), math.radians(loc1.lon)
@@ -25,6 +42,7 @@ class PricingEngine:
         self.base_price = base_price
         self.price_per_km = price_per_km
     
+    @timed('pricing')
     def calculate(self, distance_km, weight_kg=1.0):
         price = self.base_price + (distance_km * self.price_per_km)
         price += weight_kg * 0.5  # weight multiplier
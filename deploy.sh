@@ -53,28 +53,24 @@ python3 -c "from db_config import init_db; init_db(); print('Database initialize
 echo "✓ Database initialized"
 echo ""
 
-# Check if app is already running
+# Build minified, precompressed UI assets
+echo "Building static assets..."
+python3 build_assets.py
+echo "✓ Static assets built"
+echo ""
+
+# Stop a development server started by older versions of this script
 if pgrep -f "python3 app.py" > /dev/null; then
-    echo "Stopping existing application..."
+    echo "Stopping development server..."
     pkill -f "python3 app.py"
     sleep 2
 fi
 
-# Start application
+# Start the production server, or reload it without dropping requests
 echo "Starting application..."
-nohup python3 app.py > app.log 2>&1 &
-APP_PID=$!
-
-# Wait a moment and check if it started
-sleep 3
-if ps -p $APP_PID > /dev/null; then
-    echo "✓ Application started (PID: $APP_PID)"
-    echo "✓ Application running on http://localhost:5000"
-    echo "✓ Logs: app.log"
-else
-    echo "✗ Application failed to start. Check app.log for errors."
-    exit 1
-fi
+./serve.sh reload
+echo "✓ Application running on http://localhost:5000"
+echo "✓ Logs: app.log"
 
 echo ""
 echo "=== Deployment Complete ==="
@@ -0,0 +1,216 @@
+"""Group pending packages into dispatch waves: one van load each
+
+Packages are clustered on their pickup and delivery points together, so a
+wave shares both a collection area and a drop-off area. The clustering is
+k-means with capacity limits: start with enough clusters for the total
+weight and stop count, then alternate
+
+    assignment   each package joins the nearest of its DISPATCH_CANDIDATES
+                 closest centroids that still has room, taking packages with
+                 the most to lose (nearest vs. second nearest) first;
+    update       centroids move to the mean of their packages;
+
+until assignments settle. Each iteration only measures the centroids
+around a package's previous wave, so 50,000 packages plan in a few
+seconds.
+"""
+import math
+import os
+import numpy as np
+from db_config import router
+from geofence import project, METERS_PER_DEG_LAT, METERS_PER_DEG_LON
+
+DISPATCH_MAX_WEIGHT_KG = float(os.getenv('DISPATCH_MAX_WEIGHT_KG', '500'))
+DISPATCH_MAX_STOPS = int(os.getenv('DISPATCH_MAX_STOPS', '40'))
+DISPATCH_ITERATIONS = int(os.getenv('DISPATCH_ITERATIONS', '10'))
+# Packages created before weights were stored
+DISPATCH_DEFAULT_WEIGHT_KG = float(os.getenv('DISPATCH_DEFAULT_WEIGHT_KG', '1.0'))
+
+# Clusters are sized to fill vans to this fraction, leaving room to move
+# packages between neighbouring waves
+TARGET_FILL = 0.9
+DISPATCH_CANDIDATES = 8
+BLOCK_ROWS = 4096
+
+PENDING_QUERY = '''
+    SELECT id, tracking_id, weight_kg, pickup_lat, pickup_lon, delivery_lat, delivery_lon
+    FROM packages WHERE status = 'pending'
+'''
+
+
+def features(pickup_lat, pickup_lon, delivery_lat, delivery_lon):
+    """(n, 4) float32 kilometres: pickup x, y then delivery x, y"""
+    px, py = project(pickup_lat, pickup_lon)
+    dx, dy = project(delivery_lat, delivery_lon)
+    return (np.column_stack([px, py, dx, dy]) / 1000).astype(np.float32)
+
+def to_lat_lon(x, y):
+    return float(y * 1000 / METERS_PER_DEG_LAT), float(x * 1000 / METERS_PER_DEG_LON)
+
+def closest(points, centroids, count):
+    """Indices of each point's `count` nearest centroids (unordered), by blocks of rows"""
+    count = min(count, len(centroids))
+    c_norm = (centroids ** 2).sum(axis=1)
+    idx = np.empty((len(points), count), np.int64)
+    for start in range(0, len(points), BLOCK_ROWS):
+        block = points[start:start + BLOCK_ROWS]
+        # |p|^2 is the same for every centroid, so it does not change the order
+        d = c_norm[None, :] - 2 * block @ centroids.T
+        if count == 1:
+            idx[start:start + len(block), 0] = d.argmin(axis=1)
+        elif count < len(centroids):
+            idx[start:start + len(block)] = np.argpartition(d, count - 1, axis=1)[:, :count]
+        else:
+            idx[start:start + len(block)] = np.arange(count)
+    return idx
+
+def candidates(points, centroids, labels):
+    """Each point's likely nearest centroids and squared distances, closest first
+    
+    Only the DISPATCH_CANDIDATES centroids around the point's previous one
+    are measured (points without one are placed first), which avoids a full
+    points x centroids search every iteration.
+    """
+    home = labels.copy()
+    unplaced = home < 0
+    if unplaced.any():
+        home[unplaced] = closest(points[unplaced], centroids, 1)[:, 0]
+    neighbours = closest(centroids, centroids, DISPATCH_CANDIDATES)
+    idx = neighbours[home]
+    dist = ((centroids[idx] - points[:, None, :]) ** 2).sum(axis=2)
+    order = np.argsort(dist, axis=1)
+    return np.take_along_axis(idx, order, axis=1), np.take_along_axis(dist, order, axis=1)
+
+def seed_centroids(points, weights, k, rng):
+    """Start from k distinct packages, heavier ones more likely"""
+    return points[rng.choice(len(points), k, replace=False, p=weights / weights.sum())].copy()
+
+def assign(points, weights, centroids, labels, max_weight, max_stops, grow):
+    """Capacity-limited assignment; returns labels (-1: no room) and the centroids (grown if allowed)"""
+    idx, dist = candidates(points, centroids, labels)
+    regret = dist[:, 1] - dist[:, 0] if idx.shape[1] > 1 else np.zeros(len(points))
+    labels = np.full(len(points), -1, np.int64)
+    # Plain lists: this loop runs once per package
+    load = [0.0] * len(centroids)
+    stops = [0] * len(centroids)
+    choices = idx.tolist()
+    package_weights = weights.tolist()
+    leftover = []
+    for i in np.argsort(-regret, kind='stable').tolist():
+        w = package_weights[i]
+        for c in choices[i]:
+            if stops[c] < max_stops and load[c] + w <= max_weight:
+                labels[i] = c
+                load[c] += w
+                stops[c] += 1
+                break
+        else:
+            leftover.append(i)
+    load, stops = np.array(load), np.array(stops)
+    
+    # Rare: every nearby wave is full. Take the nearest one with room, or
+    # open a new wave at the package
+    for i in leftover:
+        room = (stops < max_stops) & (load + weights[i] <= max_weight)
+        if room.any():
+            d = ((centroids - points[i]) ** 2).sum(axis=1)
+            d[~room] = np.inf
+            c = int(np.argmin(d))
+        elif grow:
+            centroids = np.vstack([centroids, points[i]])
+            load = np.append(load, 0.0)
+            stops = np.append(stops, 0)
+            c = len(centroids) - 1
+        else:
+            continue
+        labels[i] = c
+        load[c] += weights[i]
+        stops[c] += 1
+    return labels, centroids
+
+def update_centroids(points, labels, centroids):
+    assigned = labels >= 0
+    counts = np.bincount(labels[assigned], minlength=len(centroids))
+    sums = np.column_stack([np.bincount(labels[assigned], weights=points[assigned, j], minlength=len(centroids))
+                            for j in range(points.shape[1])])
+    moved = centroids.copy()
+    filled = counts > 0
+    moved[filled] = (sums[filled] / counts[filled, None]).astype(np.float32)
+    return moved
+
+def cluster(points, weights, max_weight=DISPATCH_MAX_WEIGHT_KG, max_stops=DISPATCH_MAX_STOPS,
+            max_waves=None, iterations=DISPATCH_ITERATIONS, seed=0):
+    """Capacity-limited k-means over (n, d) points; returns (labels, centroids), label -1 if unplanned"""
+    if not len(points):
+        return np.zeros(0, np.int64), np.zeros((0, points.shape[1]), np.float32)
+    k = max(math.ceil(weights.sum() / (max_weight * TARGET_FILL)), math.ceil(len(points) / (max_stops * TARGET_FILL)))
+    k = min(k, len(points), max_waves or k)
+    rng = np.random.default_rng(seed)
+    centroids = seed_centroids(points, weights, k, rng)
+    labels = np.full(len(points), -1, np.int64)
+    for _ in range(max(1, iterations)):
+        previous = labels
+        labels, centroids = assign(points, weights, centroids, labels, max_weight, max_stops,
+                                   grow=max_waves is None)
+        if (previous == labels).all():
+            break
+        centroids = update_centroids(points, labels, centroids)
+    
+    # Drop waves that ended up empty and number the rest from 0
+    used = np.unique(labels[labels >= 0])
+    remap = np.full(len(centroids), -1, np.int64)
+    remap[used] = np.arange(len(used))
+    return np.where(labels >= 0, remap[np.maximum(labels, 0)], -1), centroids[used]
+
+
+def valid_weight(value):
+    """True for a usable weight_kg: a positive, finite number"""
+    return isinstance(value, (int, float)) and not isinstance(value, bool) and 0 < value < math.inf
+
+def plan_waves(packages, max_weight=DISPATCH_MAX_WEIGHT_KG, max_stops=DISPATCH_MAX_STOPS, max_waves=None,
+               iterations=DISPATCH_ITERATIONS):
+    """Waves for package dicts (see PENDING_QUERY): (waves, unassigned)"""
+    unassigned = []
+    plannable = []
+    package_weights = []
+    for p in packages:
+        weight = DISPATCH_DEFAULT_WEIGHT_KG if p['weight_kg'] is None else p['weight_kg']
+        if None in (p['pickup_lat'], p['pickup_lon'], p['delivery_lat'], p['delivery_lon']):
+            unassigned.append({'tracking_id': p['tracking_id'], 'reason': 'no_coordinates'})
+        elif not valid_weight(weight):
+            # Rows written before weights were validated
+            unassigned.append({'tracking_id': p['tracking_id'], 'reason': 'invalid_weight'})
+        elif weight > max_weight:
+            unassigned.append({'tracking_id': p['tracking_id'], 'reason': 'overweight'})
+        else:
+            plannable.append(p)
+            package_weights.append(weight)
+    
+    points = features([p['pickup_lat'] for p in plannable], [p['pickup_lon'] for p in plannable],
+                      [p['delivery_lat'] for p in plannable], [p['delivery_lon'] for p in plannable])
+    weights = np.array(package_weights, np.float64)
+    labels, centroids = cluster(points, weights, max_weight, max_stops, max_waves, iterations)
+    
+    order = np.argsort(labels, kind='stable')
+    bounds = np.searchsorted(labels[order], np.arange(len(centroids) + 1))
+    waves = []
+    for wave, centroid in enumerate(centroids):
+        members = order[bounds[wave]:bounds[wave + 1]]
+        spread = np.sqrt(((points[members] - centroid) ** 2).sum(axis=1))
+        pickup_lat, pickup_lon = to_lat_lon(*centroid[:2])
+        delivery_lat, delivery_lon = to_lat_lon(*centroid[2:])
+        waves.append({
+            'wave': wave,
+            'stops': len(members),
+            'weight_kg': round(float(weights[members].sum()), 2),
+            'pickup_centroid': {'lat': round(pickup_lat, 6), 'lon': round(pickup_lon, 6)},
+            'delivery_centroid': {'lat': round(delivery_lat, 6), 'lon': round(delivery_lon, 6)},
+            'mean_distance_km': round(float(spread.mean()), 3),
+            'tracking_ids': [plannable[i]['tracking_id'] for i in members.tolist()],
+        })
+    unassigned += [{'tracking_id': plannable[i]['tracking_id'], 'reason': 'no_capacity'}
+                   for i in np.flatnonzero(labels < 0).tolist()]
+    return waves, unassigned
+
+def pending_packages():
+    return [row for rows in router.scatter(PENDING_QUERY) for row in rows]
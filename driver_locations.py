@@ -0,0 +1,286 @@
+"""Driver GPS ping ingestion through in-memory ring buffers
+
+Pings arrive in batches and are written into preallocated NumPy arrays, one
+row per driver holding its last DRIVER_RING_SIZE pings (timestamp, lat,
+lon); no per-ping objects are kept. A background thread flushes new pings
+every DRIVER_FLUSH_SECONDS with one bulk insert into driver_locations, and
+upserts each driver's latest fix into driver_positions so every worker can
+answer "where is everyone" from one small table.
+
+Memory is bounded by DRIVER_MAX_TRACKED x DRIVER_RING_SIZE pings. If the
+database falls so far behind that a driver's ring wraps before it is
+flushed, the oldest unflushed pings are dropped (and counted) rather than
+growing without limit.
+"""
+import os
+import threading
+import time
+import numpy as np
+from db_config import DB_TYPE, router, execute_query, rows_to_dicts
+import metrics
+
+DRIVER_RING_SIZE = int(os.getenv('DRIVER_RING_SIZE', '64'))
+DRIVER_MAX_TRACKED = int(os.getenv('DRIVER_MAX_TRACKED', '50000'))
+DRIVER_FLUSH_SECONDS = float(os.getenv('DRIVER_FLUSH_SECONDS', '1'))
+DRIVER_MAX_BATCH = int(os.getenv('DRIVER_MAX_BATCH', '1000'))
+# Ping history kept in driver_locations; 0 keeps everything
+DRIVER_LOCATION_RETENTION_HOURS = int(os.getenv('DRIVER_LOCATION_RETENTION_HOURS', '72'))
+
+# Accepted ping timestamps, relative to the server clock
+MAX_PING_AGE_SECONDS = 86400
+MAX_PING_SKEW_SECONDS = 300
+PRUNE_EVERY_FLUSHES = 600
+
+
+class BufferFull(Exception):
+    """Every slot holds a driver with pings not yet flushed"""
+
+
+def parse_pings(payload):
+    """Validate a request body into an (n, 3) array of ts, lat, lon
+    
+    Accepts {"pings": [[ts, lat, lon], ...]} or, more verbosely,
+    {"pings": [{"lat": .., "lon": .., "ts": ..}, ...]} where ts (epoch
+    seconds) defaults to now. Returns (pings, rejected) where rejected
+    counts pings dropped for bad coordinates or timestamps.
+    """
+    pings = payload.get('pings') if isinstance(payload, dict) else None
+    if not isinstance(pings, list) or not pings:
+        raise ValueError('pings must be a non-empty list')
+    if len(pings) > DRIVER_MAX_BATCH:
+        raise ValueError(f'At most {DRIVER_MAX_BATCH} pings per request')
+    now = time.time()
+    try:
+        if isinstance(pings[0], dict):
+            pings = [(p.get('ts', now), p['lat'], p['lon']) for p in pings]
+        values = np.array(pings, dtype=np.float64)
+    except (TypeError, ValueError, KeyError, AttributeError):
+        raise ValueError('Each ping must be [ts, lat, lon] or {"ts", "lat", "lon"}')
+    if values.ndim != 2 or values.shape[1] != 3:
+        raise ValueError('Each ping must be [ts, lat, lon] or {"ts", "lat", "lon"}')
+    ts, lat, lon = values.T
+    with np.errstate(invalid='ignore'):
+        valid = ((np.abs(lat) <= 90) & (np.abs(lon) <= 180) &
+                 (ts >= now - MAX_PING_AGE_SECONDS) & (ts <= now + MAX_PING_SKEW_SECONDS))
+    return values[valid], int(len(values) - valid.sum())
+
+
+class LocationBuffer:
+    """Per-driver ring buffers of recent pings in preallocated 2-D arrays
+    
+    Row r of ts/lat/lon belongs to one driver; written[r] counts every ping
+    ever written to the row and flushed[r] how many reached the database,
+    so the unflushed pings are the ring positions between the two.
+    """
+    
+    def __init__(self, ring_size=DRIVER_RING_SIZE, max_drivers=DRIVER_MAX_TRACKED, capacity=1024):
+        self.ring_size = ring_size
+        self.max_drivers = max_drivers
+        self.slots = {}
+        self.drivers = []
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._allocate(min(capacity, max_drivers))
+    
+    def _allocate(self, capacity):
+        old = getattr(self, 'ts', None)
+        count = len(self.drivers)
+        shapes = {
+            'ts': ((capacity, self.ring_size), np.float64),
+            'lat': ((capacity, self.ring_size), np.float64),
+            'lon': ((capacity, self.ring_size), np.float64),
+            'written': (capacity, np.int64),
+            'flushed': (capacity, np.int64),
+            'seen_at': (capacity, np.float64),
+            # Latest fix by ping timestamp, and whether it still needs upserting
+            'last_ts': (capacity, np.float64),
+            'last_lat': (capacity, np.float64),
+            'last_lon': (capacity, np.float64),
+            'moved': (capacity, np.bool_),
+        }
+        for name, (shape, dtype) in shapes.items():
+            grown = np.zeros(shape, dtype)
+            if old is not None:
+                grown[:count] = getattr(self, name)[:count]
+            setattr(self, name, grown)
+        self.capacity = capacity
+    
+    def _slot(self, driver_id):
+        row = self.slots.get(driver_id)
+        if row is not None:
+            return row
+        if len(self.drivers) == self.capacity and self.capacity < self.max_drivers:
+            self._allocate(min(self.capacity * 2, self.max_drivers))
+        if len(self.drivers) < self.capacity:
+            row = len(self.drivers)
+            self.drivers.append(driver_id)
+        else:
+            # Reuse the longest-idle row whose pings are all in the database
+            idle = np.flatnonzero((self.written == self.flushed) & ~self.moved)
+            if not len(idle):
+                raise BufferFull()
+            row = int(idle[np.argmin(self.seen_at[idle])])
+            del self.slots[self.drivers[row]]
+            self.drivers[row] = driver_id
+            self.written[row] = self.flushed[row] = 0
+            self.last_ts[row] = 0
+        self.slots[driver_id] = row
+        return row
+    
+    def add(self, driver_id, pings):
+        """Append an (n, 3) array of ts, lat, lon pings for one driver"""
+        count = len(pings)
+        if not count:
+            return
+        keep = pings[-self.ring_size:]
+        latest = int(np.argmax(pings[:, 0]))
+        now = time.time()
+        with self._lock:
+            row = self._slot(driver_id)
+            start = self.written[row] + count - len(keep)
+            cols = (start + np.arange(len(keep))) % self.ring_size
+            self.ts[row, cols] = keep[:, 0]
+            self.lat[row, cols] = keep[:, 1]
+            self.lon[row, cols] = keep[:, 2]
+            self.written[row] += count
+            self.seen_at[row] = now
+            lag = self.written[row] - self.flushed[row]
+            if lag > self.ring_size:
+                self.dropped += int(lag - self.ring_size)
+                self.flushed[row] = self.written[row] - self.ring_size
+            if pings[latest, 0] > self.last_ts[row]:
+                self.last_ts[row], self.last_lat[row], self.last_lon[row] = pings[latest]
+                self.moved[row] = True
+    
+    def unflushed(self):
+        """Copy out pings not yet in the database, plus changed latest fixes
+        
+        Returns (pings, positions, marker); pass marker to mark_flushed()
+        once they are stored.
+        """
+        with self._lock:
+            n = len(self.drivers)
+            rows = np.flatnonzero(self.written[:n] > self.flushed[:n])
+            counts = self.written[rows] - self.flushed[rows]
+            # Ring positions flushed[r] .. written[r]-1 of every row, as flat index arrays
+            row_idx = np.repeat(rows, counts)
+            offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+            col_idx = (np.repeat(self.flushed[rows], counts) + offsets) % self.ring_size
+            drivers = [self.drivers[r] for r in rows]
+            pings = (np.repeat(np.array(drivers, dtype=object), counts),
+                     self.ts[row_idx, col_idx], self.lat[row_idx, col_idx], self.lon[row_idx, col_idx])
+            moved = np.flatnonzero(self.moved[:n])
+            positions = [(self.drivers[r], float(self.last_ts[r]), float(self.last_lat[r]), float(self.last_lon[r]))
+                         for r in moved.tolist()]
+            self.moved[moved] = False
+            marker = (rows, self.written[rows].copy(), moved)
+        return pings, positions, marker
+    
+    def mark_flushed(self, marker):
+        rows, written, _ = marker
+        with self._lock:
+            self.flushed[rows] = np.maximum(self.flushed[rows], written)
+    
+    def unmark(self, marker):
+        """A flush failed: upsert those drivers' latest fixes next time"""
+        with self._lock:
+            self.moved[marker[2]] = True
+    
+    def positions(self):
+        """Latest fix of every driver seen by this process: {driver_id: (ts, lat, lon)}"""
+        with self._lock:
+            n = len(self.drivers)
+            return {driver: (ts, lat, lon) for driver, ts, lat, lon in
+                    zip(self.drivers, self.last_ts[:n].tolist(), self.last_lat[:n].tolist(),
+                        self.last_lon[:n].tolist()) if ts > 0}
+
+
+buffer = LocationBuffer()
+
+metrics.callback('driver_location_drivers', 'Drivers with a ring buffer in this process', lambda: len(buffer.drivers))
+metrics.callback('driver_location_unflushed', 'Pings buffered but not yet written to the database',
+                 lambda: int((buffer.written - buffer.flushed).sum()))
+metrics.callback('driver_location_dropped', 'Pings lost because a ring wrapped before it was flushed',
+                 lambda: buffer.dropped, kind='counter')
+
+
+# --- Flushing ---------------------------------------------------------------
+
+def _bulk_insert(conn, query, rows):
+    if DB_TYPE == 'postgres':
+        from psycopg2.extras import execute_values
+        execute_values(conn.cursor(), query.replace('(?, ?, ?, ?)', '%s'), rows, page_size=1000)
+    else:
+        conn.executemany(query, rows)
+
+_flushes = 0
+
+def flush():
+    """Write pending pings and latest fixes to the home shard; returns pings written"""
+    global _flushes
+    pings, positions, marker = buffer.unflushed()
+    if not len(pings[0]) and not positions:
+        return 0
+    conn = router.connect(router.home_shard)
+    try:
+        _bulk_insert(conn, 'INSERT INTO driver_locations (driver_id, ts, lat, lon) VALUES (?, ?, ?, ?)',
+                     list(zip(pings[0].tolist(), pings[1].tolist(), pings[2].tolist(), pings[3].tolist())))
+        _bulk_insert(conn, '''
+            INSERT INTO driver_positions (driver_id, ts, lat, lon) VALUES (?, ?, ?, ?)
+            ON CONFLICT (driver_id) DO UPDATE SET ts = excluded.ts, lat = excluded.lat, lon = excluded.lon
+            WHERE excluded.ts > driver_positions.ts
+        ''', positions)
+        _flushes += 1
+        if DRIVER_LOCATION_RETENTION_HOURS and _flushes % PRUNE_EVERY_FLUSHES == 0:
+            execute_query(conn, 'DELETE FROM driver_locations WHERE ts < ?',
+                          (time.time() - DRIVER_LOCATION_RETENTION_HOURS * 3600,))
+        conn.commit()
+    except Exception as e:
+        # The pings stay in the ring and are retried on the next flush
+        print(f"Driver location flush failed: {e}")
+        buffer.unmark(marker)
+        return 0
+    finally:
+        conn.close()
+    buffer.mark_flushed(marker)
+    return len(pings[0])
+
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+def _flush_loop():
+    while True:
+        time.sleep(DRIVER_FLUSH_SECONDS)
+        flush()
+
+def _ensure_flusher():
+    """Start the flush thread in this process (threads do not survive fork)"""
+    global _flusher_pid
+    if _flusher_pid == os.getpid():
+        return
+    with _flusher_lock:
+        if _flusher_pid != os.getpid():
+            threading.Thread(target=_flush_loop, name='driver-location-flush', daemon=True).start()
+            _flusher_pid = os.getpid()
+
+
+# --- API helpers ------------------------------------------------------------
+
+def record(driver_id, pings):
+    _ensure_flusher()
+    buffer.add(driver_id, pings)
+
+def latest_positions(max_age=None):
+    """Latest position of every driver: the shared table, overlaid with newer local fixes"""
+    conn = router.connect(router.home_shard)
+    try:
+        rows = rows_to_dicts(execute_query(conn, 'SELECT driver_id, ts, lat, lon FROM driver_positions'))
+    finally:
+        conn.close()
+    positions = {row['driver_id']: (row['ts'], row['lat'], row['lon']) for row in rows}
+    for driver, fix in buffer.positions().items():
+        if driver not in positions or fix[0] > positions[driver][0]:
+            positions[driver] = fix
+    cutoff = time.time() - max_age if max_age else None
+    return [{'driver_id': driver, 'ts': ts, 'lat': lat, 'lon': lon}
+            for driver, (ts, lat, lon) in positions.items() if cutoff is None or ts >= cutoff]
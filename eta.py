@@ -0,0 +1,264 @@
+"""Delivery ETA prediction from zone-to-zone travel-time tables
+
+Travel times are learned from completed deliveries: the 'accepted' and
+'delivered' events in the deliveries table give how long each package took
+from dispatch to the door. train() aggregates them into NumPy tables indexed
+by zone (geocoder.address_zone) and hour of week (Monday 00:00 = 0):
+
+    travel[pickup_zone, recipient_zone, hour]   seconds, accepted -> delivered
+    wait[pickup_zone, hour]                     seconds, created -> accepted
+
+Cells are geometric means of at least ETA_MIN_SAMPLES deliveries; sparser
+cells fall back to the zone pair (or pickup zone) over all hours, then to a
+linear fit on distance. An estimate is a handful of array lookups.
+
+Tables are saved to ETA_MODEL_PATH and the server reloads them when the
+file changes (checked every ETA_RELOAD_SECONDS), so retraining with
+train_eta.py needs no restart.
+"""
+import os
+import threading
+import time
+import numpy as np
+from datetime import datetime, timedelta
+from db_config import router, execute_query, rows_to_dicts
+from geocoder import address_zone
+
+ETA_MODEL_PATH = os.getenv('ETA_MODEL_PATH', 'eta_model.npz')
+ETA_RELOAD_SECONDS = int(os.getenv('ETA_RELOAD_SECONDS', '60'))
+ETA_MIN_SAMPLES = int(os.getenv('ETA_MIN_SAMPLES', '5'))
+ETA_TRAINING_DAYS = int(os.getenv('ETA_TRAINING_DAYS', '90'))
+# A late package is never given an ETA closer than this
+ETA_MIN_REMAINING_SECONDS = 600
+ETA_BATCH_LIMIT = 1000
+
+HOURS_PER_WEEK = 168
+TERMINAL_STATUSES = ('delivered', 'cancelled')
+# Used until a model has been trained: 30 min handling plus 30 km/h, and
+# one hour for a driver to accept
+DEFAULT_BASE_SECONDS = 1800.0
+DEFAULT_SECONDS_PER_KM = 120.0
+DEFAULT_WAIT_SECONDS = 3600.0
+
+HISTORY_QUERY = '''
+    SELECT p.pickup_address, p.recipient_address, p.distance, p.created_at,
+           MIN(CASE WHEN d.status = 'accepted' THEN d.created_at END) AS accepted_at,
+           MAX(CASE WHEN d.status = 'delivered' THEN d.created_at END) AS delivered_at
+    FROM packages p JOIN deliveries d ON d.package_id = p.id
+    WHERE p.status = 'delivered' AND p.created_at >= ?
+    GROUP BY p.id, p.pickup_address, p.recipient_address, p.distance, p.created_at
+'''
+
+# Dispatch time of a package, as an extra column of a packages query
+ACCEPTED_AT = '''(SELECT MIN(d.created_at) FROM deliveries d
+                  WHERE d.package_id = packages.id AND d.status = 'accepted') AS accepted_at'''
+
+
+def to_epoch(values):
+    """Naive ISO timestamps (like created_at) to epoch seconds; NaN for None"""
+    stamps = np.array(values, dtype='datetime64[s]')
+    seconds = stamps.astype(np.int64).astype(np.float64)
+    seconds[np.isnat(stamps)] = np.nan
+    return seconds
+
+def hour_of_week(seconds):
+    # The epoch, 1970-01-01, was a Thursday: hour 72 of its week
+    return (np.asarray(seconds, dtype=np.int64) // 3600 + 72) % HOURS_PER_WEEK
+
+def _now():
+    """Current time on the same naive-local scale as the stored timestamps"""
+    return float(np.datetime64(datetime.now(), 's').astype(np.int64))
+
+def _log_means(keys, seconds, size, min_samples):
+    """Geometric mean of seconds per key; NaN where there are too few samples"""
+    counts = np.bincount(keys, minlength=size)
+    sums = np.bincount(keys, weights=np.log(seconds), minlength=size)
+    means = np.full(size, np.nan)
+    enough = counts >= min_samples
+    means[enough] = np.exp(sums[enough] / counts[enough])
+    return means
+
+
+class ETAModel:
+    """Zone/hour travel and wait tables plus the distance fallback"""
+    
+    def __init__(self, zones, travel, wait, base=DEFAULT_BASE_SECONDS,
+                 per_km=DEFAULT_SECONDS_PER_KM, default_wait=DEFAULT_WAIT_SECONDS):
+        self.zones = list(zones)
+        self.codes = {zone: i for i, zone in enumerate(self.zones)}
+        self.travel = travel
+        self.wait = wait
+        self.base = float(base)
+        self.per_km = float(per_km)
+        self.default_wait = float(default_wait)
+    
+    @classmethod
+    def untrained(cls):
+        return cls([], np.zeros((0, 0, HOURS_PER_WEEK), np.float32), np.zeros((0, HOURS_PER_WEEK), np.float32))
+    
+    @classmethod
+    def train(cls, history, min_samples=ETA_MIN_SAMPLES):
+        """Build the tables from history rows (see HISTORY_QUERY)"""
+        if not history:
+            return cls.untrained()
+        zones = sorted({address_zone(h['pickup_address']) for h in history} |
+                       {address_zone(h['recipient_address']) for h in history})
+        codes = {zone: i for i, zone in enumerate(zones)}
+        n = len(zones)
+        
+        origin = np.array([codes[address_zone(h['pickup_address'])] for h in history], np.int64)
+        dest = np.array([codes[address_zone(h['recipient_address'])] for h in history], np.int64)
+        distance = np.array([h['distance'] or 0.0 for h in history], np.float64)
+        created = to_epoch([h['created_at'] for h in history])
+        accepted = to_epoch([h['accepted_at'] for h in history])
+        delivered = to_epoch([h['delivered_at'] for h in history])
+        
+        # Dispatch -> delivery, by zone pair and the hour dispatch happened
+        ok = ~np.isnan(accepted) & ~np.isnan(delivered) & (delivered > accepted)
+        duration = (delivered - accepted)[ok]
+        pair = origin[ok] * n + dest[ok]
+        hour = hour_of_week(accepted[ok])
+        cells = _log_means(pair * HOURS_PER_WEEK + hour, duration, n * n * HOURS_PER_WEEK, min_samples)
+        pairs = _log_means(pair, duration, n * n, min_samples)
+        travel = cells.reshape(n, n, HOURS_PER_WEEK)
+        travel = np.where(np.isnan(travel), pairs.reshape(n, n, 1), travel)
+        
+        base, per_km = DEFAULT_BASE_SECONDS, DEFAULT_SECONDS_PER_KM
+        if ok.sum() >= 2 and np.ptp(distance[ok]) > 0:
+            per_km, base = np.polyfit(distance[ok], duration, 1)
+            per_km, base = max(per_km, 0.0), max(base, 0.0)
+        
+        # Creation -> acceptance, by pickup zone and hour created
+        ok = ~np.isnan(accepted) & ~np.isnan(created) & (accepted >= created)
+        waited = np.maximum((accepted - created)[ok], 1.0)
+        cells = _log_means(origin[ok] * HOURS_PER_WEEK + hour_of_week(created[ok]), waited,
+                           n * HOURS_PER_WEEK, min_samples)
+        per_zone = _log_means(origin[ok], waited, n, min_samples)
+        wait = cells.reshape(n, HOURS_PER_WEEK)
+        wait = np.where(np.isnan(wait), per_zone.reshape(n, 1), wait)
+        default_wait = float(np.exp(np.log(waited).mean())) if len(waited) else DEFAULT_WAIT_SECONDS
+        
+        return cls(zones, travel.astype(np.float32), wait.astype(np.float32), base, per_km, default_wait)
+    
+    def save(self, path=ETA_MODEL_PATH):
+        """Write atomically, so a server reloading mid-write never sees half a file"""
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez_compressed(f, zones=np.array(self.zones, dtype=str), travel=self.travel, wait=self.wait,
+                                params=np.array([self.base, self.per_km, self.default_wait]))
+        os.replace(tmp, path)
+    
+    @classmethod
+    def load(cls, path=ETA_MODEL_PATH):
+        with np.load(path) as data:
+            base, per_km, default_wait = data['params'].tolist()
+            return cls(data['zones'].tolist(), data['travel'], data['wait'], base, per_km, default_wait)
+    
+    def travel_seconds(self, origin, dest, hour, distance):
+        o, d = self.codes.get(origin), self.codes.get(dest)
+        value = self.travel[o, d, hour] if o is not None and d is not None else np.nan
+        if np.isnan(value):
+            return self.base + self.per_km * (distance or 0.0)
+        return float(value)
+    
+    def wait_seconds(self, origin, hour):
+        o = self.codes.get(origin)
+        value = self.wait[o, hour] if o is not None else np.nan
+        return self.default_wait if np.isnan(value) else float(value)
+    
+    def estimate(self, package, accepted_at=None, now=None):
+        """ETA in epoch seconds for a package dict; None once delivered or cancelled
+        
+        accepted_at is the dispatch time (epoch seconds) or None if no
+        driver has accepted the package yet.
+        """
+        if package['status'] in TERMINAL_STATUSES:
+            return None
+        now = _now() if now is None else now
+        origin = address_zone(package['pickup_address'])
+        dest = address_zone(package['recipient_address'])
+        if accepted_at is None:
+            start = now + self.wait_seconds(origin, int(hour_of_week(now)))
+        else:
+            start = accepted_at
+        eta = start + self.travel_seconds(origin, dest, int(hour_of_week(start)), package['distance'])
+        return max(eta, now + ETA_MIN_REMAINING_SECONDS)
+
+
+class ModelLoader:
+    """Current model, reloaded when the model file changes"""
+    
+    def __init__(self, path=ETA_MODEL_PATH):
+        self.path = path
+        self._model = ETAModel.untrained()
+        self._mtime = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+    
+    def get(self):
+        if time.time() - self._checked_at >= ETA_RELOAD_SECONDS:
+            with self._lock:
+                if time.time() - self._checked_at >= ETA_RELOAD_SECONDS:
+                    self._reload()
+        return self._model
+    
+    def _reload(self):
+        self._checked_at = time.time()
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            self._model = ETAModel.load(self.path)
+            self._mtime = mtime
+        except (OSError, ValueError, KeyError) as e:
+            print(f"ETA model reload failed: {e}")
+
+
+loader = ModelLoader()
+
+
+def load_history(days=ETA_TRAINING_DAYS):
+    cutoff = (datetime.now() - timedelta(days=days)).isoformat()
+    return [row for rows in router.scatter(HISTORY_QUERY, (cutoff,)) for row in rows]
+
+def train(days=ETA_TRAINING_DAYS, min_samples=ETA_MIN_SAMPLES, path=ETA_MODEL_PATH):
+    """Learn the tables from recent deliveries and save them for the servers"""
+    history = load_history(days)
+    model = ETAModel.train(history, min_samples)
+    model.save(path)
+    return model, history
+
+def format_eta(seconds):
+    return None if seconds is None else str(np.datetime64(int(seconds), 's'))
+
+def package_eta(package, accepted_at):
+    """ETA as an ISO timestamp (like created_at) for a package dict"""
+    accepted = None if not accepted_at else float(to_epoch([accepted_at])[0])
+    return format_eta(loader.get().estimate(package, accepted))
+
+def batch_eta(tracking_ids):
+    """ETAs for many tracking ids: one query per shard; unknown ids are omitted"""
+    by_shard = {}
+    for tracking_id in tracking_ids:
+        by_shard.setdefault(router.shard_for(tracking_id), []).append(tracking_id)
+    model = loader.get()
+    now = _now()
+    etas = {}
+    for shard, ids in by_shard.items():
+        conn = router.connect(shard)
+        try:
+            cursor = execute_query(conn, f'''
+                SELECT tracking_id, status, pickup_address, recipient_address, distance, {ACCEPTED_AT}
+                FROM packages WHERE tracking_id IN ({', '.join('?' for _ in ids)})
+            ''', ids)
+            packages = rows_to_dicts(cursor)
+        finally:
+            conn.close()
+        accepted = to_epoch([p['accepted_at'] for p in packages])
+        for package, started in zip(packages, accepted.tolist()):
+            started = None if np.isnan(started) else started
+            etas[package['tracking_id']] = format_eta(model.estimate(package, started, now))
+    return etas
@@ -1,5 +1,6 @@
 """Simple geocoding for Ireland addresses and EIRCODEs"""
 import re
+from metrics import timed
 
 # Approximate coordinates for major Irish cities/regions
 IRELAND_COORDINATES = {
@@ -72,6 +73,7 @@ def extract_eircode(address):
     
     return None
 
+@timed('geocode')
 def geocode_ireland_address(address):
     """
     Convert Irish address or EIRCODE to approximate coordinates
@@ -108,3 +110,20 @@ def geocode_ireland_address(address):
     lon = base_lon + random.uniform(-0.05, 0.05)
     return (lat, lon)
 
+def address_zone(address):
+    """
+    Map an address to a coarse delivery zone key
+    (routing area like 'd02', else city name, else 'other')
+    """
+    if not address:
+        return 'other'
+    
+    eircode = extract_eircode(address)
+    if eircode and eircode in IRELAND_COORDINATES:
+        return eircode
+    
+    address_lower = address.lower()
+    for city in IRELAND_COORDINATES:
+        if city in address_lower and city != 'default':
+            return city
+    return 'other'
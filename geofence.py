@@ -0,0 +1,227 @@
+"""Geofences that move packages through their statuses from driver positions
+
+Every package with a driver and a status of assigned, in_transit or
+out_for_delivery has two fences: its pickup point and its delivery point.
+They are indexed in a grid keyed by (driver, cell), so a driver position is
+only compared with that driver's fences in the 3x3 cells around it. The
+stage decides what a position can trigger:
+
+    assigned          -> in_transit         stayed GEOFENCE_DWELL_SECONDS within
+                                            GEOFENCE_ENTER_METERS of the pickup,
+                                            then left beyond GEOFENCE_EXIT_METERS
+    in_transit        -> out_for_delivery   came within GEOFENCE_APPROACH_METERS
+                                            of the delivery point
+    out_for_delivery  -> delivered          dwelt at the delivery point, then left
+
+The gap between the enter and exit radius, the dwell time, and transitions
+that only go forward keep GPS jitter at a boundary from flapping a status.
+
+Transitions are applied on a background thread through the same status
+change path as PUT /api/packages/<id>/status (event log, email, SNS). Each
+worker sees its own share of the pings, so the change is compare-and-set on
+the previous status and fires once. The fences are reloaded from the
+database every GEOFENCE_REFRESH_SECONDS.
+"""
+import math
+import os
+import queue
+import threading
+import time
+import numpy as np
+from db_config import router
+import metrics
+
+GEOFENCE_ENABLED = os.getenv('GEOFENCE_ENABLED', '1') == '1'
+GEOFENCE_ENTER_METERS = float(os.getenv('GEOFENCE_ENTER_METERS', '75'))
+GEOFENCE_EXIT_METERS = float(os.getenv('GEOFENCE_EXIT_METERS', '150'))
+GEOFENCE_APPROACH_METERS = float(os.getenv('GEOFENCE_APPROACH_METERS', '2000'))
+GEOFENCE_DWELL_SECONDS = float(os.getenv('GEOFENCE_DWELL_SECONDS', '30'))
+GEOFENCE_REFRESH_SECONDS = float(os.getenv('GEOFENCE_REFRESH_SECONDS', '30'))
+
+# Stages, in the order a package moves through them
+ASSIGNED, IN_TRANSIT, OUT_FOR_DELIVERY, DONE = range(4)
+STAGES = {'assigned': ASSIGNED, 'in_transit': IN_TRANSIT, 'out_for_delivery': OUT_FOR_DELIVERY}
+NEXT_STATUS = {ASSIGNED: 'in_transit', IN_TRANSIT: 'out_for_delivery', OUT_FOR_DELIVERY: 'delivered'}
+STATUS = {stage: status for status, stage in STAGES.items()}
+
+# Equirectangular projection to metres around Ireland's latitude; accurate
+# to well under a metre at fence distances
+REFERENCE_LAT = 53.4
+METERS_PER_DEG_LAT = 110574.0
+METERS_PER_DEG_LON = 111320.0 * math.cos(math.radians(REFERENCE_LAT))
+# A cell must be at least as wide as the largest radius a stage watches
+CELL_METERS = max(GEOFENCE_APPROACH_METERS, GEOFENCE_EXIT_METERS)
+
+FENCE_QUERY = '''
+    SELECT id, driver_id, status, pickup_lat, pickup_lon, delivery_lat, delivery_lon
+    FROM packages
+    WHERE status IN ('assigned', 'in_transit', 'out_for_delivery') AND driver_id IS NOT NULL
+      AND pickup_lat IS NOT NULL AND delivery_lat IS NOT NULL
+'''
+
+
+def project(lat, lon):
+    """Degrees to (x, y) metres"""
+    return np.asarray(lon, np.float64) * METERS_PER_DEG_LON, np.asarray(lat, np.float64) * METERS_PER_DEG_LAT
+
+
+class FenceIndex:
+    """Fences of active packages bucketed by (driver, grid cell), with per-package hysteresis state"""
+    
+    def __init__(self, packages, previous=None):
+        self.ids = [p['id'] for p in packages]
+        self.stage = np.array([STAGES[p['status']] for p in packages], np.int8)
+        self.pickup = np.column_stack(project([p['pickup_lat'] for p in packages],
+                                              [p['pickup_lon'] for p in packages])) if packages else np.zeros((0, 2))
+        self.delivery = np.column_stack(project([p['delivery_lat'] for p in packages],
+                                                [p['delivery_lon'] for p in packages])) if packages else np.zeros((0, 2))
+        # Time of the first and latest ping inside the current fence (NaN: outside)
+        self.inside_since = np.full(len(packages), np.nan)
+        self.inside_last = np.full(len(packages), np.nan)
+        self.rows = {package_id: i for i, package_id in enumerate(self.ids)}
+        if previous is not None:
+            self._carry_over(previous)
+        
+        # Each package sits in the cells of both its points; the stage
+        # decides which one is measured
+        self.cells = {}
+        for points in (self.pickup, self.delivery):
+            cx, cy = np.floor_divide(points, CELL_METERS).astype(np.int64).T.tolist() if len(points) else ([], [])
+            for i, (x, y) in enumerate(zip(cx, cy)):
+                self.cells.setdefault((packages[i]['driver_id'], x, y), set()).add(i)
+        self.cells = {key: np.fromiter(rows, np.int64) for key, rows in self.cells.items()}
+        self._lock = threading.Lock()
+    
+    def __len__(self):
+        return len(self.ids)
+    
+    def _carry_over(self, previous):
+        """Keep dwell state, and stages this worker already advanced past the database"""
+        for package_id, old in previous.rows.items():
+            new = self.rows.get(package_id)
+            if new is None:
+                continue
+            if previous.stage[old] > self.stage[new]:
+                self.stage[new] = previous.stage[old]
+            if previous.stage[old] == self.stage[new]:
+                self.inside_since[new] = previous.inside_since[old]
+                self.inside_last[new] = previous.inside_last[old]
+    
+    def candidates(self, driver_id, x, y):
+        """Rows of the driver's packages with a fence in the cells around the points"""
+        cells = set(zip(np.floor_divide(x, CELL_METERS).astype(np.int64).tolist(),
+                        np.floor_divide(y, CELL_METERS).astype(np.int64).tolist()))
+        found = [self.cells.get((driver_id, cx + dx, cy + dy))
+                 for cx, cy in cells for dx in (-1, 0, 1) for dy in (-1, 0, 1)]
+        found = [rows for rows in found if rows is not None]
+        if not found:
+            return found
+        return np.unique(np.concatenate(found)) if len(found) > 1 else found[0]
+    
+    def evaluate(self, driver_id, pings):
+        """Feed an (n, 3) array of ts, lat, lon pings; returns [(package_id, from, to)]"""
+        x, y = project(pings[:, 1], pings[:, 2])
+        rows = self.candidates(driver_id, x, y)
+        if not len(rows):
+            return []
+        order = np.argsort(pings[:, 0], kind='stable')
+        ts, x, y = pings[order, 0], x[order], y[order]
+        transitions = []
+        with self._lock:
+            for row in rows.tolist():
+                stage = int(self.stage[row])
+                if stage == DONE:
+                    continue
+                target = self.pickup[row] if stage == ASSIGNED else self.delivery[row]
+                distances = np.hypot(x - target[0], y - target[1]).tolist()
+                for i, t in enumerate(ts.tolist()):
+                    if self._step(row, stage, t, distances[i]):
+                        transitions.append((self.ids[row], STATUS[stage], NEXT_STATUS[stage]))
+                        stage = self.stage[row] = stage + 1
+                        if stage == DONE:
+                            break
+                        # Later stages all measure the delivery point
+                        target = self.delivery[row]
+                        distances = np.hypot(x - target[0], y - target[1]).tolist()
+        return transitions
+    
+    def _step(self, row, stage, t, d):
+        """Advance one package's state by one ping; True if its stage is complete"""
+        if stage == IN_TRANSIT:
+            return d <= GEOFENCE_APPROACH_METERS
+        if d <= GEOFENCE_ENTER_METERS:
+            if np.isnan(self.inside_since[row]):
+                self.inside_since[row] = t
+            self.inside_last[row] = t
+        elif d > GEOFENCE_EXIT_METERS and not np.isnan(self.inside_since[row]):
+            dwelt = self.inside_last[row] - self.inside_since[row] >= GEOFENCE_DWELL_SECONDS
+            self.inside_since[row] = self.inside_last[row] = np.nan
+            return dwelt
+        return False
+
+
+class GeofenceEngine:
+    """Current fence index, its periodic reload, and the transition queue"""
+    
+    def __init__(self):
+        self.index = FenceIndex([])
+        self.on_transition = None
+        self.transitions = queue.Queue()
+        self.applied = 0
+        self._loaded_at = 0
+        self._worker_pid = None
+        self._lock = threading.Lock()
+    
+    def reload(self):
+        packages = [row for rows in router.scatter(FENCE_QUERY) for row in rows]
+        self.index = FenceIndex(packages, previous=self.index)
+        self._loaded_at = time.time()
+    
+    def observe(self, driver_id, pings):
+        """Evaluate a batch of one driver's pings and queue any transitions"""
+        self._ensure_worker()
+        for transition in self.index.evaluate(driver_id, pings):
+            self.transitions.put(transition)
+    
+    def _ensure_worker(self):
+        if self._worker_pid == os.getpid():
+            return
+        with self._lock:
+            if self._worker_pid != os.getpid():
+                threading.Thread(target=self._run, name='geofence', daemon=True).start()
+                self._worker_pid = os.getpid()
+    
+    def _run(self):
+        while True:
+            if time.time() - self._loaded_at >= GEOFENCE_REFRESH_SECONDS:
+                try:
+                    self.reload()
+                except Exception as e:
+                    print(f"Geofence reload failed: {e}")
+                    self._loaded_at = time.time()
+            try:
+                package_id, old, new = self.transitions.get(timeout=1)
+            except queue.Empty:
+                continue
+            try:
+                if self.on_transition(package_id, new, expected_status=old):
+                    self.applied += 1
+            except Exception as e:
+                print(f"Geofence transition {package_id} {old} -> {new} failed: {e}")
+
+
+engine = GeofenceEngine()
+
+metrics.callback('geofence_packages', 'Packages with active fences', lambda: len(engine.index))
+metrics.callback('geofence_pending_transitions', 'Transitions waiting to be applied',
+                 lambda: engine.transitions.qsize())
+metrics.callback('geofence_transitions', 'Status transitions applied from geofences', lambda: engine.applied,
+                 kind='counter')
+
+def observe(driver_id, pings):
+    if GEOFENCE_ENABLED and len(pings):
+        engine.observe(driver_id, pings)
+
+def init(on_transition):
+    """Set the function applying transitions: (package_id, status, expected_status) -> bool"""
+    engine.on_transition = on_transition
@@ -0,0 +1,49 @@
+"""Gunicorn configuration for production serving
+
+    gunicorn -c gunicorn.conf.py app:app     (or ./serve.sh start)
+
+With ASGI=1 the workers are uvicorn event loops serving asgi_app:app
+(ASGI=1 ./serve.sh start); one per core is enough, as each keeps many
+requests waiting on the database and AWS at once.
+
+The app is imported once in the master before forking (preload_app), so the
+schema init in app.py runs once and the geocoder tables and other module
+state are shared copy-on-write by the workers. Workers are recycled after
+max_requests. For a zero-downtime code reload use ./serve.sh reload, which
+starts a new master with USR2 and gracefully retires the old one.
+"""
+import gc
+import multiprocessing
+import os
+import random
+
+bind = os.getenv('BIND', '0.0.0.0:5000')
+ASGI = os.getenv('ASGI', '0') == '1'
+cores = multiprocessing.cpu_count()
+workers = int(os.getenv('WEB_CONCURRENCY', cores if ASGI else cores * 2 + 1))
+threads = int(os.getenv('GUNICORN_THREADS', '1'))
+if ASGI:
+    worker_class = 'uvicorn.workers.UvicornWorker'
+else:
+    worker_class = 'gthread' if threads > 1 else 'sync'
+preload_app = True
+
+# Recycle workers to bound slow memory growth; jitter avoids restarting
+# every worker at the same moment
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '2000'))
+max_requests_jitter = max_requests // 10
+
+timeout = 60
+graceful_timeout = 30
+keepalive = 5
+pidfile = os.getenv('GUNICORN_PIDFILE', 'gunicorn.pid')
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-')
+
+def when_ready(server):
+    # Move everything loaded so far out of the GC's reach so collections in
+    # the workers do not write to (and un-share) the preloaded pages
+    gc.freeze()
+
+def post_fork(server, worker):
+    # Workers inherit the master's RNG state; reseed so geocoder jitter differs
+    random.seed()
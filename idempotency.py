@@ -0,0 +1,243 @@
+"""Idempotency-Key support for write endpoints
+
+A retried request carrying the same Idempotency-Key header gets the stored
+first response instead of running the handler again (no second geocode,
+insert or email). Duplicates that arrive while the first request is still
+running wait for it and then replay its response. Keys are scoped to the
+caller (the authenticated user, else the client address), so two callers
+sending the same key never see each other's responses.
+
+Responses live in a bounded, TTL-evicted in-process store. With
+IDEMPOTENCY_DB=1 they are also written to the idempotency_keys table so
+replays and in-flight waits work across workers.
+"""
+import hashlib
+import itertools
+import os
+import threading
+import time
+from collections import OrderedDict
+from functools import wraps
+from flask import g, request, jsonify, current_app, Response
+from db_config import router, execute_query
+import admission
+import metrics
+
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv('IDEMPOTENCY_TTL_SECONDS', '86400'))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv('IDEMPOTENCY_MAX_ENTRIES', '10000'))
+IDEMPOTENCY_DB = os.getenv('IDEMPOTENCY_DB', '0') == '1'
+# How long a duplicate waits for the in-flight original before giving up
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv('IDEMPOTENCY_WAIT_SECONDS', '30'))
+
+HEADER = 'Idempotency-Key'
+
+
+class Entry:
+    """One key's state: in flight (event unset) or completed (response set)"""
+    
+    def __init__(self, fingerprint):
+        self.fingerprint = fingerprint
+        self.created_at = time.time()
+        self.event = threading.Event()
+        self.response = None  # (status, body bytes, content type)
+
+
+class IdempotencyStore:
+    """Bounded LRU of idempotency entries with TTL expiry"""
+    
+    def __init__(self, max_entries=IDEMPOTENCY_MAX_ENTRIES, ttl=IDEMPOTENCY_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def claim(self, key, fingerprint):
+        """Return (entry, is_owner); the owner must later complete() or release()"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry.created_at > self.ttl:
+                del self._entries[key]
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry, False
+            entry = self._entries[key] = Entry(fingerprint)
+            # Evict least recently used; evicted in-flight entries stay valid
+            # for the threads already holding them
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return entry, True
+    
+    def complete(self, entry, response):
+        entry.response = response
+        entry.event.set()
+    
+    def release(self, key, entry):
+        """Forget a failed attempt so the next retry runs the handler again"""
+        with self._lock:
+            if self._entries.get(key) is entry:
+                del self._entries[key]
+        entry.event.set()
+
+
+store = IdempotencyStore()
+metrics.callback('idempotency_entries', 'Idempotency keys held in memory', lambda: len(store._entries))
+
+
+# --- Optional database backing (shared between workers) --------------------
+
+# Shared by request threads; next() on a count is atomic, unlike += on an int
+_writes = itertools.count(1)
+
+def _db_claim(key, fingerprint):
+    """Insert a placeholder row; returns None if claimed, else the existing row"""
+    conn = router.connect(router.home_shard)
+    try:
+        cursor = execute_query(conn, '''
+            INSERT INTO idempotency_keys (key, fingerprint, status, body, content_type, created_at)
+            VALUES (?, ?, NULL, NULL, NULL, ?) ON CONFLICT (key) DO NOTHING
+        ''', (key, fingerprint, time.time()))
+        claimed = cursor.rowcount == 1
+        if next(_writes) % 1000 == 0:
+            execute_query(conn, 'DELETE FROM idempotency_keys WHERE created_at < ?',
+                          (time.time() - IDEMPOTENCY_TTL_SECONDS,))
+        conn.commit()
+        if claimed:
+            return None
+        cursor = execute_query(conn, '''
+            SELECT fingerprint, status, body, content_type, created_at
+            FROM idempotency_keys WHERE key=?
+        ''', (key,))
+        row = cursor.fetchone()
+        if row is not None and row[1] is None and row[4] < time.time() - 2 * IDEMPOTENCY_WAIT_SECONDS:
+            # Placeholder left by a worker that died mid-request: take it over
+            cursor = execute_query(conn, '''
+                UPDATE idempotency_keys SET fingerprint=?, created_at=?
+                WHERE key=? AND status IS NULL AND created_at=?
+            ''', (fingerprint, time.time(), key, row[4]))
+            conn.commit()
+            if cursor.rowcount == 1:
+                return None
+        return row
+    finally:
+        conn.close()
+
+def _db_wait(key, deadline):
+    """Poll until another worker stores its response; None on timeout or release"""
+    while time.time() < deadline:
+        conn = router.connect(router.home_shard)
+        try:
+            cursor = execute_query(conn, 'SELECT status, body, content_type FROM idempotency_keys WHERE key=?', (key,))
+            row = cursor.fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        if row[0] is not None:
+            return (row[0], _to_bytes(row[1]), row[2])
+        time.sleep(0.05)
+    return None
+
+def _db_complete(key, response):
+    status, body, content_type = response
+    conn = router.connect(router.home_shard)
+    try:
+        execute_query(conn, 'UPDATE idempotency_keys SET status=?, body=?, content_type=? WHERE key=?',
+                      (status, body.decode('utf-8'), content_type, key))
+        conn.commit()
+    finally:
+        conn.close()
+
+def _db_release(key):
+    conn = router.connect(router.home_shard)
+    try:
+        execute_query(conn, 'DELETE FROM idempotency_keys WHERE key=? AND status IS NULL', (key,))
+        conn.commit()
+    finally:
+        conn.close()
+
+def _to_bytes(body):
+    return body.encode('utf-8') if isinstance(body, str) else bytes(body)
+
+
+# --- Flask decorator --------------------------------------------------------
+
+def _replay(response):
+    status, body, content_type = response
+    resp = Response(body, status=status, content_type=content_type)
+    resp.headers['Idempotent-Replayed'] = 'true'
+    return resp
+
+def _mismatch():
+    return jsonify({'error': f'{HEADER} was already used with a different request'}), 422
+
+def _in_progress():
+    resp = jsonify({'error': f'A request with this {HEADER} is still in progress'})
+    resp.headers['Retry-After'] = '1'
+    return resp, 409
+
+def _caller():
+    user = g.get('user')
+    if user:
+        return f"user:{user['id']}"
+    return admission.client_key('', request.headers.get('X-Forwarded-For'), request.remote_addr)
+
+def idempotent(view):
+    """Make a write endpoint replay its first response for a repeated Idempotency-Key"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        client_key = request.headers.get(HEADER)
+        if not client_key:
+            return view(*args, **kwargs)
+        
+        key = f"{_caller()} {request.method} {request.path} {client_key}"
+        fingerprint = hashlib.sha256(request.get_data()).hexdigest()
+        deadline = time.time() + IDEMPOTENCY_WAIT_SECONDS
+        
+        while True:
+            entry, owner = store.claim(key, fingerprint)
+            if owner:
+                break
+            if entry.fingerprint != fingerprint:
+                return _mismatch()
+            if not entry.event.wait(max(deadline - time.time(), 0)):
+                return _in_progress()
+            if entry.response is not None:
+                return _replay(entry.response)
+            # The original failed and was released; try to take over
+        
+        try:
+            if IDEMPOTENCY_DB:
+                row = _db_claim(key, fingerprint)
+                if row is not None:
+                    if row[0] != fingerprint:
+                        store.release(key, entry)
+                        return _mismatch()
+                    stored = (row[1], _to_bytes(row[2]), row[3]) if row[1] is not None else _db_wait(key, deadline)
+                    if stored is None:
+                        store.release(key, entry)
+                        return _in_progress()
+                    store.complete(entry, stored)
+                    return _replay(stored)
+            
+            resp = current_app.make_response(view(*args, **kwargs))
+        except Exception:
+            store.release(key, entry)
+            if IDEMPOTENCY_DB:
+                _db_release(key)
+            raise
+        
+        # Server errors are not stored, so a retry gets another attempt
+        if resp.status_code >= 500:
+            store.release(key, entry)
+            if IDEMPOTENCY_DB:
+                _db_release(key)
+            return resp
+        
+        stored = (resp.status_code, resp.get_data(), resp.content_type)
+        if IDEMPOTENCY_DB:
+            _db_complete(key, stored)
+        store.complete(entry, stored)
+        return resp
+    return wrapper
@@ -0,0 +1,82 @@
+"""Identifiers for new rows
+
+new_id() gives the primary keys of users, packages and deliveries: UUIDv7
+strings (RFC 9562) that start with the creation time in milliseconds, so a
+new key sorts after the ones before it and inserts land at the right-hand
+edge of the primary key index instead of on a random page. Within a
+millisecond a per-process sequence keeps them in order. They are still
+36-character UUID strings, so they sit in the same TEXT columns as the
+random (version 4) ids of older rows.
+
+tracking_id() gives the IDs customers type in: "TRK", 12 random Crockford
+base32 characters (60 bits) and a check character (Luhn mod 32), which
+catches any single mistyped character and most swapped neighbours. They are
+the public key of the unauthenticated tracking route, so unlike new_id()
+they carry no timestamp to enumerate. Uniqueness is enforced per shard by
+the unique tracking_id index, which is enough because a tracking ID always
+routes to the same shard; a repeat is not inserted and another is drawn.
+IDs issued before this format (TRK + 8 hex digits) stay valid.
+"""
+import secrets
+import threading
+import time
+import uuid
+
+TRACKING_PREFIX = 'TRK'
+TRACKING_ALPHABET = '0123456789ABCDEFGHJKMNPQRSTVWXYZ'  # Crockford base32: no I, L, O, U
+TRACKING_BODY_LENGTH = 12
+TRACKING_ID_LENGTH = len(TRACKING_PREFIX) + TRACKING_BODY_LENGTH + 1
+# Draws before giving up on a new package; with 60 random bits a second one is already rare
+TRACKING_ID_ATTEMPTS = 5
+
+_VALUES = {ch: i for i, ch in enumerate(TRACKING_ALPHABET)}
+_lock = threading.Lock()
+_last_ms = 0
+_sequence = 0
+
+
+def new_id(at=None):
+    """A UUIDv7 string for a new row; at (Unix seconds) backdates it, for backfills"""
+    global _last_ms, _sequence
+    if at is not None:
+        ms, sequence = int(at * 1000), secrets.randbits(12)
+    else:
+        with _lock:
+            ms = time.time_ns() // 1_000_000
+            if ms > _last_ms:
+                # Start low in the 12 bits so the millisecond has room to count up
+                _last_ms, _sequence = ms, secrets.randbits(10)
+            elif _sequence < 0xFFF:
+                _sequence += 1
+            else:
+                # Sequence exhausted (or the clock went back): borrow the next millisecond
+                _last_ms, _sequence = _last_ms + 1, 0
+            ms, sequence = _last_ms, _sequence
+    value = (ms & 0xFFFFFFFFFFFF) << 80 | 0x7 << 76 | sequence << 64 | 0b10 << 62 | secrets.randbits(62)
+    return str(uuid.UUID(int=value))
+
+def _check_character(body):
+    """Luhn mod 32 check character for a string of TRACKING_ALPHABET characters"""
+    total = 0
+    factor = 2
+    for ch in reversed(body):
+        addend = factor * _VALUES[ch]
+        total += addend // 32 + addend % 32
+        factor = 3 - factor
+    return TRACKING_ALPHABET[-total % 32]
+
+def tracking_id():
+    body = ''.join(secrets.choice(TRACKING_ALPHABET) for _ in range(TRACKING_BODY_LENGTH))
+    return f"{TRACKING_PREFIX}{body}{_check_character(body)}"
+
+def mistyped_tracking_id(value):
+    """True for a current-format tracking ID whose check character does not match
+
+    Anything else (including the older TRK + 8 hex format) is looked up as is.
+    """
+    if len(value) != TRACKING_ID_LENGTH or not value.startswith(TRACKING_PREFIX):
+        return False
+    body = value[len(TRACKING_PREFIX):-1]
+    if any(ch not in _VALUES for ch in body):
+        return True
+    return _check_character(body) != value[-1]
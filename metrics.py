@@ -0,0 +1,402 @@
+"""In-process metrics: counters, gauges and histograms served at /metrics
+
+Recording is cheap enough for the tracking path. Counters and histograms
+accumulate into per-thread lists, so an observation takes no lock: one
+bisect and two additions. A scrape sums the threads' lists, folding those
+of exited threads into a running total. Values computed from other modules'
+state (cache sizes, buffer fill) are registered as callbacks and only read
+on scrape.
+
+Two histograms cover where request time goes:
+
+    http_request_duration_seconds{endpoint, method, status}
+    stage_duration_seconds{stage}    db_connect, db_query, geocode, distance,
+                                     pricing, json, s3, sns, ses
+
+Functions are timed with the @timed(stage) decorator, which also hands each
+call to the current request's capture when profiler.py has one open (for the
+slow request buffer). Under gunicorn every
+worker keeps its own registry, and a scrape reports the worker that
+answered it (the pid label tells them apart). METRICS_ENABLED=0 leaves
+functions undecorated and removes the endpoint.
+"""
+import bisect
+import contextvars
+import inspect
+import os
+import threading
+import time
+from functools import wraps
+from flask import request, Response
+from flask.json.provider import DefaultJSONProvider
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
+
+# Seconds: from sub-millisecond lookups to slow SES calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def _label_text(names, values, extra=()):
+    pairs = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)] + list(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+class ThreadCells:
+    """Per-thread accumulator lists for one series, summed on scrape"""
+    
+    def __init__(self, size):
+        self.size = size
+        self._local = threading.local()
+        self._cells = []  # (thread, cell)
+        self._retired = [0] * size
+        self._lock = threading.Lock()
+    
+    def cell(self):
+        try:
+            return self._local.cell
+        except AttributeError:
+            cell = self._local.cell = [0] * self.size
+            with self._lock:
+                self._cells.append((threading.current_thread(), cell))
+            return cell
+    
+    def totals(self):
+        with self._lock:
+            live = []
+            for thread, cell in self._cells:
+                if thread.is_alive():
+                    live.append((thread, cell))
+                else:
+                    # The thread is gone, so nothing writes to its cell any more
+                    self._retired = [a + b for a, b in zip(self._retired, cell)]
+            self._cells = live
+            totals = list(self._retired)
+        for _, cell in live:
+            totals = [a + b for a, b in zip(totals, cell)]
+        return totals
+
+
+class Metric:
+    kind = None
+    
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+        self._lock = threading.Lock()
+    
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            with self._lock:
+                child = self._children.get(values)
+                if child is None:
+                    child = self._children[values] = self._new_child()
+        return child
+    
+    def samples(self):
+        """[(suffix, label values, extra label text, value)] for the exposition"""
+        raise NotImplementedError
+
+
+class _CounterChild:
+    __slots__ = ('_cells',)
+    
+    def __init__(self):
+        self._cells = ThreadCells(1)
+    
+    def inc(self, amount=1):
+        self._cells.cell()[0] += amount
+    
+    def value(self):
+        return self._cells.totals()[0]
+
+
+class Counter(Metric):
+    kind = 'counter'
+    
+    def _new_child(self):
+        return _CounterChild()
+    
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+    
+    def samples(self):
+        return [('_total', values, (), child.value()) for values, child in list(self._children.items())]
+
+
+class _GaugeChild:
+    __slots__ = ('_value', '_lock')
+    
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+    
+    def set(self, value):
+        self._value = value
+    
+    def inc(self, amount=1):
+        with self._lock:
+            self._value += amount
+    
+    def dec(self, amount=1):
+        with self._lock:
+            self._value -= amount
+    
+    def value(self):
+        return self._value
+
+
+class Gauge(Metric):
+    kind = 'gauge'
+    
+    def _new_child(self):
+        return _GaugeChild()
+    
+    def set(self, value):
+        self.labels().set(value)
+    
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+    
+    def dec(self, amount=1):
+        self.labels().dec(amount)
+    
+    def samples(self):
+        return [('', values, (), child.value()) for values, child in list(self._children.items())]
+
+
+class _HistogramChild:
+    __slots__ = ('bounds', '_cells')
+    
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # One count per bucket (the last is +Inf), then the sum
+        self._cells = ThreadCells(len(bounds) + 2)
+    
+    def observe(self, value):
+        cell = self._cells.cell()
+        cell[bisect.bisect_left(self.bounds, value)] += 1
+        cell[-1] += value
+    
+    def snapshot(self):
+        totals = self._cells.totals()
+        return totals[:-1], totals[-1]
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+    
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.bounds = tuple(sorted(buckets))
+    
+    def _new_child(self):
+        return _HistogramChild(self.bounds)
+    
+    def observe(self, value):
+        self.labels().observe(value)
+    
+    def samples(self):
+        samples = []
+        for values, child in list(self._children.items()):
+            counts, total = child.snapshot()
+            cumulative = 0
+            for bound, count in zip(self.bounds + (float('inf'),), counts):
+                cumulative += count
+                samples.append(('_bucket', values, (f'le="{_number(bound)}"',), cumulative))
+            samples.append(('_sum', values, (), total))
+            samples.append(('_count', values, (), cumulative))
+        return samples
+
+
+class Callback(Metric):
+    """Values read from a function at scrape time: a number, or {label values: number}"""
+    
+    def __init__(self, name, help, fn, labelnames=(), kind='gauge'):
+        super().__init__(name, help, labelnames)
+        self.kind = kind
+        self.fn = fn
+    
+    def samples(self):
+        try:
+            values = self.fn()
+        except Exception as e:
+            print(f"Metric {self.name} failed: {e}")
+            return []
+        if not isinstance(values, dict):
+            values = {(): values}
+        suffix = '_total' if self.kind == 'counter' else ''
+        return [(suffix, labels, (), value) for labels, value in values.items()]
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = {}
+        self._lock = threading.Lock()
+    
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self.metrics:
+                raise ValueError(f"Metric {metric.name} is already registered")
+            self.metrics[metric.name] = metric
+        return metric
+    
+    def render(self):
+        """Prometheus text exposition format 0.0.4"""
+        pid = f'pid="{os.getpid()}"'
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            for suffix, values, extra, value in metric.samples():
+                labels = _label_text(metric.labelnames, values, extra + (pid,))
+                lines.append(f'{metric.name}{suffix}{labels} {_number(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+def counter(name, help, labelnames=()):
+    return registry.register(Counter(name, help, labelnames))
+
+def gauge(name, help, labelnames=()):
+    return registry.register(Gauge(name, help, labelnames))
+
+def histogram(name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return registry.register(Histogram(name, help, labelnames, buckets))
+
+def callback(name, help, fn, labelnames=(), kind='gauge'):
+    return registry.register(Callback(name, help, fn, labelnames, kind))
+
+
+REQUEST_SECONDS = histogram('http_request_duration_seconds', 'Time to handle a request',
+                            ('endpoint', 'method', 'status'))
+# Requests started and finished, per thread; the difference is in flight
+_requests = ThreadCells(2)
+
+def _in_flight():
+    started, finished = _requests.totals()
+    return started - finished
+
+callback('http_requests_in_flight', 'Requests being handled by this process', _in_flight)
+STAGE_SECONDS = histogram('stage_duration_seconds', 'Time spent in one stage of handling a request', ('stage',))
+
+# Calls recorded for the current request while a list is set (see profiler.py)
+_spans = contextvars.ContextVar('metrics_spans', default=None)
+
+def collect_spans():
+    """Start recording this context's timed calls as (stage, name, started, seconds, args)"""
+    spans = []
+    _spans.set(spans)
+    return spans
+
+def stop_spans():
+    _spans.set(None)
+
+def timed(stage):
+    """Decorator recording each call's duration under stage_duration_seconds{stage}
+    
+    Coroutine functions are timed until they return, not until the call
+    hands back the coroutine.
+    """
+    def decorate(fn):
+        if not METRICS_ENABLED:
+            return fn
+        child = STAGE_SECONDS.labels(stage)
+        name = fn.__qualname__
+        if inspect.iscoroutinefunction(fn):
+            @wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    elapsed = time.perf_counter() - started
+                    child.observe(elapsed)
+                    spans = _spans.get()
+                    if spans is not None:
+                        spans.append((stage, name, started, elapsed, args))
+            return async_wrapper
+        
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                elapsed = time.perf_counter() - started
+                child.observe(elapsed)
+                spans = _spans.get()
+                if spans is not None:
+                    spans.append((stage, name, started, elapsed, args))
+        return wrapper
+    return decorate
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """Flask's JSON provider, with serialization and parsing timed as the json stage"""
+    
+    _stage = STAGE_SECONDS.labels('json')
+    
+    def dumps(self, obj, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().dumps(obj, **kwargs)
+        finally:
+            self._stage.observe(time.perf_counter() - started)
+    
+    def loads(self, s, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().loads(s, **kwargs)
+        finally:
+            self._stage.observe(time.perf_counter() - started)
+
+
+# A context variable rather than flask.g: the proxy lookups cost more than
+# the rest of the bookkeeping together
+_request_started = contextvars.ContextVar('metrics_request_started', default=None)
+
+def request_started():
+    """Count a request in flight; returns its start time for request_finished()"""
+    _requests.cell()[0] += 1
+    return time.perf_counter()
+
+def request_finished(started, endpoint, method, status):
+    _requests.cell()[1] += 1
+    REQUEST_SECONDS.labels(endpoint, method, status).observe(time.perf_counter() - started)
+
+def start_timer():
+    """before_request hook"""
+    _request_started.set(request_started())
+
+def record_request(response):
+    """after_request hook (also runs for error responses)"""
+    started = _request_started.get()
+    if started is not None:
+        _request_started.set(None)
+        req = request._get_current_object()
+        request_finished(started, req.endpoint or 'unmatched', req.method, response.status_code)
+    return response
+
+def metrics_endpoint():
+    return Response(registry.render(), mimetype='text/plain; version=0.0.4')
+
+def init_app(app):
+    """Register first, so the request timer wraps every other hook"""
+    if not METRICS_ENABLED:
+        return
+    app.json = TimedJSONProvider(app)
+    app.before_request(start_timer)
+    app.after_request(record_request)
+    app.add_url_rule('/metrics', 'metrics', metrics_endpoint)
@@ -0,0 +1,273 @@
+"""Request profiling and a buffer of slow requests
+
+Requests run under cProfile when sampled (PROFILE_SAMPLE_RATE, a fraction
+of requests) or when they carry an "X-Profile: 1" header together with the
+token of a user in PROFILE_ROLE. While a request runs, the calls decorated
+with metrics.timed are recorded with their timings: the SQL of every query,
+connections opened, S3/SNS/SES calls, geocoding and pricing.
+
+A request taking SLOW_REQUEST_MS or longer is kept, with those calls and its
+profile if it had one, in a buffer of the last SLOW_REQUEST_BUFFER captures
+(per worker). Requests profiled on demand are kept whatever their duration,
+and the response names the capture in an X-Profile-Id header. The captures
+are served under /api/admin/slow-requests, the profiles as pstats files or
+as collapsed stacks for flamegraph.pl and speedscope.
+
+For a request that is not profiled, the cost is an empty list per request
+and an append per timed call. SLOW_REQUEST_MS=0 turns capture off unless a
+request is sampled or asks to be profiled.
+"""
+import contextvars
+import cProfile
+import marshal
+import os
+import pstats
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from flask import request
+import auth
+import metrics
+
+SLOW_REQUEST_MS = float(os.getenv('SLOW_REQUEST_MS', '1000'))
+SLOW_REQUEST_BUFFER = int(os.getenv('SLOW_REQUEST_BUFFER', '50'))
+PROFILE_SAMPLE_RATE = float(os.getenv('PROFILE_SAMPLE_RATE', '0'))
+PROFILE_ROLE = os.getenv('PROFILE_ROLE', 'admin')
+
+# Calls kept per capture, and characters of SQL per call
+MAX_SPANS = 500
+MAX_SQL_CHARS = 2000
+# Collapsed stacks leave out paths under this share of the profiled time
+MIN_STACK_SHARE = 0.0001
+SQL_STAGES = ('db_query',)
+
+
+def label(func):
+    """pstats function key to a frame name"""
+    filename, lineno, name = func
+    if filename == '~':
+        return name.replace(';', ',')
+    # The parent directory tells flask/app.py from this app.py
+    where = os.path.join(os.path.basename(os.path.dirname(filename)), os.path.basename(filename))
+    return f"{name} ({where}:{lineno})".replace(';', ',')
+
+def folded_stacks(stats):
+    """Collapsed stacks, "frame;frame;frame microseconds" per line, from a pstats table
+    
+    cProfile keeps caller/callee pairs rather than stacks, so the time of a
+    function called from several places is shared out between the paths in
+    proportion to the time each caller spent in it.
+    """
+    callees = {}
+    for func, (_, _, _, _, callers) in stats.items():
+        for caller, edge in callers.items():
+            callees.setdefault(caller, []).append((func, edge[3]))
+    roots = [func for func, entry in stats.items() if not entry[4]]
+    total = sum(stats[func][3] for func in roots)
+    floor = total * MIN_STACK_SHARE
+    folded = {}
+    
+    def walk(func, path, on_path, share):
+        self_time = stats[func][2]
+        path = path + (label(func),)
+        self_us = round(self_time * share * 1e6)
+        if self_us:
+            key = ';'.join(path)
+            folded[key] = folded.get(key, 0) + self_us
+        on_path = on_path | {func}
+        for callee, edge_time in callees.get(func, ()):
+            callee_time = stats[callee][3]
+            # Recursion shows as a cycle; its time stays with the outer call
+            if callee in on_path or not callee_time or edge_time * share < floor:
+                continue
+            walk(callee, path, on_path, share * edge_time / callee_time)
+    
+    for func in roots:
+        if stats[func][3] >= floor:
+            walk(func, (), frozenset(), 1.0)
+    return ''.join(f'{stack} {us}\n' for stack, us in sorted(folded.items()))
+
+
+class Capture:
+    """One request in progress: its start, the calls recorded so far and its profiler"""
+    
+    __slots__ = ('started', 'spans', 'profiler', 'on_demand', 'id')
+    
+    def __init__(self, profile, on_demand):
+        self.spans = metrics.collect_spans()
+        self.profiler = None
+        self.on_demand = on_demand
+        self.id = uuid.uuid4().hex[:16] if on_demand else None
+        if profile:
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+                self.profiler = profiler
+            except ValueError as e:
+                # Python 3.12+ allows one profiler at a time per process
+                print(f"Profiling skipped: {e}")
+        self.started = time.perf_counter()
+    
+    def stop(self):
+        elapsed = time.perf_counter() - self.started
+        if self.profiler is not None:
+            self.profiler.disable()
+        metrics.stop_spans()
+        return elapsed
+    
+    def calls(self):
+        """Recorded calls as dicts, offsets in milliseconds from the start of the request"""
+        calls = []
+        for stage, name, started, seconds, args in self.spans[:MAX_SPANS]:
+            call = {'stage': stage, 'call': name, 'start_ms': round((started - self.started) * 1000, 3),
+                    'ms': round(seconds * 1000, 3)}
+            if stage in SQL_STAGES and len(args) > 1 and isinstance(args[1], str):
+                call['sql'] = ' '.join(args[1].split())[:MAX_SQL_CHARS]
+            calls.append(call)
+        return calls
+
+
+class SlowRequests:
+    """Ring buffer of captured requests, with their profiles converted on first use"""
+    
+    def __init__(self, size=SLOW_REQUEST_BUFFER):
+        self.entries = deque(maxlen=size)
+        self.captured = 0
+        self._lock = threading.Lock()
+    
+    def add(self, entry):
+        with self._lock:
+            self.entries.append(entry)
+            self.captured += 1
+    
+    def get(self, capture_id):
+        with self._lock:
+            for entry in self.entries:
+                if entry['id'] == capture_id:
+                    return entry
+        return None
+    
+    def summaries(self):
+        with self._lock:
+            entries = list(self.entries)
+        return [summary(entry) for entry in reversed(entries)]
+    
+    def stats(self, entry):
+        """pstats table of an entry, None if it was not profiled"""
+        with self._lock:
+            profiler = entry.pop('_profiler', None)
+            if profiler is not None:
+                entry['_stats'] = pstats.Stats(profiler).stats
+            return entry.get('_stats')
+
+
+def summary(entry):
+    totals = {}
+    for call in entry['calls']:
+        count, ms = totals.get(call['stage'], (0, 0.0))
+        totals[call['stage']] = (count + 1, ms + call['ms'])
+    fields = ('id', 'started_at', 'method', 'path', 'endpoint', 'status', 'duration_ms', 'profiled', 'on_demand')
+    result = {field: entry[field] for field in fields}
+    result['stages'] = {stage: {'calls': count, 'ms': round(ms, 3)} for stage, (count, ms) in sorted(totals.items())}
+    return result
+
+def top_functions(stats, limit=30):
+    rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    return [{'function': label(func), 'calls': nc, 'self_ms': round(tt * 1000, 3), 'cumulative_ms': round(ct * 1000, 3)}
+            for func, (_, nc, tt, ct, _) in rows]
+
+def detail(entry):
+    """Summary, recorded calls and the most expensive functions of a capture"""
+    result = summary(entry)
+    result['calls'] = entry['calls']
+    result['calls_dropped'] = entry['calls_dropped']
+    stats = slow_requests.stats(entry)
+    if stats is not None:
+        result['functions'] = top_functions(stats)
+    return result
+
+def pstats_file(entry):
+    """Bytes of a file for pstats.Stats() / snakeviz, None if the request was not profiled"""
+    stats = slow_requests.stats(entry)
+    return marshal.dumps(stats) if stats is not None else None
+
+def collapsed(entry):
+    stats = slow_requests.stats(entry)
+    return folded_stacks(stats) if stats is not None else None
+
+
+slow_requests = SlowRequests()
+_capture = contextvars.ContextVar('profiler_capture', default=None)
+
+metrics.callback('slow_requests_captured', 'Requests kept in the slow request buffer',
+                 lambda: slow_requests.captured, kind='counter')
+
+def wants_profile(app, environ):
+    """X-Profile from a user with PROFILE_ROLE (the header alone is ignored)"""
+    if environ.get('HTTP_X_PROFILE', '0') in ('', '0'):
+        return False
+    with app.app_context():
+        user, _ = auth.authenticate(environ.get('HTTP_AUTHORIZATION'))
+    return auth.has_role(user, PROFILE_ROLE)
+
+
+class CaptureMiddleware:
+    """Starts the capture around the whole Flask request, reading the environ directly
+    
+    A before_request hook would cover less of the request and cost more: the
+    request proxy alone takes longer than the rest of the bookkeeping.
+    """
+    
+    def __init__(self, app):
+        self.app = app
+        self.wsgi_app = app.wsgi_app
+    
+    def __call__(self, environ, start_response):
+        on_demand = 'HTTP_X_PROFILE' in environ and wants_profile(self.app, environ)
+        profile = on_demand or (PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE)
+        if not profile and SLOW_REQUEST_MS <= 0:
+            return self.wsgi_app(environ, start_response)
+        _capture.set(Capture(profile, on_demand))
+        try:
+            return self.wsgi_app(environ, start_response)
+        finally:
+            # Still set if the request ended without reaching finish_capture
+            capture = _capture.get()
+            if capture is not None:
+                _capture.set(None)
+                capture.stop()
+
+def finish_capture(response):
+    """after_request hook: keep the request if it was slow or asked to be profiled"""
+    capture = _capture.get()
+    if capture is None:
+        return response
+    _capture.set(None)
+    elapsed = capture.stop()
+    if capture.on_demand or (SLOW_REQUEST_MS > 0 and elapsed * 1000 >= SLOW_REQUEST_MS):
+        req = request._get_current_object()
+        entry = {
+            'id': capture.id or uuid.uuid4().hex[:16],
+            'started_at': time.time() - elapsed,
+            'method': req.method,
+            'path': req.full_path.rstrip('?'),
+            'endpoint': req.endpoint,
+            'status': response.status_code,
+            'duration_ms': round(elapsed * 1000, 3),
+            'profiled': capture.profiler is not None,
+            'on_demand': capture.on_demand,
+            'calls': capture.calls(),
+            'calls_dropped': max(0, len(capture.spans) - MAX_SPANS),
+            '_profiler': capture.profiler,
+        }
+        slow_requests.add(entry)
+        if capture.on_demand:
+            response.headers['X-Profile-Id'] = entry['id']
+    return response
+
+def init_app(app):
+    """Register right after metrics: after_request hooks run last-registered first, so the others end inside the capture"""
+    app.wsgi_app = CaptureMiddleware(app)
+    app.after_request(finish_capture)
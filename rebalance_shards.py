@@ -0,0 +1,34 @@
+"""Rebalance packages across shards after adding or removing databases
+
+Usage:
+    python3 rebalance_shards.py --from shard_a.db,shard_b.db \
+        --to shard_a.db,shard_b.db,shard_c.db [--dry-run]
+
+Run it before switching DB_SHARDS to the new list. Shards are named the same
+way as in DB_SHARDS (SQLite paths, or "host[:port][/dbname]" for postgres).
+"""
+import argparse
+from db_config import init_shard, rebalance_shards
+
+def main():
+    parser = argparse.ArgumentParser(description='Move packages to their new shard')
+    parser.add_argument('--from', dest='old', required=True, help='Current comma-separated shard list')
+    parser.add_argument('--to', dest='new', required=True, help='New comma-separated shard list')
+    parser.add_argument('--dry-run', action='store_true', help='Only report what would move')
+    args = parser.parse_args()
+    
+    old_shards = [s.strip() for s in args.old.split(',') if s.strip()]
+    new_shards = [s.strip() for s in args.new.split(',') if s.strip()]
+    
+    if not args.dry_run:
+        for shard in new_shards:
+            init_shard(shard)
+    
+    moves = rebalance_shards(old_shards, new_shards, dry_run=args.dry_run)
+    total = sum(moves.values())
+    for (source, target), count in sorted(moves.items()):
+        print(f"{source} -> {target}: {count} packages")
+    print(f"{'Would move' if args.dry_run else 'Moved'} {total} packages")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,174 @@
+"""The queries behind the API routes, declared once, and the records they return
+
+Each query is written once with ? placeholders and compiled for DB_TYPE when
+this module is imported, so nothing is rewritten per call. SELECTs return
+named tuples of the declared columns (package.tracking_id whichever driver
+is in use) and routes serialise them with _asdict().
+
+Queries run as plain parameterised statements. The routes open a
+connection per request, so a server-side prepared statement would be
+prepared and thrown away each time; only the pooled connections of
+async_db.py live long enough for asyncpg's statement cache to pay off.
+
+Every run is timed as a db_query stage with its declared SQL, as inline
+queries are.
+"""
+import re
+from typing import NamedTuple
+from db_config import DB_TYPE, CURRENT_TRACKING_ID
+from eta import ACCEPTED_AT
+from metrics import timed
+
+
+class Package(NamedTuple):
+    id: str
+    tracking_id: str
+    sender_id: str
+    recipient_name: str
+    recipient_email: str | None
+    recipient_address: str
+    pickup_address: str
+    status: str
+    distance: float
+    price: float
+    driver_id: str | None
+    created_at: str
+
+
+class TrackedPackage(NamedTuple):
+    """Package with the time a driver accepted it (None before), for the ETA"""
+    id: str
+    tracking_id: str
+    sender_id: str
+    recipient_name: str
+    recipient_email: str | None
+    recipient_address: str
+    pickup_address: str
+    status: str
+    distance: float
+    price: float
+    driver_id: str | None
+    created_at: str
+    accepted_at: str | None
+
+
+class PackageTotals(NamedTuple):
+    total: int
+    revenue: float | None
+    distance_sum: float | None
+    distance_count: int
+
+
+class StatusCount(NamedTuple):
+    status: str
+    count: int
+
+
+PACKAGE_COLUMNS = ', '.join(Package._fields)
+
+
+class Query:
+    """A declared statement compiled for the active dialect
+    
+    record is the named tuple type of its rows, for SELECTs. On PostgreSQL,
+    numbered is the SQL with $1..$n placeholders, as asyncpg (async_db.py)
+    takes it.
+    """
+    
+    __slots__ = ('name', 'sql', 'numbered', 'record')
+    
+    def __init__(self, name, sql, record=None):
+        self.name = name
+        self.record = record
+        sql = ' '.join(sql.split())
+        self.numbered = None
+        if DB_TYPE == 'postgres':
+            self.sql = sql.replace('?', '%s')
+            positions = iter(range(1, sql.count('?') + 1))
+            self.numbered = re.sub(r'\?', lambda _: f'${next(positions)}', sql)
+        else:
+            self.sql = sql
+    
+    def execute(self, conn, params=()):
+        """Run the query on conn and return the cursor"""
+        return _execute(conn, self.sql, params)
+    
+    def one(self, conn, params=()):
+        """First row as a record, None if there is none"""
+        row = self.execute(conn, params).fetchone()
+        return self.record._make(row) if row is not None else None
+    
+    def all(self, conn, params=()):
+        make = self.record._make
+        return [make(row) for row in self.execute(conn, params).fetchall()]
+    
+    def scalar(self, conn, params=()):
+        """First column of the first row, None if there is no row"""
+        row = self.execute(conn, params).fetchone()
+        return row[0] if row is not None else None
+    
+    def run(self, conn, params=()):
+        """Run a write; returns the number of rows it changed"""
+        return self.execute(conn, params).rowcount
+
+
+@timed('db_query')
+def _execute(conn, sql, params):
+    # Same signature as execute_query, so profiler.py records sql
+    cursor = conn.cursor()
+    cursor.execute(sql, params)
+    return cursor
+
+
+PING = Query('ping', 'SELECT 1')
+
+# Users (home shard)
+USER_ID_BY_EMAIL = Query('user_id_by_email', 'SELECT id FROM users WHERE email=?')
+USER_ID_BY_LOGIN = Query('user_id_by_login', 'SELECT id FROM users WHERE email=? AND password=?')
+INSERT_USER = Query('insert_user', 'INSERT INTO users (id, email, password, name, role) VALUES (?, ?, ?, ?, ?)')
+SET_USER_ROLE = Query('set_user_role', 'UPDATE users SET role=? WHERE email=?')
+
+# Packages (the shard owning the tracking id)
+# Inserts nothing (rowcount 0) if the tracking ID is already taken on the shard
+INSERT_PACKAGE = Query('insert_package', f'''
+    INSERT INTO packages (id, tracking_id, sender_id, recipient_name, recipient_email, recipient_address,
+                          pickup_address, status, distance, price, driver_id, created_at,
+                          pickup_lat, pickup_lon, delivery_lat, delivery_lon, weight_kg)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (tracking_id) WHERE {CURRENT_TRACKING_ID} DO NOTHING
+''')
+PACKAGE_BY_ID = Query('package_by_id', f'SELECT {PACKAGE_COLUMNS} FROM packages WHERE id=?', Package)
+TRACKED_PACKAGE = Query('tracked_package', f'''
+    SELECT {PACKAGE_COLUMNS}, {ACCEPTED_AT} FROM packages WHERE tracking_id=?
+''', TrackedPackage)
+PACKAGE_EXISTS = Query('package_exists', 'SELECT 1 FROM packages WHERE id=?')
+PACKAGE_WEIGHT = Query('package_weight', 'SELECT weight_kg FROM packages WHERE id=?')
+SET_STATUS = Query('set_status', 'UPDATE packages SET status=? WHERE id=?')
+SET_STATUS_IF = Query('set_status_if', 'UPDATE packages SET status=? WHERE id=? AND status=?')
+ASSIGN_DRIVER = Query('assign_driver', 'UPDATE packages SET status=?, driver_id=? WHERE id=?')
+SET_WEIGHT = Query('set_weight', 'UPDATE packages SET weight_kg=? WHERE id=?')
+SET_COORDINATES = Query('set_coordinates', '''
+    UPDATE packages SET pickup_lat=?, pickup_lon=?, delivery_lat=?, delivery_lon=? WHERE id=?
+''')
+UPDATE_PACKAGE = Query('update_package', '''
+    UPDATE packages
+    SET recipient_name=?, recipient_email=?, recipient_address=?, pickup_address=?, distance=?, price=?
+    WHERE id=?
+''')
+DELETE_PACKAGE = Query('delete_package', 'DELETE FROM packages WHERE id=?')
+INSERT_DELIVERY = Query('insert_delivery', '''
+    INSERT INTO deliveries (id, package_id, driver_id, status, created_at) VALUES (?, ?, ?, ?, ?)
+''')
+
+# Per shard, merged by ShardRouter.scatter/gather
+RECENT_PACKAGES = Query('recent_packages', f'''
+    SELECT {PACKAGE_COLUMNS} FROM packages ORDER BY created_at DESC LIMIT 10
+''', Package)
+PACKAGES_BY_STATUS = Query('packages_by_status', f'''
+    SELECT {PACKAGE_COLUMNS} FROM packages WHERE status=? ORDER BY created_at DESC
+''', Package)
+PACKAGE_TOTALS = Query('package_totals', '''
+    SELECT COUNT(*) AS total, SUM(price) AS revenue, SUM(distance) AS distance_sum, COUNT(distance) AS distance_count
+    FROM packages
+''', PackageTotals)
+STATUS_COUNTS = Query('status_counts', 'SELECT status, COUNT(*) AS count FROM packages GROUP BY status', StatusCount)
@@ -0,0 +1,390 @@
+"""Road-network distances from a contraction hierarchy
+
+The road graph is a file of NumPy arrays (ROAD_GRAPH_PATH, written by
+build_road_graph.py from an OpenStreetMap extract): node coordinates and,
+per node, its edges in compressed sparse row form, lengths in metres.
+Building it also contracts the graph: nodes are ranked by importance and
+removed one by one, with shortcut edges added wherever that would lengthen
+a shortest path. What is stored is the hierarchy:
+
+    up      edges from each node to higher-ranked nodes
+    down    edges into each node from higher-ranked nodes (reversed)
+
+A shortest path always climbs then descends in rank, so a query runs two
+small Dijkstra searches that only move up, one from each end, and takes the
+best meeting point. They settle a few hundred nodes whatever the size of the
+network. One-to-many queries search up from the origin once and reuse it
+for every destination.
+
+Points are snapped to the nearest node through a grid index. A point
+further than ROAD_SNAP_MAX_METERS from the network, an unreachable pair, or
+no graph file makes distance_km() return None, and callers fall back to
+straight-line distance. The file is reloaded when it changes (checked
+every ROAD_RELOAD_SECONDS).
+"""
+import heapq
+import os
+import threading
+import time
+import numpy as np
+from geofence import project, METERS_PER_DEG_LAT, METERS_PER_DEG_LON
+
+ROAD_GRAPH_PATH = os.getenv('ROAD_GRAPH_PATH', 'road_graph.npz')
+ROAD_RELOAD_SECONDS = int(os.getenv('ROAD_RELOAD_SECONDS', '300'))
+ROAD_SNAP_MAX_METERS = float(os.getenv('ROAD_SNAP_MAX_METERS', '2000'))
+
+# Snapping grid; a point's nearest node is looked for in widening rings of cells
+SNAP_CELL_METERS = 500.0
+# Nodes a witness search may settle before a shortcut is added anyway
+WITNESS_SETTLE_LIMIT = 60
+EARTH_RADIUS_METERS = 6371000.0
+
+INF = float('inf')
+
+
+def haversine_meters(lat1, lon1, lat2, lon2):
+    """Great-circle distance; works elementwise on arrays"""
+    lat1, lon1, lat2, lon2 = (np.radians(v) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_METERS * np.arcsin(np.sqrt(a))
+
+def to_csr(n, src, dst, weight):
+    """Edge lists to (offsets, targets, weights), edges grouped by source"""
+    src = np.asarray(src, np.int64)
+    order = np.argsort(src, kind='stable')
+    offsets = np.zeros(n + 1, np.int64)
+    np.cumsum(np.bincount(src, minlength=n), out=offsets[1:])
+    return offsets, np.asarray(dst, np.int32)[order], np.asarray(weight, np.float32)[order]
+
+def largest_component(n, src, dst):
+    """Mask of the nodes in the largest weakly connected component"""
+    parent = list(range(n))
+    
+    def find(x):
+        while parent[x] != x:
+            parent[x] = parent[parent[x]]
+            x = parent[x]
+        return x
+    for u, v in zip(np.asarray(src).tolist(), np.asarray(dst).tolist()):
+        ru, rv = find(u), find(v)
+        if ru != rv:
+            parent[ru] = rv
+    roots = np.array([find(x) for x in range(n)])
+    return roots == np.bincount(roots).argmax()
+
+
+def contract(n, src, dst, weight, settle_limit=WITNESS_SETTLE_LIMIT, progress=None):
+    """Contraction hierarchy of a directed graph: (rank, up edges, down edges)
+    
+    Edge lists are (src, dst, weight) triples of arrays. Nodes are taken in
+    order of twice the edge difference (shortcuts added minus edges removed),
+    plus the number of neighbours already contracted and the node's depth in
+    the hierarchy so far, which keep contraction spread out and the
+    hierarchy shallow. Priorities are recomputed lazily when a node reaches
+    the front of the queue.
+    """
+    out = [{} for _ in range(n)]
+    inn = [{} for _ in range(n)]
+    for u, v, w in zip(np.asarray(src).tolist(), np.asarray(dst).tolist(), np.asarray(weight).tolist()):
+        if u != v and w < out[u].get(v, INF):
+            out[u][v] = w
+            inn[v][u] = w
+    
+    def witness_distances(source, skip, targets, limit):
+        """Tentative distances from source avoiding skip, searched as far as limit"""
+        dist = {source: 0.0}
+        heap = [(0.0, source)]
+        remaining, settled = len(targets), 0
+        while heap:
+            d, x = heapq.heappop(heap)
+            if d > dist[x]:
+                continue
+            if d > limit or settled >= settle_limit:
+                break
+            if x in targets:
+                remaining -= 1
+                if not remaining:
+                    break
+            settled += 1
+            for y, w in out[x].items():
+                nd = d + w
+                if y != skip and nd < dist.get(y, INF):
+                    dist[y] = nd
+                    heapq.heappush(heap, (nd, y))
+        return dist
+    
+    def shortcuts(v):
+        found = []
+        for u, wu in inn[v].items():
+            targets = {w: wu + ww for w, ww in out[v].items() if w != u}
+            if not targets:
+                continue
+            dist = witness_distances(u, v, targets, max(targets.values()))
+            found.extend((u, w, d) for w, d in targets.items() if dist.get(w, INF) > d)
+        return found
+    
+    deleted = [0] * n
+    level = [0] * n
+    
+    def priority(v, found):
+        return 2 * (len(found) - len(inn[v]) - len(out[v])) + deleted[v] + level[v]
+    
+    heap = [(priority(v, shortcuts(v)), v) for v in range(n)]
+    heapq.heapify(heap)
+    rank = np.zeros(n, np.int32)
+    up, down = ([], [], []), ([], [], [])
+    order = 0
+    while heap:
+        _, v = heapq.heappop(heap)
+        found = shortcuts(v)
+        current = priority(v, found)
+        if heap and current > heap[0][0]:
+            heapq.heappush(heap, (current, v))
+            continue
+        
+        rank[v] = order
+        order += 1
+        if progress and order % 10000 == 0:
+            progress(order, n)
+        # What is left around v is higher in rank: these edges are the hierarchy
+        for w, d in out[v].items():
+            up[0].append(v), up[1].append(w), up[2].append(d)
+            del inn[w][v]
+        for u, d in inn[v].items():
+            down[0].append(v), down[1].append(u), down[2].append(d)
+            del out[u][v]
+        for u, w, d in found:
+            if d < out[u].get(w, INF):
+                out[u][w] = d
+                inn[w][u] = d
+        for x in out[v].keys() | inn[v].keys():
+            deleted[x] += 1
+            level[x] = max(level[x], level[v] + 1)
+        out[v] = inn[v] = None
+    return rank, up, down
+
+
+class RoadNetwork:
+    """Contracted road graph, its node coordinates and a grid index for snapping"""
+    
+    def __init__(self, lat, lon, up, down):
+        self.lat = np.asarray(lat, np.float64)
+        self.lon = np.asarray(lon, np.float64)
+        self.up = tuple(up)      # (offsets, targets, weights)
+        self.down = tuple(down)
+        # Queries walk the arrays through memoryviews: fast item access, no
+        # per-worker copies of the graph
+        self._up = tuple(memoryview(a) for a in self.up)
+        self._down = tuple(memoryview(a) for a in self.down)
+        self._build_grid()
+    
+    def __len__(self):
+        return len(self.lat)
+    
+    @classmethod
+    def build(cls, lat, lon, src, dst, weight, progress=None):
+        """Contract a graph given as directed edge lists (lengths in metres)"""
+        n = len(lat)
+        _, up, down = contract(n, src, dst, weight, progress=progress)
+        return cls(lat, lon, to_csr(n, *up), to_csr(n, *down))
+    
+    def save(self, path=ROAD_GRAPH_PATH):
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            np.savez(f, lat=self.lat, lon=self.lon,
+                     up_offsets=self.up[0], up_targets=self.up[1], up_weights=self.up[2],
+                     down_offsets=self.down[0], down_targets=self.down[1], down_weights=self.down[2])
+        os.replace(tmp, path)
+    
+    @classmethod
+    def load(cls, path=ROAD_GRAPH_PATH):
+        with np.load(path) as data:
+            return cls(data['lat'], data['lon'],
+                       (data['up_offsets'], data['up_targets'], data['up_weights']),
+                       (data['down_offsets'], data['down_targets'], data['down_weights']))
+    
+    def _build_grid(self):
+        x, y = project(self.lat, self.lon)
+        cx = np.floor_divide(x, SNAP_CELL_METERS).astype(np.int64)
+        cy = np.floor_divide(y, SNAP_CELL_METERS).astype(np.int64)
+        order = np.lexsort((cy, cx))
+        # Nodes sorted by cell; a cell is a (start, end) span of the sorted arrays
+        self._cell_nodes = memoryview(order.astype(np.int64))
+        self._cell_x = memoryview(np.ascontiguousarray(x[order]))
+        self._cell_y = memoryview(np.ascontiguousarray(y[order]))
+        self._cells = {}
+        for i, key in enumerate(zip(cx[order].tolist(), cy[order].tolist())):
+            span = self._cells.get(key)
+            self._cells[key] = (span[0], i + 1) if span else (i, i + 1)
+    
+    def snap(self, lat, lon, max_meters=ROAD_SNAP_MAX_METERS):
+        """(node, metres) of the nearest node, or None beyond max_meters"""
+        x, y = lon * METERS_PER_DEG_LON, lat * METERS_PER_DEG_LAT
+        cx, cy = int(x // SNAP_CELL_METERS), int(y // SNAP_CELL_METERS)
+        xs, ys = self._cell_x, self._cell_y
+        best, best_d2 = None, INF
+        for ring in range(int(max_meters // SNAP_CELL_METERS) + 2):
+            # Nodes in cells beyond this ring are at least (ring - 1) cells away
+            if best is not None and best_d2 <= ((ring - 1) * SNAP_CELL_METERS) ** 2:
+                break
+            for dx in range(-ring, ring + 1):
+                for dy in range(-ring, ring + 1):
+                    if max(abs(dx), abs(dy)) != ring:
+                        continue
+                    span = self._cells.get((cx + dx, cy + dy))
+                    if span is None:
+                        continue
+                    for i in range(*span):
+                        d2 = (xs[i] - x) ** 2 + (ys[i] - y) ** 2
+                        if d2 < best_d2:
+                            best, best_d2 = i, d2
+        if best is None:
+            return None
+        node = self._cell_nodes[best]
+        meters = float(haversine_meters(lat, lon, self.lat[node], self.lon[node]))
+        return (node, meters) if meters <= max_meters else None
+    
+    def _search(self, graph, stall, source, bound=None):
+        """Upward Dijkstra from source; with bound, (settled distances, best meeting) against them"""
+        offsets, targets, weights = graph
+        s_offsets, s_targets, s_weights = stall
+        dist = {source: 0.0}
+        settled = {}
+        heap = [(0.0, source)]
+        best = INF
+        while heap:
+            d, x = heapq.heappop(heap)
+            if d >= best:
+                break
+            if x in settled:
+                continue
+            settled[x] = d
+            # Stall-on-demand: reached more cheaply from a higher node, so no
+            # shortest path runs up through x
+            for i in range(s_offsets[x], s_offsets[x + 1]):
+                dy = dist.get(s_targets[i])
+                if dy is not None and dy + s_weights[i] < d:
+                    break
+            else:
+                if bound is not None:
+                    other = bound.get(x)
+                    if other is not None and d + other < best:
+                        best = d + other
+                for i in range(offsets[x], offsets[x + 1]):
+                    y = targets[i]
+                    nd = d + weights[i]
+                    if nd < dist.get(y, INF):
+                        dist[y] = nd
+                        heapq.heappush(heap, (nd, y))
+        return settled, best
+    
+    def distance(self, source, target):
+        """Shortest path length in metres between two nodes (inf if unreachable)"""
+        if source == target:
+            return 0.0
+        # Both searches advance in turn; each stops once it cannot improve on best
+        graphs = ((self._up, self._down), (self._down, self._up))
+        dists = ({source: 0.0}, {target: 0.0})
+        settled = ({}, {})
+        heaps = ([(0.0, source)], [(0.0, target)])
+        best = INF
+        side = 0
+        while heaps[0] or heaps[1]:
+            side = side ^ 1 if heaps[side ^ 1] else side
+            heap, dist, done, other = heaps[side], dists[side], settled[side], dists[side ^ 1]
+            (offsets, targets, weights), (s_offsets, s_targets, s_weights) = graphs[side]
+            d, x = heapq.heappop(heap)
+            if d >= best:
+                heap.clear()
+                continue
+            if x in done:
+                continue
+            done[x] = d
+            # Stall-on-demand, as in _search
+            for i in range(s_offsets[x], s_offsets[x + 1]):
+                dy = dist.get(s_targets[i])
+                if dy is not None and dy + s_weights[i] < d:
+                    break
+            else:
+                meet = other.get(x)
+                if meet is not None and d + meet < best:
+                    best = d + meet
+                for i in range(offsets[x], offsets[x + 1]):
+                    y = targets[i]
+                    nd = d + weights[i]
+                    if nd < dist.get(y, INF):
+                        dist[y] = nd
+                        heapq.heappush(heap, (nd, y))
+        return best
+    
+    def distances(self, source, targets):
+        """Shortest path lengths in metres from one node to many"""
+        forward, _ = self._search(self._up, self._down, source)
+        return [0.0 if t == source else self._search(self._down, self._up, t, bound=forward)[1]
+                for t in targets]
+    
+    def route_meters(self, origin, destinations):
+        """Road distance from (lat, lon) to each (lat, lon), None where there is none"""
+        start = self.snap(*origin)
+        ends = [self.snap(*d) for d in destinations]
+        if start is None:
+            return [None] * len(destinations)
+        reachable = [i for i, end in enumerate(ends) if end is not None]
+        lengths = self.distances(start[0], [ends[i][0] for i in reachable])
+        result = [None] * len(destinations)
+        for i, length in zip(reachable, lengths):
+            if length == INF:
+                continue
+            if ends[i][0] == start[0]:
+                # Both ends snap to one junction: the graph says nothing about the gap
+                result[i] = float(haversine_meters(*origin, *destinations[i]))
+            else:
+                result[i] = start[1] + length + ends[i][1]
+        return result
+
+
+class NetworkLoader:
+    """Current road network (None without a graph file), reloaded when the file changes"""
+    
+    def __init__(self, path=ROAD_GRAPH_PATH):
+        self.path = path
+        self._network = None
+        self._mtime = None
+        self._checked_at = 0
+        self._lock = threading.Lock()
+    
+    def get(self):
+        if time.time() - self._checked_at >= ROAD_RELOAD_SECONDS:
+            with self._lock:
+                if time.time() - self._checked_at >= ROAD_RELOAD_SECONDS:
+                    self._reload()
+        return self._network
+    
+    def _reload(self):
+        self._checked_at = time.time()
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            self._network = RoadNetwork.load(self.path)
+            self._mtime = mtime
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Road graph reload failed: {e}")
+
+
+loader = NetworkLoader()
+# Load at import, so gunicorn's preloaded master shares the graph with workers
+loader.get()
+
+def distance_km(origin, destination):
+    """Road distance between (lat, lon) pairs in km, None to fall back to straight line"""
+    return distances_km(origin, [destination])[0]
+
+def distances_km(origin, destinations):
+    network = loader.get()
+    if network is None:
+        return [None] * len(destinations)
+    return [m / 1000 if m is not None else None for m in network.route_meters(origin, destinations)]
@@ -0,0 +1,102 @@
+"""Full-text package search over recipient names, emails and addresses"""
+import re
+from db_config import DB_TYPE, router
+
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+SEARCH_COLUMNS = '''p.id, p.tracking_id, p.sender_id, p.recipient_name, p.recipient_email,
+               p.recipient_address, p.pickup_address, p.status, p.distance, p.price,
+               p.driver_id, p.created_at'''
+
+# Only the newest matches are scored. Ranking every hit for a common name
+# or EIRCODE costs time proportional to the match count; the candidate cap
+# keeps a query bounded however large the table grows.
+SEARCH_CANDIDATES = 1000
+
+# One ranked list per query: every prefix match is a candidate, whole-word
+# matches rank above prefix-only ones, and id breaks ties so each row has a
+# fixed place and pages neither repeat nor skip rows. Shards are merged on
+# the same keys (SEARCH_ORDER, all descending).
+SEARCH_ORDER = ('whole_word', 'score', 'created_at', 'id')
+
+if DB_TYPE == 'postgres':
+    SEARCH_SQL = f'''
+        SELECT {SEARCH_COLUMNS}, c.whole_word, ts_rank(p.search_vector, to_tsquery('simple', ?)) AS score
+        FROM (
+            SELECT id, search_vector @@ to_tsquery('simple', ?) AS whole_word FROM packages
+            WHERE search_vector @@ to_tsquery('simple', ?)
+            ORDER BY whole_word DESC, created_at DESC
+            LIMIT {SEARCH_CANDIDATES}
+        ) c JOIN packages p ON p.id = c.id
+        ORDER BY c.whole_word DESC, score DESC, p.created_at DESC, p.id DESC
+        LIMIT ?
+    '''
+else:
+    # bm25 is lower-is-better; negate it so both dialects return a score
+    # where higher is better and shards can be merged on it. Columns are
+    # weighted name, email, delivery address, pickup address.
+    SEARCH_SQL = f'''
+        SELECT {SEARCH_COLUMNS}, c.whole_word, -c.bm AS score
+        FROM (
+            SELECT rowid, rowid IN (SELECT rowid FROM packages_fts WHERE packages_fts MATCH ?) AS whole_word,
+                   bm25(packages_fts, 4.0, 4.0, 1.0, 0.5) AS bm
+            FROM packages_fts
+            WHERE packages_fts MATCH ?
+            ORDER BY whole_word DESC, rowid DESC
+            LIMIT {SEARCH_CANDIDATES}
+        ) c JOIN packages p ON p.rowid = c.rowid
+        ORDER BY c.whole_word DESC, c.bm, p.created_at DESC, p.id DESC
+        LIMIT ?
+    '''
+
+def tokenize(query):
+    """Split free text into lowercase alphanumeric terms
+    
+    Emails and EIRCODEs are broken up the same way the index tokenizes
+    them, so "jane@ex" matches jane@example.com.
+    """
+    return [t for t in re.split(r'[^0-9a-z]+', (query or '').lower()) if t]
+
+def compile_match(terms, prefix=True):
+    """Build a dialect-specific query requiring every term"""
+    if DB_TYPE == 'postgres':
+        return ' & '.join(f"{t}:*" if prefix else t for t in terms)
+    return ' AND '.join(f'"{t}"*' if prefix else f'"{t}"' for t in terms)
+
+def search_packages(query, page=1, per_page=DEFAULT_PAGE_SIZE):
+    """Return one page of ranked matches with its paging info
+    
+    Every shard returns its best page * per_page + 1 hits; the router merges
+    them by score and the requested page is sliced from the merged list.
+    Paging stops at SEARCH_CANDIDATES matches per shard.
+    
+    Every page comes from the same ordering (SEARCH_ORDER): whole-word
+    matches first, then matches on a prefix of a term.
+    """
+    page = max(page, 1)
+    per_page = min(max(per_page, 1), MAX_PAGE_SIZE)
+    terms = tokenize(query)
+    if not terms:
+        return {'page': page, 'per_page': per_page, 'has_more': False, 'results': []}
+    
+    offset = (page - 1) * per_page
+    wanted = offset + per_page + 1
+    
+    whole_word, prefix = compile_match(terms, prefix=False), compile_match(terms)
+    if DB_TYPE == 'postgres':
+        params = (prefix, whole_word, prefix, wanted)
+    else:
+        params = (whole_word, prefix, wanted)
+    rows = router.gather(SEARCH_SQL, params, order_by=SEARCH_ORDER, limit=wanted)
+    
+    results = rows[offset:offset + per_page]
+    for row in results:
+        del row['whole_word']
+        row['score'] = float(row['score'])
+    return {
+        'page': page,
+        'per_page': per_page,
+        'has_more': len(rows) > offset + per_page,
+        'results': results
+    }
@@ -0,0 +1,68 @@
+#!/bin/bash
+# Start, gracefully reload or stop the production server (gunicorn)
+#   ./serve.sh start    start in the background (logs: app.log)
+#   ./serve.sh reload   zero-downtime reload with the current code
+#   ./serve.sh stop     finish in-flight requests, then stop
+# With ASGI=1 the asyncio app (asgi_app.py) is served instead of app.py
+
+set -e
+
+PIDFILE=${GUNICORN_PIDFILE:-gunicorn.pid}
+APP_MODULE=app:app
+if [ "$ASGI" = "1" ]; then
+    APP_MODULE=asgi_app:app
+fi
+
+running() {
+    [ -f "$1" ] && kill -0 "$(cat "$1")" 2>/dev/null
+}
+
+case "$1" in
+    start)
+        if running "$PIDFILE"; then
+            echo "Already running (PID: $(cat "$PIDFILE"))"
+            exit 0
+        fi
+        nohup gunicorn -c gunicorn.conf.py "$APP_MODULE" >> app.log 2>&1 &
+        sleep 3
+        if running "$PIDFILE"; then
+            echo "✓ Application started (PID: $(cat "$PIDFILE"))"
+        else
+            echo "✗ Application failed to start. Check app.log for errors."
+            exit 1
+        fi
+        ;;
+    reload)
+        if ! running "$PIDFILE"; then
+            exec "$0" start
+        fi
+        OLD_PID=$(cat "$PIDFILE")
+        # USR2 forks a new master that loads the new code and writes
+        # $PIDFILE.2; it takes over $PIDFILE once the old master exits
+        kill -USR2 "$OLD_PID"
+        for _ in $(seq 1 30); do
+            if running "$PIDFILE.2"; then
+                break
+            fi
+            sleep 1
+        done
+        if ! running "$PIDFILE.2"; then
+            echo "✗ New master did not start; old workers still serving. Check app.log."
+            exit 1
+        fi
+        NEW_PID=$(cat "$PIDFILE.2")
+        # TERM lets the old workers finish their in-flight requests
+        kill -TERM "$OLD_PID"
+        echo "✓ Reloaded (PID: $NEW_PID, retired: $OLD_PID)"
+        ;;
+    stop)
+        if running "$PIDFILE"; then
+            kill -TERM "$(cat "$PIDFILE")"
+            echo "✓ Stopping (PID: $(cat "$PIDFILE"))"
+        fi
+        ;;
+    *)
+        echo "Usage: $0 {start|reload|stop}"
+        exit 1
+        ;;
+esac
@@ -0,0 +1,30 @@
+"""Grant or change a user's role (e.g. admin, for the slow request endpoints)
+
+Usage:
+    python3 set_user_role.py user@example.com admin
+    python3 set_user_role.py user@example.com customer    # take it away again
+
+Registration always creates users with the customer role; this is the only
+way to give anyone another one. Workers see a new role within
+AUTH_USER_CACHE_TTL seconds; a removed admin role stops working at once.
+"""
+import argparse
+from db_config import router
+import repository
+
+def main():
+    parser = argparse.ArgumentParser(description="Set a user's role")
+    parser.add_argument('email')
+    parser.add_argument('role')
+    args = parser.parse_args()
+    
+    conn = router.connect(router.home_shard)
+    updated = repository.SET_USER_ROLE.run(conn, (args.role, args.email))
+    conn.commit()
+    conn.close()
+    if not updated:
+        raise SystemExit(f"No user registered as {args.email}")
+    print(f"{args.email} now has the {args.role} role")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+"""Precompressed, fingerprinted static assets
+
+build_assets.py minifies the UI (static/index.html) into static/dist/: the
+inline <style> and <script> blocks are moved to content-hashed files
+(app.<hash>.css, app.<hash>.js) and every file gets .gz and .br variants
+compressed once at the highest level. The server then picks a variant from
+Accept-Encoding instead of compressing per request:
+
+    /                  dist/index.html, revalidated on each load (ETag -> 304)
+    /static/dist/...   fingerprinted, cached as immutable for a year
+
+Without a build the UI is served from static/ as before. JSON API responses
+of COMPRESS_MIN_BYTES or more are gzip-compressed on the fly.
+"""
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+from flask import request, Response, send_from_directory
+
+STATIC_DIR = 'static'
+DIST_DIR = os.path.join(STATIC_DIR, 'dist')
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', '1024'))
+COMPRESS_LEVEL = int(os.getenv('COMPRESS_LEVEL', '6'))
+
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'no-cache'
+# Preferred first when the client accepts both at the same quality
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))
+
+
+# --- Build ------------------------------------------------------------------
+
+def minify_css(text):
+    text = re.sub(r'/\*.*?\*/', '', text, flags=re.S)
+    text = re.sub(r'\s+', ' ', text)
+    text = re.sub(r'\s*([{};,>])\s*', r'\1', text)
+    text = re.sub(r':\s+', ':', text)
+    return text.replace(';}', '}').strip()
+
+def minify_js(text):
+    """Strip indentation, blank lines and whole-line comments
+    
+    Line breaks are kept so automatic semicolon insertion still applies.
+    """
+    lines = (line.strip() for line in text.splitlines())
+    return '\n'.join(line for line in lines if line and not line.startswith('//'))
+
+def minify_html(text):
+    text = re.sub(r'<!--.*?-->', '', text, flags=re.S)
+    lines = (line.strip() for line in text.splitlines())
+    return '\n'.join(line for line in lines if line)
+
+def _brotli():
+    try:
+        import brotli
+    except ImportError:
+        return None
+    return brotli
+
+def _fingerprint(data):
+    return hashlib.sha256(data).hexdigest()[:12]
+
+def _write(target, name, data):
+    """Write a file and its compressed variants; returns the encodings written"""
+    encodings = {'gzip': gzip.compress(data, 9, mtime=0)}
+    brotli = _brotli()
+    if brotli is not None:
+        encodings['br'] = brotli.compress(data, quality=11)
+    files = [(name, data)] + [(name + suffix, encodings[e]) for e, suffix in ENCODINGS if e in encodings]
+    for filename, payload in files:
+        path = os.path.join(target, filename)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(payload)
+        os.replace(path + '.tmp', path)
+    return sorted(encodings)
+
+def build(source=STATIC_DIR, target=DIST_DIR):
+    """Minify and fingerprint the UI into target; returns the manifest
+    
+    Files from earlier builds are left in place so pages loaded before a
+    deploy can still fetch the assets they reference.
+    """
+    with open(os.path.join(source, 'index.html'), encoding='utf-8') as f:
+        html = f.read()
+    os.makedirs(target, exist_ok=True)
+    manifest = {}
+    
+    def bundle(tag, ext, minify, reference):
+        nonlocal html
+        pattern = re.compile(rf'<{tag}>(.*?)</{tag}>', re.S)
+        blocks = pattern.findall(html)
+        if not blocks:
+            return
+        data = minify('\n'.join(blocks)).encode('utf-8')
+        etag = _fingerprint(data)
+        name = f"app.{etag}.{ext}"
+        manifest[name] = {'etag': etag, 'encodings': _write(target, name, data)}
+        # The bundle takes the place of the first block; the others are dropped
+        html = pattern.sub('', pattern.sub(reference.format(f"/static/dist/{name}"), html, count=1))
+    
+    bundle('style', 'css', minify_css, '<link rel="stylesheet" href="{}">')
+    bundle('script', 'js', minify_js, '<script src="{}"></script>')
+    
+    data = minify_html(html).encode('utf-8')
+    manifest['index.html'] = {'etag': _fingerprint(data), 'encodings': _write(target, 'index.html', data)}
+    
+    # Written last: a server never sees a manifest naming files not yet on disk
+    path = os.path.join(target, 'manifest.json')
+    with open(path + '.tmp', 'w') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(path + '.tmp', path)
+    return manifest
+
+
+# --- Serving ----------------------------------------------------------------
+
+_assets = None
+
+def load(target=DIST_DIR):
+    """Read the built files and their variants into memory ({} without a build)"""
+    global _assets
+    assets = {}
+    path = os.path.join(target, 'manifest.json')
+    if os.path.exists(path):
+        with open(path) as f:
+            manifest = json.load(f)
+        for name, info in manifest.items():
+            variants = {}
+            for encoding, suffix in (('identity', ''),) + ENCODINGS:
+                if encoding == 'identity' or encoding in info['encodings']:
+                    with open(os.path.join(target, name + suffix), 'rb') as f:
+                        variants[encoding] = f.read()
+            assets[name] = {
+                'etag': info['etag'],
+                'mimetype': mimetypes.guess_type(name)[0] or 'application/octet-stream',
+                'variants': variants
+            }
+    _assets = assets
+    return assets
+
+def get_assets():
+    return _assets if _assets is not None else load()
+
+def choose_encoding(available):
+    """Best encoding in available that the request's Accept-Encoding allows"""
+    accepted = request.accept_encodings
+    best, best_quality = 'identity', 0
+    for encoding, _ in ENCODINGS:
+        quality = accepted[encoding]
+        if encoding in available and quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+def _send(name, cache_control):
+    asset = get_assets()[name]
+    encoding = choose_encoding(asset['variants'])
+    resp = Response(asset['variants'][encoding], mimetype=asset['mimetype'])
+    if encoding != 'identity':
+        resp.headers['Content-Encoding'] = encoding
+    resp.vary.add('Accept-Encoding')
+    resp.headers['Cache-Control'] = cache_control
+    # One ETag per representation, so caches never mix up encodings
+    resp.set_etag(f"{asset['etag']}-{encoding}")
+    return resp.make_conditional(request)
+
+def send_index():
+    if 'index.html' in get_assets():
+        return _send('index.html', REVALIDATE)
+    return send_from_directory(STATIC_DIR, 'index.html')
+
+def send_static(path):
+    name = path[len('dist/'):] if path.startswith('dist/') else None
+    if name and name in get_assets():
+        return _send(name, REVALIDATE if name == 'index.html' else IMMUTABLE)
+    return send_from_directory(STATIC_DIR, path)
+
+def compress_response(resp):
+    """after_request hook: gzip JSON responses of COMPRESS_MIN_BYTES or more"""
+    if (resp.mimetype != 'application/json' or resp.direct_passthrough or resp.is_streamed
+            or 'Content-Encoding' in resp.headers or resp.status_code in (204, 304)):
+        return resp
+    data = resp.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return resp
+    resp.vary.add('Accept-Encoding')
+    if request.accept_encodings['gzip'] <= 0:
+        return resp
+    resp.set_data(gzip.compress(data, COMPRESS_LEVEL))
+    resp.headers['Content-Encoding'] = 'gzip'
+    return resp
+
+def init_app(app):
+    # Loaded at import, so gunicorn's preloaded master shares it with workers
+    load()
+    app.after_request(compress_response)
@@ -0,0 +1,26 @@
+import admission
+import auth
+from admission import LocalTokenBuckets, PRIORITY_CLASSES
+
+
+def test_junk_tokens_share_the_client_address_bucket(monkeypatch):
+    monkeypatch.setattr(admission, 'buckets', LocalTokenBuckets())
+    burst = PRIORITY_CLASSES['bulk']['burst']
+    for i in range(burst):
+        client = admission.client_key(f'Bearer junk-{i}', None, '203.0.113.7')
+        assert client == 'ip:203.0.113.7'
+        assert admission.check('register', client) is None
+        admission.limiter.release('register')
+
+    status, _, retry_after = admission.check('register', admission.client_key('Bearer junk-new', None, '203.0.113.7'))
+    assert status == 429 and retry_after > 0
+    # Another address still has its own bucket
+    assert admission.check('register', admission.client_key('Bearer junk-new', None, '203.0.113.8')) is None
+    admission.limiter.release('register')
+
+def test_verified_tokens_are_keyed_on_the_user(monkeypatch):
+    user = {'id': 'user-1', 'role': 'customer'}
+    monkeypatch.setattr(auth, 'verify', lambda header: (user, {}, None) if header else (None, None, None))
+    assert admission.client_key('Bearer one', None, '203.0.113.7') == 'user:user-1'
+    assert admission.client_key('Bearer two', None, '198.51.100.1') == 'user:user-1'
+    assert admission.client_key('', None, '203.0.113.7') == 'ip:203.0.113.7'
@@ -0,0 +1,58 @@
+import json
+import zlib
+import pytest
+import archive
+from archive import ArchiveIndex, BloomFilter, LocalArchiveStore, PACKAGE_COLUMNS, encode_columns
+
+
+class CountingStore(LocalArchiveStore):
+    def __init__(self, root):
+        super().__init__(root)
+        self.gets = 0
+    
+    def get(self, key):
+        self.gets += 1
+        return super().get(key)
+
+
+def write_partitions(store, count, bloom_files=True):
+    for day in range(count):
+        partition = f"date=2024-{day // 28 + 1:02d}-{day % 28 + 1:02d}"
+        rows = [{'id': f'id-{day}-{i}', 'tracking_id': f'TRK{day:04d}{i:04d}'} for i in range(20)]
+        index = {'tracking_id': [r['tracking_id'] for r in rows], 'id': [r['id'] for r in rows]}
+        store.put(f"{partition}/packages-r.col", encode_columns(PACKAGE_COLUMNS, rows))
+        store.put(f"{partition}/packages-r.idx", zlib.compress(json.dumps(index).encode('utf-8')))
+        # Older archives have no .bloom files; their filters are built from the .idx
+        if bloom_files and day % 2:
+            store.put(f"{partition}/packages-r.bloom", BloomFilter.for_index(index).to_bytes())
+
+def test_unknown_keys_read_nothing_with_more_partitions_than_the_cache(tmp_path):
+    store = CountingStore(str(tmp_path))
+    write_partitions(store, 100)
+    index = ArchiveIndex(store, max_partitions=8)
+    assert index.lookup('tracking_id', 'TRK00000001')['id'] == 'id-0-1'
+    
+    store.gets = 0
+    for i in range(200):
+        assert index.lookup('tracking_id', f'TRKMISSING{i:04d}') is None
+        assert index.lookup('id', f'missing-{i}') is None
+    # Only Bloom filter false positives (about 0.05% per partition) fetch an index
+    assert store.gets < 0.005 * 400 * 100
+
+def test_found_key_reads_its_index_and_columns_once(tmp_path):
+    store = CountingStore(str(tmp_path))
+    write_partitions(store, 100)
+    index = ArchiveIndex(store, max_partitions=8)
+    index.lookup('id', 'warm-up')
+    
+    store.gets = 0
+    package = index.lookup('id', 'id-37-5')
+    assert package['tracking_id'] == 'TRK00370005' and package['archived']
+    assert store.gets <= 4
+
+def test_filters_still_loading_answer_unavailable(tmp_path, monkeypatch):
+    store = CountingStore(str(tmp_path))
+    write_partitions(store, 10)
+    monkeypatch.setattr(archive, 'ARCHIVE_LOOKUP_TIMEOUT', -1)
+    with pytest.raises(archive.ArchiveUnavailable):
+        ArchiveIndex(store).lookup('id', 'id-1-1')
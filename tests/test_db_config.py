@@ -0,0 +1,56 @@
+import sqlite3
+import db_config
+import repository
+
+FIELDS = ('sender', 'Recipient', 'r@example.com', 'Dublin', 'Cork', 'pending', 1.0, 5.0, None,
+          '2024-01-01T00:00:00', None, None, None, None, 1.0)
+
+
+def tracking_index(path):
+    conn = sqlite3.connect(path)
+    try:
+        return conn.execute("SELECT sql FROM sqlite_master WHERE name='idx_packages_tracking_id_unique'").fetchone()[0]
+    finally:
+        conn.close()
+
+def insert(path, package_id, tracking_id):
+    conn = db_config.get_db_connection(path)
+    try:
+        inserted = repository.INSERT_PACKAGE.run(conn, (package_id, tracking_id) + FIELDS)
+        conn.commit()
+        return inserted
+    finally:
+        conn.close()
+
+def test_partial_tracking_index_becomes_full_once_duplicates_are_gone(tmp_path):
+    path = str(tmp_path / 'shard.db')
+    db_config.init_shard(path)
+    # An older database: plain index and duplicate legacy tracking IDs
+    conn = sqlite3.connect(path)
+    conn.execute('DROP INDEX idx_packages_tracking_id_unique')
+    conn.execute('CREATE INDEX idx_packages_tracking_id ON packages (tracking_id)')
+    conn.execute("INSERT INTO packages (id, tracking_id) VALUES ('a', 'TRK0000ABCD'), ('b', 'TRK0000ABCD')")
+    conn.commit()
+    conn.close()
+
+    db_config.init_shard(path)
+    assert 'WHERE' in tracking_index(path).upper()
+    assert insert(path, 'c', 'TRK0000ABCD') == 1
+    # Still partial while the duplicates remain
+    db_config.init_shard(path)
+    assert 'WHERE' in tracking_index(path).upper()
+
+    conn = sqlite3.connect(path)
+    conn.execute("DELETE FROM packages WHERE id IN ('b', 'c')")
+    conn.commit()
+    conn.close()
+    db_config.init_shard(path)
+    assert 'WHERE' not in tracking_index(path).upper()
+    conn = sqlite3.connect(path)
+    assert conn.execute("SELECT 1 FROM sqlite_master WHERE name='idx_packages_tracking_id'").fetchone() is None
+    conn.close()
+
+    # INSERT_PACKAGE's conflict target still matches the full index
+    assert insert(path, 'd', 'TRK0000ABCD') == 0
+    assert insert(path, 'e', 'ABCDEFGH12345678') == 1
+    assert insert(path, 'f', 'ABCDEFGH12345678') == 0
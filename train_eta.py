@@ -0,0 +1,29 @@
+"""Learn the ETA travel-time tables from completed deliveries
+
+Usage:
+    python3 train_eta.py [--days 90] [--min-samples 5]
+
+Writes ETA_MODEL_PATH (default ./eta_model.npz); running servers pick it up
+within ETA_RELOAD_SECONDS. Schedule it nightly, e.g. from cron.
+"""
+import argparse
+import numpy as np
+from eta import ETA_MODEL_PATH, ETA_MIN_SAMPLES, ETA_TRAINING_DAYS, train
+
+def main():
+    parser = argparse.ArgumentParser(description='Train the delivery ETA tables')
+    parser.add_argument('--days', type=int, default=ETA_TRAINING_DAYS,
+                        help='Learn from packages created in the last this many days')
+    parser.add_argument('--min-samples', type=int, default=ETA_MIN_SAMPLES,
+                        help='Deliveries needed before a zone/hour cell is trusted')
+    args = parser.parse_args()
+    
+    model, history = train(days=args.days, min_samples=args.min_samples)
+    filled = np.count_nonzero(~np.isnan(model.travel))
+    print(f"Learned from {len(history)} delivered packages across {len(model.zones)} zones")
+    print(f"Zone/hour cells with data: {filled} of {model.travel.size}")
+    print(f"Distance fallback: {model.base / 60:.0f} min + {model.per_km / 60:.1f} min/km")
+    print(f"Saved to {ETA_MODEL_PATH}")
+
+if __name__ == '__main__':
+    main()